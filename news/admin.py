@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
-from .models import Article, CustomUser, Newsletter, Publisher
+from .models import Article, CustomUser, Job, Newsletter, Publisher
 
 
 @admin.register(CustomUser)
@@ -13,4 +13,10 @@ class CustomUserAdmin(UserAdmin):
 
 admin.site.register(Publisher)
 admin.site.register(Article)
-admin.site.register(Newsletter)
\ No newline at end of file
+admin.site.register(Newsletter)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "status", "attempts", "run_after", "locked_by")
+    list_filter = ("status", "kind")
\ No newline at end of file
@@ -1,4 +1,6 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class NewsConfig(AppConfig):
@@ -6,4 +8,8 @@ class NewsConfig(AppConfig):
     name = "news"
 
     def ready(self):
+        import news.middleware
         import news.signals
+
+        post_migrate.connect(news.signals.create_groups_and_permissions, sender=self)
+        connection_created.connect(news.middleware.install_query_observer, dispatch_uid="news.query_observer")
@@ -0,0 +1,206 @@
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from .models import Article, CustomUser, Newsletter, Publisher
+
+BENCH_PREFIX = "bench-"
+
+# A fixed made-up vocabulary, drawn with Zipf-like weights, so benchmark
+# text has common and rare words the way real articles do.
+_SYLLABLES = ("ka", "lo", "mi", "ner", "sta", "vi", "dor", "pen", "tu", "gra", "shi", "bel")
+VOCABULARY = [a + b + c for a in _SYLLABLES for b in _SYLLABLES for c in _SYLLABLES]
+_WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+
+
+def bench_text(words):
+    """
+    Returns ``words`` random vocabulary words.
+    """
+    return " ".join(random.choices(VOCABULARY, _WEIGHTS, k=words))
+
+
+@contextmanager
+def explicit_created_at(*models):
+    """
+    Lets bulk inserts set ``created_at`` instead of having it forced to now.
+    """
+    fields = [model._meta.get_field("created_at") for model in models]
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, saved):
+            field.auto_now_add = value
+
+
+def ensure_publishers(count, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the ids of ``count`` benchmark publishers, creating any missing.
+    """
+    names = [f"{BENCH_PREFIX}publisher-{i}" for i in range(count)]
+    existing = set(Publisher.objects.using(using).filter(name__in=names).values_list("name", flat=True))
+    Publisher.objects.using(using).bulk_create(
+        [Publisher(name=name) for name in names if name not in existing],
+        batch_size=1000,
+    )
+    return list(Publisher.objects.using(using).filter(name__in=names).values_list("id", flat=True))
+
+
+def ensure_users(role, count, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the ids of ``count`` benchmark users with ``role``, creating any missing.
+    """
+    names = [f"{BENCH_PREFIX}{role}-{i}" for i in range(count)]
+    existing = set(CustomUser.objects.using(using).filter(username__in=names).values_list("username", flat=True))
+    password = make_password(None)
+    CustomUser.objects.using(using).bulk_create(
+        [CustomUser(username=name, role=role, password=password) for name in names if name not in existing],
+        batch_size=1000,
+    )
+    return list(CustomUser.objects.using(using).filter(username__in=names).values_list("id", flat=True))
+
+
+def powerlaw_count(alpha, maximum):
+    """
+    Returns a count >= 1 from a Pareto distribution, capped at ``maximum``.
+    """
+    return min(maximum, int(random.paretovariate(alpha)))
+
+
+def seed_subscriptions(reader_ids, publisher_ids, journalist_ids, alpha=1.5, maximum=50, batch_size=5000):
+    """
+    Subscribes each reader to a power-law number of sources.
+
+    Most readers follow one or two sources and a few follow dozens; popular
+    publishers and journalists (the first ids) get most of the subscribers.
+    Returns the number of subscription rows written.
+    """
+    publisher_through = CustomUser.subscribed_publishers.through
+    journalist_through = CustomUser.subscribed_journalists.through
+    publisher_weights = [1 / rank for rank in range(1, len(publisher_ids) + 1)]
+    journalist_weights = [1 / rank for rank in range(1, len(journalist_ids) + 1)]
+
+    publisher_rows = []
+    journalist_rows = []
+    written = 0
+
+    def flush():
+        publisher_through.objects.bulk_create(publisher_rows, batch_size=batch_size, ignore_conflicts=True)
+        journalist_through.objects.bulk_create(journalist_rows, batch_size=batch_size, ignore_conflicts=True)
+        return len(publisher_rows) + len(journalist_rows)
+
+    for reader_id in reader_ids:
+        count = powerlaw_count(alpha, maximum)
+        publishers = min(len(publisher_ids), (count + 1) // 2)
+        journalists = min(len(journalist_ids), count - publishers)
+
+        for publisher_id in set(random.choices(publisher_ids, publisher_weights, k=publishers)):
+            publisher_rows.append(publisher_through(customuser_id=reader_id, publisher_id=publisher_id))
+        for journalist_id in set(random.choices(journalist_ids, journalist_weights, k=journalists)):
+            journalist_rows.append(journalist_through(from_customuser_id=reader_id, to_customuser_id=journalist_id))
+
+        if len(publisher_rows) + len(journalist_rows) >= batch_size:
+            written += flush()
+            publisher_rows, journalist_rows = [], []
+
+    written += flush()
+    return written
+
+
+def seed_articles(
+    count,
+    publisher_ids,
+    journalist_ids,
+    approved_ratio=0.9,
+    days=3 * 365,
+    batch_size=5000,
+    progress=None,
+    using=DEFAULT_DB_ALIAS,
+):
+    """
+    Bulk inserts ``count`` articles spread over the last ``days`` days.
+    """
+    now = timezone.now()
+    span = days * 24 * 3600
+    created = 0
+
+    with explicit_created_at(Article):
+        while created < count:
+            size = min(batch_size, count - created)
+            batch = [
+                Article(
+                    title=f"Benchmark article {created + i} {bench_text(4)}",
+                    content=bench_text(120),
+                    publisher_id=random.choice(publisher_ids),
+                    journalist_id=random.choice(journalist_ids),
+                    approved=random.random() < approved_ratio,
+                    created_at=now - timedelta(seconds=random.randint(0, span)),
+                )
+                for i in range(size)
+            ]
+            Article.objects.using(using).bulk_create(batch, batch_size=batch_size)
+            created += size
+            if progress:
+                progress(created)
+
+    return created
+
+
+def seed_newsletters(count, publisher_ids, journalist_ids, days=3 * 365, batch_size=5000, using=DEFAULT_DB_ALIAS):
+    """
+    Bulk inserts ``count`` newsletters spread over the last ``days`` days.
+    """
+    now = timezone.now()
+    span = days * 24 * 3600
+
+    with explicit_created_at(Newsletter):
+        for start in range(0, count, batch_size):
+            Newsletter.objects.using(using).bulk_create(
+                [
+                    Newsletter(
+                        title=f"Benchmark newsletter {start + i}",
+                        content=bench_text(120),
+                        publisher_id=random.choice(publisher_ids),
+                        journalist_id=random.choice(journalist_ids),
+                        created_at=now - timedelta(seconds=random.randint(0, span)),
+                    )
+                    for i in range(min(batch_size, count - start))
+                ],
+                batch_size=batch_size,
+            )
+
+    return count
+
+
+def time_call(fn, repeat):
+    """
+    Calls ``fn`` ``repeat`` times and returns each duration in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(timings):
+    """
+    Returns p50/p95/max of a list of millisecond timings.
+    """
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "p50_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(p95, 3),
+        "max_ms": round(ordered[-1], 3),
+    }
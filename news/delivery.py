@@ -0,0 +1,211 @@
+import os
+import smtplib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Max
+
+from . import metrics
+from .models import CustomUser, EmailBatch
+from .subscriptions import subscriber_ids
+
+
+class DeliveryError(Exception):
+    """
+    Raised when a batch of emails could not be sent.
+    """
+
+
+def _connection_lost(exc):
+    """
+    True for errors that end the SMTP session rather than concern one
+    message. smtplib's errors are OSErrors too, so check those first.
+    """
+    if isinstance(
+        exc,
+        (
+            smtplib.SMTPServerDisconnected,
+            smtplib.SMTPConnectError,
+            smtplib.SMTPHeloError,
+            smtplib.SMTPAuthenticationError,
+        ),
+    ):
+        return True
+    return isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPException)
+
+
+def subscriber_addresses(article, after_id=0):
+    """
+    Yields (user id, email) for an article's subscribers in id order.
+    """
+    # Read fresh: a worker's cached sets may predate a subscription change
+    # made in another process.
+    ids = subscriber_ids(article.publisher_id, article.journalist_id, cached=False)
+    return _addresses(pk for pk in ids if pk > after_id)
+
+
+def _addresses(user_ids):
+    ids = sorted(user_ids)
+    for start in range(0, len(ids), 1000):
+        rows = (
+            CustomUser.objects.filter(pk__in=ids[start:start + 1000])
+            .exclude(email="")
+            .order_by("id")
+            .values_list("id", "email")
+        )
+        yield from rows.iterator(chunk_size=1000)
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def new_delivery():
+    """
+    Returns a key for one send of a message. Pass the same key when
+    retrying that send so it resumes; a new send needs a new key.
+    """
+    return uuid.uuid4().hex
+
+
+def _deliver(anchor, delivery, recipients, build_message, from_email):
+    """
+    Sends the message ``build_message(user_id, address)`` to each recipient,
+    recording the batches under ``delivery`` against the ``anchor`` article.
+
+    Messages go out one by one, so a refused or malformed address is only
+    recorded in its batch's ``failures``. Losing the connection ends the
+    delivery: what was sent of the batch is recorded as done, the rest as
+    failed, and DeliveryError is raised.
+    """
+    from_email = from_email or os.environ.get("DEFAULT_FROM_EMAIL") or "webmaster@localhost"
+    batch_size = getattr(settings, "EMAIL_BATCH_SIZE", 100)
+    rate = getattr(settings, "EMAIL_RATE_LIMIT", 0)
+
+    sent_total = 0
+    connection = None
+    try:
+        for batch in _batches(recipients, batch_size):
+            if connection is None:
+                connection = get_connection()
+                connection.open()
+
+            started = time.monotonic()
+            sent = 0
+            failures = []
+            error = ""
+            handled = 0
+            for user_id, address in batch:
+                try:
+                    subject, body = build_message(user_id, address)
+                    message = EmailMessage(subject, body, from_email, [address], connection=connection)
+                    if connection.send_messages([message]):
+                        sent += 1
+                    else:
+                        failures.append({"recipient": user_id, "error": "Not sent."})
+                except Exception as exc:
+                    if _connection_lost(exc):
+                        error = f"{type(exc).__name__}: {exc}"
+                        break
+                    failures.append({"recipient": user_id, "error": f"{type(exc).__name__}: {exc}"})
+                handled += 1
+
+            elapsed = time.monotonic() - started
+            if handled:
+                EmailBatch.objects.create(
+                    article=anchor,
+                    delivery=delivery,
+                    first_recipient_id=batch[0][0],
+                    last_recipient_id=batch[handled - 1][0],
+                    recipients=handled,
+                    sent=sent,
+                    failures=failures,
+                    duration_ms=int(elapsed * 1000),
+                )
+            metrics.EMAILS.inc(sent, result="sent")
+            metrics.EMAILS.inc(len(failures), result="failed")
+            sent_total += sent
+
+            if error:
+                # Resumed from here: the recipients before it are done.
+                rest = batch[handled:]
+                EmailBatch.objects.create(
+                    article=anchor,
+                    delivery=delivery,
+                    first_recipient_id=rest[0][0],
+                    last_recipient_id=rest[-1][0],
+                    recipients=len(rest),
+                    error=error,
+                    duration_ms=int(elapsed * 1000),
+                )
+                metrics.EMAILS.inc(len(rest), result="failed")
+                raise DeliveryError(error)
+
+            if rate:
+                time.sleep(max(0, len(batch) / rate - elapsed))
+    finally:
+        if connection is not None:
+            connection.close()
+
+    return sent_total
+
+
+def _resume_after(delivery):
+    return EmailBatch.objects.filter(delivery=delivery, error="").aggregate(last=Max("last_recipient_id"))["last"] or 0
+
+
+def deliver_article_email(article, subject, body, delivery=None, from_email=None):
+    """
+    Sends one message per subscriber of ``article``.
+
+    Messages go out in batches of EMAIL_BATCH_SIZE over a single SMTP
+    connection, paced to at most EMAIL_RATE_LIMIT messages per second.
+    Every batch is recorded as an EmailBatch, with the recipients whose
+    message was refused. Delivery stops when the connection fails and
+    raises DeliveryError; calling it again with the same ``delivery``
+    (see ``new_delivery``) resumes after the last recipient handled, so
+    nobody gets the message twice. Without one it is a new send.
+    """
+    delivery = delivery or new_delivery()
+    recipients = subscriber_addresses(article, _resume_after(delivery))
+    return _deliver(article, delivery, recipients, lambda user_id, address: (subject, body), from_email)
+
+
+def deliver_digest_email(articles, build_message, delivery=None, from_email=None):
+    """
+    Sends each reader subscribed to any of ``articles`` a single message.
+
+    ``build_message(articles)`` gets the reader's articles, in the order
+    given, and returns (subject, body). Batching, pacing and resuming by
+    ``delivery`` work as in ``deliver_article_email``.
+
+    EmailBatch needs an article, so the batches are recorded against the
+    first one. Its rows go if that article is deleted (CASCADE), and a
+    retry of the digest then starts over: resume is by ``delivery``, but
+    the records of what was sent are gone with it.
+    """
+    articles = list(articles)
+    if not articles:
+        return 0
+
+    by_reader = {}
+    for article in articles:
+        for reader_id in subscriber_ids(article.publisher_id, article.journalist_id, cached=False):
+            by_reader.setdefault(reader_id, []).append(article)
+
+    anchor = articles[0]
+    delivery = delivery or new_delivery()
+    resume_after = _resume_after(delivery)
+    recipients = _addresses(pk for pk in by_reader if pk > resume_after)
+    return _deliver(
+        anchor, delivery, recipients, lambda user_id, address: build_message(by_reader[user_id]), from_email
+    )
@@ -0,0 +1,169 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import replicas
+
+# Every reader, publisher and journalist has a version token in the feed
+# cache. A reader's feed can only change when one of the tokens it is
+# built from changes, so a hash of those tokens is a strong ETag for it.
+# Tokens are random rather than counters: if one is evicted it comes back
+# as a value no client has seen, never as an old one. That also makes it
+# safe for tokens to expire after FEED_CACHE_VERSION_TIMEOUT, which bounds
+# how long a process that did not see a bump keeps serving the old feed.
+# A body that will be cached is queried on the primary (replicas.primary).
+READER = "reader"
+PUBLISHER = "publisher"
+JOURNALIST = "journalist"
+
+
+def _cache():
+    return caches[getattr(settings, "FEED_CACHE_ALIAS", "default")]
+
+
+def _version_timeout():
+    return getattr(settings, "FEED_CACHE_VERSION_TIMEOUT", 60)
+
+
+def _version_key(kind, pk):
+    return f"news:feed-version:{kind}:{pk}"
+
+
+def _body_key(etag):
+    return "news:feed-body:" + etag.strip('"')
+
+
+def bump(kind, ids):
+    """
+    Gives each of ``ids`` a new version token.
+    """
+    keys = {_version_key(kind, pk): uuid.uuid4().hex for pk in ids if pk}
+    if keys:
+        _cache().set_many(keys, timeout=_version_timeout())
+
+
+def _versions(keys):
+    cache = _cache()
+    found = cache.get_many(keys)
+
+    for key in keys:
+        if key not in found:
+            token = uuid.uuid4().hex
+            # add() keeps whichever token another process stored first.
+            if not cache.add(key, token, timeout=_version_timeout()):
+                token = cache.get(key, token)
+            found[key] = token
+
+    return [found[key] for key in keys]
+
+
+async def _aversions(keys):
+    cache = _cache()
+    found = await cache.aget_many(keys)
+
+    for key in keys:
+        if key not in found:
+            token = uuid.uuid4().hex
+            if not await cache.aadd(key, token, timeout=_version_timeout()):
+                token = await cache.aget(key, token)
+            found[key] = token
+
+    return [found[key] for key in keys]
+
+
+def _version_keys(reader_id, publisher_ids, journalist_ids):
+    keys = [_version_key(READER, reader_id)]
+    keys += [_version_key(PUBLISHER, pk) for pk in sorted(publisher_ids)]
+    keys += [_version_key(JOURNALIST, pk) for pk in sorted(journalist_ids)]
+    return keys
+
+
+def _etag(reader_id, versions, variant):
+    parts = [str(reader_id)] + versions + [str(v) for v in variant]
+    return '"%s"' % hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+def feed_etag(reader_id, publisher_ids, journalist_ids, *variant):
+    """
+    Returns the strong ETag of one rendering of a reader's feed.
+
+    ``variant`` holds whatever else shapes the body (format, cursor, limit).
+    """
+    return _etag(reader_id, _versions(_version_keys(reader_id, publisher_ids, journalist_ids)), variant)
+
+
+async def afeed_etag(reader_id, publisher_ids, journalist_ids, *variant):
+    return _etag(reader_id, await _aversions(_version_keys(reader_id, publisher_ids, journalist_ids)), variant)
+
+
+def cached_body(etag):
+    """
+    Returns the stored response body for an ETag, or None.
+    """
+    return _cache().get(_body_key(etag))
+
+
+async def acached_body(etag):
+    return await _cache().aget(_body_key(etag))
+
+
+class _BodyBuffer:
+    """
+    Collects a streamed body until it outgrows FEED_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self):
+        self.limit = getattr(settings, "FEED_CACHE_MAX_BYTES", 1024 * 1024)
+        self.chunks = []
+        self.size = 0
+
+    def add(self, chunk):
+        if self.chunks is not None:
+            self.size += len(chunk)
+            if self.size > self.limit:
+                self.chunks = None
+            else:
+                self.chunks.append(chunk)
+
+    @property
+    def body(self):
+        return None if self.chunks is None else b"".join(self.chunks)
+
+
+def caching_stream(chunks, etag):
+    """
+    Passes ``chunks`` through and stores the joined body under ``etag``
+    once the stream completes, unless it outgrows FEED_CACHE_MAX_BYTES.
+    """
+    buffer = _BodyBuffer()
+    chunks = iter(chunks)
+    while True:
+        with replicas.primary():
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        buffer.add(chunk)
+        yield chunk
+
+    if buffer.body is not None:
+        _cache().set(_body_key(etag), buffer.body, getattr(settings, "FEED_CACHE_TIMEOUT", 300))
+
+
+async def acaching_stream(chunks, etag):
+    """
+    ``caching_stream`` for an async iterator of chunks.
+    """
+    buffer = _BodyBuffer()
+    chunks = aiter(chunks)
+    while True:
+        with replicas.primary():
+            chunk = await anext(chunks, None)
+        if chunk is None:
+            break
+        buffer.add(chunk)
+        yield chunk
+
+    if buffer.body is not None:
+        await _cache().aset(_body_key(etag), buffer.body, getattr(settings, "FEED_CACHE_TIMEOUT", 300))
@@ -0,0 +1,179 @@
+from django.conf import settings
+from django.db.models import Q
+
+from . import feed_cache
+from .models import Article, CustomUser, FeedEntry
+from .subscriptions import reader_journalist_ids, reader_publisher_ids, subscriber_ids
+
+
+def _batch_size():
+    return getattr(settings, "FEED_BATCH_SIZE", 1000)
+
+
+def _insert(entries):
+    FeedEntry.objects.bulk_create(entries, batch_size=_batch_size(), ignore_conflicts=True)
+
+
+def _chunks(values):
+    values = list(values)
+    size = _batch_size()
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _source_articles(publisher_ids, journalist_ids):
+    match = Q()
+    if publisher_ids:
+        match |= Q(publisher_id__in=publisher_ids)
+    if journalist_ids:
+        match |= Q(journalist_id__in=journalist_ids)
+
+    if not match:
+        return Article.objects.none()
+    return Article.objects.filter(approved=True).filter(match)
+
+
+def reader_feed(reader_id):
+    """
+    Returns a reader's feed entries, newest first.
+    """
+    return FeedEntry.objects.filter(reader_id=reader_id).order_by("-created_at", "-article_id")
+
+
+def fanout_article(article_id):
+    """
+    Makes an article appear in exactly the feeds of its current subscribers.
+
+    Returns the number of entries added and removed.
+    """
+    article = (
+        Article.objects.filter(pk=article_id)
+        .values("approved", "publisher_id", "journalist_id", "created_at")
+        .first()
+    )
+    if article is None:
+        return 0, 0
+    if not article["approved"]:
+        return 0, remove_article(article_id)
+
+    # From the tables, not this process's subscription cache, which may not
+    # have seen a subscription made elsewhere yet.
+    wanted = subscriber_ids(article["publisher_id"], article["journalist_id"], cached=False)
+    existing = set(FeedEntry.objects.filter(article_id=article_id).values_list("reader_id", flat=True))
+
+    stale = existing - wanted
+    for chunk in _chunks(stale):
+        FeedEntry.objects.filter(article_id=article_id, reader_id__in=chunk).delete()
+
+    missing = wanted - existing
+    _insert(
+        FeedEntry(reader_id=reader_id, article_id=article_id, created_at=article["created_at"])
+        for reader_id in missing
+    )
+
+    # New entries belong to subscribers of the article's publisher or
+    # journalist; stale ones to readers who may follow neither any more.
+    feed_cache.bump(feed_cache.PUBLISHER, [article["publisher_id"]])
+    feed_cache.bump(feed_cache.JOURNALIST, [article["journalist_id"]])
+    feed_cache.bump(feed_cache.READER, stale)
+    return len(missing), len(stale)
+
+
+def fanout_articles(article_ids):
+    """
+    Runs ``fanout_article`` for each article, e.g. after a bulk insert.
+    """
+    for article_id in article_ids:
+        fanout_article(article_id)
+
+
+def remove_article(article_id):
+    """
+    Takes an article out of every feed. Returns the number of entries removed.
+    """
+    deleted, _ = FeedEntry.objects.filter(article_id=article_id).delete()
+    return deleted
+
+
+def add_sources(reader_ids, publisher_ids=(), journalist_ids=()):
+    """
+    Adds the approved articles of newly subscribed sources to readers' feeds.
+    """
+    reader_ids = list(
+        CustomUser.objects.filter(pk__in=reader_ids, role=CustomUser.READER).values_list("id", flat=True)
+    )
+    if not reader_ids:
+        return
+
+    batch = []
+    articles = _source_articles(publisher_ids, journalist_ids).values_list("id", "created_at")
+    for article_id, created_at in articles.iterator(chunk_size=_batch_size()):
+        batch.extend(
+            FeedEntry(reader_id=reader_id, article_id=article_id, created_at=created_at)
+            for reader_id in reader_ids
+        )
+        if len(batch) >= _batch_size():
+            _insert(batch)
+            batch = []
+    _insert(batch)
+    feed_cache.bump(feed_cache.READER, reader_ids)
+
+
+def remove_sources(reader_ids, publisher_ids=(), journalist_ids=()):
+    """
+    Drops articles of unsubscribed sources that a reader no longer reaches
+    through any remaining subscription.
+    """
+    dropped = Q()
+    if publisher_ids:
+        dropped |= Q(article__publisher_id__in=publisher_ids)
+    if journalist_ids:
+        dropped |= Q(article__journalist_id__in=journalist_ids)
+    if not dropped:
+        return
+
+    for reader in CustomUser.objects.filter(pk__in=reader_ids):
+        qs = FeedEntry.objects.filter(reader=reader).filter(dropped)
+        if reader.role == CustomUser.READER:
+            qs = qs.exclude(article__publisher_id__in=reader_publisher_ids(reader.pk, cached=False)).exclude(
+                article__journalist_id__in=reader_journalist_ids(reader.pk, cached=False)
+            )
+        qs.delete()
+
+    feed_cache.bump(feed_cache.READER, reader_ids)
+
+
+def sync_reader(reader_id, delete_stale=True, dry_run=False):
+    """
+    Brings one reader's feed in line with their subscriptions.
+
+    Returns the number of entries that were (or, with ``dry_run``, would be)
+    added and removed.
+    """
+    reader = CustomUser.objects.filter(pk=reader_id).first()
+    if reader is None:
+        return 0, 0
+
+    wanted = {}
+    if reader.role == CustomUser.READER:
+        articles = _source_articles(
+            reader_publisher_ids(reader_id, cached=False),
+            reader_journalist_ids(reader_id, cached=False),
+        ).values_list("id", "created_at")
+        wanted = dict(articles.iterator(chunk_size=_batch_size()))
+
+    existing = set(FeedEntry.objects.filter(reader_id=reader_id).values_list("article_id", flat=True))
+    missing = wanted.keys() - existing
+    stale = existing - wanted.keys() if delete_stale else set()
+
+    if not dry_run:
+        _insert(
+            FeedEntry(reader_id=reader_id, article_id=article_id, created_at=wanted[article_id])
+            for article_id in missing
+        )
+        for chunk in _chunks(stale):
+            FeedEntry.objects.filter(reader_id=reader_id, article_id__in=chunk).delete()
+        if missing or stale:
+            feed_cache.bump(feed_cache.READER, [reader_id])
+
+    return len(missing), len(stale)
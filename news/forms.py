@@ -7,4 +7,17 @@ class RegisterForm(UserCreationForm):
 
     class Meta(UserCreationForm.Meta):
         model = CustomUser
-        fields = ("username", "email", "role", "password1", "password2")
\ No newline at end of file
+        fields = ("username", "email", "role", "password1", "password2")
+
+
+def content_error(title, content, publisher=None, publisher_required=False):
+    """
+    Returns the first problem with article/newsletter fields, or None.
+    """
+    if not title:
+        return "Title is required."
+    if not content:
+        return "Content is required."
+    if publisher_required and not publisher:
+        return "Publisher is required."
+    return None
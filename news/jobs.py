@@ -0,0 +1,184 @@
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .models import Job
+
+# Maps a job kind to the dotted path of the callable that runs it. The
+# callable receives the job payload as keyword arguments and signals a
+# retryable failure by raising.
+JOB_HANDLERS = {
+    "email_subscribers": "news.notifications.email_subscribers_job",
+    "email_digest": "news.notifications.email_digest_job",
+    "post_to_x": "news.notifications.post_to_x_job",
+    "fanout_article": "news.feeds.fanout_article",
+    "fanout_articles": "news.feeds.fanout_articles",
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def default_worker_id(index=0):
+    """
+    Builds an identifier for a worker thread.
+    """
+    return f"{socket.gethostname()}:{index}"
+
+
+def enqueue(kind, **payload):
+    """
+    Adds a job to the queue.
+
+    Call it inside the transaction that makes the change the job reacts to,
+    so the job is only visible once that change is committed.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    return Job.objects.create(
+        kind=kind,
+        payload=payload,
+        max_attempts=_setting("JOB_MAX_ATTEMPTS", 5),
+    )
+
+
+def retry_delay(attempts):
+    """
+    Returns the backoff in seconds before the next attempt.
+    """
+    base = _setting("JOB_RETRY_BASE_SECONDS", 5)
+    cap = _setting("JOB_RETRY_MAX_SECONDS", 600)
+    delay = min(cap, base * (2 ** max(attempts - 1, 0)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _stale(now):
+    return Q(
+        status=Job.RUNNING,
+        locked_at__lt=now - timedelta(seconds=_setting("JOB_VISIBILITY_TIMEOUT", 300)),
+    )
+
+
+def _runnable(now):
+    return Q(status=Job.PENDING, run_after__lte=now) | (_stale(now) & Q(attempts__lt=F("max_attempts")))
+
+
+def _fail_exhausted(now):
+    """
+    Marks FAILED the jobs whose worker died during their last attempt, so
+    a job that takes a worker down with it is not run forever.
+    """
+    exhausted = list(
+        Job.objects.filter(_stale(now), attempts__gte=F("max_attempts")).values_list("pk", "kind", "locked_by")
+    )
+    for pk, kind, locked_by in exhausted:
+        updated = Job.objects.filter(_stale(now), pk=pk, locked_by=locked_by).update(
+            status=Job.FAILED,
+            last_error=f"Worker {locked_by} timed out on the last attempt.",
+            locked_at=None,
+            locked_by="",
+            updated_at=now,
+        )
+        if updated:
+            metrics.JOBS.inc(kind=kind, result="failed")
+
+
+def claim(worker_id, limit=1):
+    """
+    Locks up to ``limit`` runnable jobs for ``worker_id``.
+
+    Jobs left RUNNING by a worker that died are picked up again once the
+    visibility timeout has passed, so every job runs at least once, or
+    marked FAILED if that was their last attempt. Each
+    claim is a conditional UPDATE, which keeps concurrent workers from
+    taking the same job on any database backend.
+    """
+    now = timezone.now()
+    _fail_exhausted(now)
+    runnable = _runnable(now)
+
+    candidates = list(
+        Job.objects.filter(runnable)
+        .order_by("run_after", "id")
+        .values_list("id", flat=True)[: limit * 4]
+    )
+
+    claimed = []
+    for pk in candidates:
+        updated = Job.objects.filter(runnable, pk=pk).update(
+            status=Job.RUNNING,
+            locked_at=now,
+            locked_by=worker_id,
+            attempts=F("attempts") + 1,
+        )
+        if updated:
+            claimed.append(pk)
+            if len(claimed) >= limit:
+                break
+
+    if not claimed:
+        return []
+    return list(Job.objects.filter(pk__in=claimed).order_by("run_after", "id"))
+
+
+def run_job(job):
+    """
+    Runs a claimed job and records the outcome.
+
+    Returns True when the job succeeded.
+    """
+    try:
+        handler = import_string(JOB_HANDLERS[job.kind])
+        handler(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            changes = {"status": Job.FAILED}
+        else:
+            changes = {
+                "status": Job.PENDING,
+                "run_after": timezone.now() + timedelta(seconds=retry_delay(job.attempts)),
+            }
+        changes.update(last_error=error, locked_at=None, locked_by="")
+        ok = False
+    else:
+        changes = {"status": Job.DONE, "last_error": "", "locked_at": None, "locked_by": ""}
+        ok = True
+
+    result = "done" if ok else ("failed" if changes["status"] == Job.FAILED else "retry")
+    metrics.JOBS.inc(kind=job.kind, result=result)
+
+    # A job reclaimed by another worker after a timeout belongs to that
+    # worker now, so only touch the row while we still hold the lock.
+    changes["updated_at"] = timezone.now()
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(**changes)
+    return ok
+
+
+def run_pending(worker_id=None, limit=None):
+    """
+    Runs runnable jobs one by one until none are left.
+
+    Returns the number of jobs processed.
+    """
+    worker_id = worker_id or default_worker_id()
+    processed = 0
+
+    while limit is None or processed < limit:
+        jobs = claim(worker_id)
+        if not jobs:
+            break
+        for job in jobs:
+            run_job(job)
+            processed += 1
+
+    return processed
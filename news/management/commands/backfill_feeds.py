@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from news.feeds import sync_reader
+from news.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Adds any missing approved articles to readers' materialized feeds."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reader", type=int, action="append", dest="readers", help="Only this reader id (repeatable).")
+
+    def handle(self, *args, **options):
+        readers = CustomUser.objects.filter(role=CustomUser.READER)
+        if options["readers"]:
+            readers = readers.filter(pk__in=options["readers"])
+
+        total = 0
+        for reader_id in readers.values_list("id", flat=True).iterator():
+            added, _ = sync_reader(reader_id, delete_stale=False)
+            total += added
+
+        self.stdout.write(self.style.SUCCESS(f"Added {total} feed entries."))
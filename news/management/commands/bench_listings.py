@@ -0,0 +1,140 @@
+import json
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from news.bench import ensure_publishers, ensure_users, seed_articles, seed_newsletters, summarize, time_call
+from news.feeds import reader_feed
+from news.models import Article, CustomUser, FeedEntry, Newsletter
+
+# The (created_at, id) keyset order of news.pagination, and of reader_feed.
+ORDER = ("-created_at", "-id")
+LISTING_MODELS = (Article, Newsletter, FeedEntry)
+
+
+def listing_queries(page_size, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the first-page listing queries the views run, keyed by view name.
+    """
+    articles = Article.objects.using(using)
+    newsletters = Newsletter.objects.using(using)
+    journalist_id = articles.exclude(journalist=None).order_by("-id").values_list("journalist_id", flat=True).first()
+    reader_id = FeedEntry.objects.using(using).order_by("-id").values_list("reader_id", flat=True).first()
+
+    fields = ("id", "title", "created_at")
+    return {
+        "articles": articles.filter(approved=True).order_by(*ORDER).values_list(*fields)[:page_size],
+        "review_articles": articles.filter(approved=False, rejected=False).order_by(*ORDER).values_list(*fields)[:page_size],
+        "editor_articles": articles.order_by(*ORDER).values_list(*fields)[:page_size],
+        "journalist_articles": articles.filter(journalist_id=journalist_id)
+        .order_by(*ORDER)
+        .values_list(*fields)[:page_size],
+        "get_articles": reader_feed(reader_id).using(using).values_list("article_id", "created_at")[:page_size],
+        "editor_newsletters": newsletters.order_by(*ORDER).values_list(*fields)[:page_size],
+        "journalist_newsletters": newsletters.filter(journalist_id=journalist_id)
+        .order_by(*ORDER)
+        .values_list(*fields)[:page_size],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the article/newsletter listing queries and prints their EXPLAIN "
+        "plans, optionally with the Meta.indexes dropped for comparison."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0, help="Insert this many articles first.")
+        parser.add_argument("--repeat", type=int, default=20, help="Timed runs per query.")
+        parser.add_argument("--page-size", type=int, default=50, help="Rows fetched per listing.")
+        parser.add_argument(
+            "--compare",
+            action="store_true",
+            help=(
+                "Also measure with the listing indexes dropped, then restore them. "
+                "Only on a database listed in BENCH_SCRATCH_DATABASES."
+            ),
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="Database alias to seed and measure.",
+        )
+        parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        if using not in connections:
+            raise CommandError(f"Unknown database {using!r}.")
+        # Dropping indexes on a live database leaves it without them if
+        # the command is interrupted.
+        if options["compare"] and using not in getattr(settings, "BENCH_SCRATCH_DATABASES", []):
+            raise CommandError(
+                f"--compare drops indexes; add {using!r} to BENCH_SCRATCH_DATABASES if it is a scratch database."
+            )
+        self.connection = connections[using]
+
+        if options["seed"]:
+            publisher_ids = ensure_publishers(50, using=using)
+            journalist_ids = ensure_users(CustomUser.JOURNALIST, 200, using=using)
+            seed_articles(
+                options["seed"],
+                publisher_ids,
+                journalist_ids,
+                progress=lambda n: self.stderr.write(f"seeded {n} articles"),
+                using=using,
+            )
+            seed_newsletters(options["seed"] // 10, publisher_ids, journalist_ids, using=using)
+            self.analyze()
+
+        results = {}
+        if options["compare"]:
+            with self.indexes_dropped():
+                results["without_indexes"] = self.measure(options)
+        results["with_indexes"] = self.measure(options)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for label, measured in results.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"== {label} =="))
+            for name, row in measured.items():
+                self.stdout.write(f"{name}: p50={row['p50_ms']}ms p95={row['p95_ms']}ms")
+                for line in row["plan"].splitlines():
+                    self.stdout.write(f"    {line}")
+
+    def measure(self, options):
+        self.analyze()
+        random.seed(0)
+        measured = {}
+        for name, qs in listing_queries(options["page_size"], self.connection.alias).items():
+            timings = time_call(lambda: list(qs), options["repeat"])
+            measured[name] = dict(summarize(timings), plan=qs.explain())
+        return measured
+
+    def analyze(self):
+        with self.connection.cursor() as cursor:
+            if self.connection.vendor == "sqlite":
+                cursor.execute("ANALYZE")
+            elif self.connection.vendor == "mysql":
+                cursor.execute("ANALYZE TABLE news_article, news_newsletter, news_feedentry")
+
+    @contextmanager
+    def indexes_dropped(self):
+        with self.connection.schema_editor() as editor:
+            for model in LISTING_MODELS:
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
+        self.stderr.write("dropped listing indexes")
+        try:
+            yield
+        finally:
+            with self.connection.schema_editor() as editor:
+                for model in LISTING_MODELS:
+                    for index in model._meta.indexes:
+                        editor.add_index(model, index)
+            self.stderr.write("restored listing indexes")
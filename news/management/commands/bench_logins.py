@@ -0,0 +1,58 @@
+import json
+import time
+
+from django.contrib.auth import SESSION_KEY
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from news.bench import ensure_users, summarize
+from news.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Measures login throughput and the queries each login runs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50, help="Benchmark readers to log in.")
+        parser.add_argument("--repeat", type=int, default=5, help="Logins per user.")
+        parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+
+    def handle(self, *args, **options):
+        user_ids = ensure_users(CustomUser.READER, options["users"])
+        users = list(CustomUser.objects.filter(pk__in=user_ids))
+
+        # force_login() runs the real login() path, including the last_login
+        # save, without spending the time on password hashing.
+        timings = []
+        queries = []
+        started = time.perf_counter()
+        for _ in range(options["repeat"]):
+            for user in users:
+                client = Client()
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    client.force_login(user)
+                    timings.append((time.perf_counter() - start) * 1000)
+                if client.session.get(SESSION_KEY) != str(user.pk):
+                    raise CommandError(f"Login did not put user {user.pk} in the session.")
+                queries.append(len(captured))
+        elapsed = time.perf_counter() - started
+
+        result = dict(
+            summarize(timings),
+            logins=len(timings),
+            logins_per_second=round(len(timings) / elapsed, 1),
+            queries_per_login=round(sum(queries) / len(queries), 2),
+        )
+
+        if options["json"]:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        self.stdout.write(
+            f"{result['logins']} logins: {result['logins_per_second']}/s "
+            f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+            f"queries/login={result['queries_per_login']}"
+        )
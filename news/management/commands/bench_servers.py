@@ -0,0 +1,270 @@
+import importlib.util
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from news.bench import summarize
+from news.management.commands.bench_views import pick_samples, pick_users, row_counts
+from news.models import CustomUser
+
+# The same project under each server. ASYNC_VIEWS picks the async or sync
+# versions of the routes below (see news/urls.py).
+SERVERS = {
+    "asgi": {"package": "uvicorn", "async_views": "1"},
+    "wsgi": {"package": "gunicorn", "async_views": "0"},
+}
+
+
+def server_command(name, port, options):
+    if name == "asgi":
+        return [
+            sys.executable, "-m", "uvicorn", "news_project.asgi:application",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(options["workers"]),
+            "--no-access-log", "--log-level", "warning",
+        ]
+    return [
+        sys.executable, "-m", "gunicorn", "news_project.wsgi:application",
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(options["workers"]),
+        "--worker-class", "gthread", "--threads", str(options["threads"]),
+        "--log-level", "warning",
+    ]
+
+
+def _children(pid):
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as handle:
+                children += [int(child) for child in handle.read().split()]
+        except OSError:
+            pass
+    return children
+
+
+def tree_rss_kb(pid):
+    """
+    Returns the resident memory of a process and all its descendants, or
+    None where /proc is not available.
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    total = 0
+    pending = [pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/status") as handle:
+                for line in handle:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            pending += _children(pid)
+        except OSError:
+            continue
+    return total
+
+
+class RssSampler(threading.Thread):
+    """
+    Records the peak memory of a process tree until stopped.
+    """
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = tree_rss_kb(pid)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            rss = tree_rss_kb(self.pid)
+            if rss is not None:
+                self.peak_kb = max(self.peak_kb or 0, rss)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak_kb
+
+
+def _mb(kb):
+    return None if kb is None else round(kb / 1024, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves the project under uvicorn (ASGI, async views) and gunicorn "
+        "(WSGI, threaded workers) in turn, loads /articles/, an article page "
+        "and /api/articles/ at rising concurrency and reports throughput, "
+        "latency, errors and the servers' memory as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--server", action="append", choices=sorted(SERVERS), help="Only this server (repeatable).")
+        parser.add_argument(
+            "--concurrency", type=int, action="append", help="Concurrent clients (repeatable; default 1, 8, 32, 128)."
+        )
+        parser.add_argument("--duration", type=float, default=10, help="Seconds of load per concurrency level.")
+        parser.add_argument("--workers", type=int, default=1, help="Server processes.")
+        parser.add_argument("--threads", type=int, default=8, help="Threads per gunicorn worker.")
+        parser.add_argument("--port", type=int, default=8701)
+        parser.add_argument("--startup-timeout", type=float, default=30)
+        parser.add_argument("--output", default="-", help="JSON file to write, or - for stdout.")
+
+    def handle(self, *args, **options):
+        servers = options["server"] or sorted(SERVERS)
+        missing = [SERVERS[name]["package"] for name in servers if importlib.util.find_spec(SERVERS[name]["package"]) is None]
+        if missing:
+            raise CommandError(
+                f"{', '.join(missing)} not installed. They are only needed for this benchmark: "
+                f"pip install {' '.join(missing)}, or pick a server with --server."
+            )
+        levels = options["concurrency"] or [1, 8, 32, 128]
+        if min(levels) < 1 or options["duration"] <= 0:
+            raise CommandError("--concurrency and --duration must be positive.")
+
+        users = pick_users()
+        if users[CustomUser.READER] is None:
+            raise CommandError("No reader; run seed_bench first.")
+        article = pick_samples(users[CustomUser.JOURNALIST])["article"]
+        paths = [reverse("articles"), reverse("get_articles") + "?limit=50"]
+        if article is not None:
+            paths.insert(1, reverse("article_detail", args=[article]))
+
+        # The servers share the database, so a session made here logs
+        # their clients in.
+        client = Client()
+        client.force_login(CustomUser.objects.get(pk=users[CustomUser.READER]))
+        cookies = {settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value}
+
+        report = {
+            "started_at": timezone.now().isoformat(),
+            "rows": row_counts(),
+            "paths": paths,
+            "duration": options["duration"],
+            "workers": options["workers"],
+            "threads": options["threads"],
+            "servers": {},
+        }
+        for name in servers:
+            report["servers"][name] = self.run_server(name, paths, cookies, levels, options)
+
+        text = json.dumps(report, indent=2)
+        if options["output"] == "-":
+            self.stdout.write(text)
+        else:
+            with open(options["output"], "w", encoding="utf-8") as handle:
+                handle.write(text + "\n")
+
+    def run_server(self, name, paths, cookies, levels, options):
+        port = options["port"]
+        env = dict(os.environ, ASYNC_VIEWS=SERVERS[name]["async_views"])
+        env.setdefault("DJANGO_SETTINGS_MODULE", "news_project.settings")
+        log = tempfile.TemporaryFile()
+        process = subprocess.Popen(
+            server_command(name, port, options),
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        try:
+            base = f"http://127.0.0.1:{port}"
+            self.wait_ready(process, base, log, options["startup_timeout"])
+            # One pass fills the page and feed caches before the timed runs.
+            for path in paths:
+                requests.get(base + path, cookies=cookies, timeout=60)
+
+            result = {"idle_rss_mb": _mb(tree_rss_kb(process.pid)), "levels": {}}
+            for level in levels:
+                result["levels"][str(level)] = self.load(process.pid, base, paths, cookies, level, options["duration"])
+                self.stderr.write(f"{name} x{level}: {result['levels'][str(level)]}")
+            return result
+        finally:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+                process.wait(timeout=30)
+            except ProcessLookupError:
+                pass
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+            log.close()
+
+    def wait_ready(self, process, base, log, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                log.seek(0)
+                raise CommandError(f"Server exited with {process.returncode}:\n{log.read().decode(errors='replace')}")
+            try:
+                requests.get(base + reverse("login"), timeout=1)
+                return
+            except requests.ConnectionError:
+                time.sleep(0.2)
+        raise CommandError(f"Server did not answer within {timeout:g}s.")
+
+    def load(self, pid, base, paths, cookies, concurrency, duration):
+        timings = []
+        errors = []
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+
+        def client(offset):
+            session = requests.Session()
+            session.cookies.update(cookies)
+            done = []
+            failed = 0
+            count = offset
+            while time.monotonic() < deadline:
+                path = paths[count % len(paths)]
+                count += 1
+                started = time.perf_counter()
+                try:
+                    response = session.get(base + path, timeout=60)
+                    ok = response.status_code == 200
+                except requests.RequestException:
+                    ok = False
+                if ok:
+                    done.append((time.perf_counter() - started) * 1000)
+                else:
+                    failed += 1
+            with lock:
+                timings.extend(done)
+                errors.append(failed)
+
+        sampler = RssSampler(pid)
+        sampler.start()
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        peak = sampler.stop()
+
+        result = {
+            "requests": len(timings),
+            "errors": sum(errors),
+            "requests_per_second": round(len(timings) / elapsed, 1),
+            "peak_rss_mb": _mb(peak),
+        }
+        if timings:
+            result.update(summarize(timings))
+        return result
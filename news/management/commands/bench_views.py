@@ -0,0 +1,266 @@
+import json
+import tracemalloc
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from news import urls
+from news.bench import VOCABULARY, summarize, time_call
+from news.models import Article, CustomUser, FeedEntry, Newsletter
+
+# How to request each named route in news/urls.py: who is logged in
+# (None is anonymous), which sample object fills <pk>, and the query
+# string. Routes that only change data on POST are listed with the
+# reason they are left out. A route missing from here is reported as
+# skipped so new views get noticed.
+VIEW_SPECS = {
+    "home": {"role": None},
+    "login": {"role": None},
+    "register": {"role": None},
+    "articles": {"role": CustomUser.READER},
+    "article_search": {"role": CustomUser.READER, "params": {"q": VOCABULARY[0]}},
+    "article_detail": {"role": CustomUser.READER, "sample": "article"},
+    "review_articles": {"role": CustomUser.EDITOR},
+    "approve_article": {"role": CustomUser.EDITOR, "sample": "pending_article"},
+    "editor_articles": {"role": CustomUser.EDITOR},
+    "editor_article_edit": {"role": CustomUser.EDITOR, "sample": "article"},
+    "editor_article_delete": {"role": CustomUser.EDITOR, "sample": "article"},
+    "editor_newsletters": {"role": CustomUser.EDITOR},
+    "editor_newsletter_edit": {"role": CustomUser.EDITOR, "sample": "newsletter"},
+    "editor_newsletter_delete": {"role": CustomUser.EDITOR, "sample": "newsletter"},
+    "journalist_articles": {"role": CustomUser.JOURNALIST},
+    "create_article": {"role": CustomUser.JOURNALIST},
+    "journalist_article_edit": {"role": CustomUser.JOURNALIST, "sample": "journalist_article"},
+    "journalist_article_delete": {"role": CustomUser.JOURNALIST, "sample": "journalist_article"},
+    "journalist_newsletters": {"role": CustomUser.JOURNALIST},
+    "create_newsletter": {"role": CustomUser.JOURNALIST},
+    "journalist_newsletter_edit": {"role": CustomUser.JOURNALIST, "sample": "journalist_newsletter"},
+    "journalist_newsletter_delete": {"role": CustomUser.JOURNALIST, "sample": "journalist_newsletter"},
+    "publisher_list": {"role": CustomUser.READER},
+    "publisher_create": {"role": CustomUser.EDITOR},
+    "get_articles": {"role": CustomUser.READER, "params": {"limit": "50"}},
+    "api_article_search": {"role": CustomUser.READER, "params": {"q": VOCABULARY[0]}},
+    "metrics": {"role": None},
+    "article_stream": {"skip": "An endless event stream, ASGI only."},
+    "logout": {"skip": "POST only; it would end the session."},
+    "moderate_articles": {"skip": "POST only; it changes data."},
+    "api_moderate_articles": {"skip": "POST only; it changes data."},
+    "profile_list": {"skip": "Staff only; a debugging aid."},
+    "profile_download": {"skip": "Staff only; a debugging aid."},
+}
+
+
+def route_names():
+    return [pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern) and pattern.name]
+
+
+def pick_users():
+    """
+    Returns the user id to log in as for each role.
+
+    The reader is the one with the most subscriptions among those whose
+    feed is materialized, so get_articles sees a heavy feed; the
+    journalist is whoever wrote the newest article.
+    """
+    heavy_readers = (
+        CustomUser.subscribed_publishers.through.objects.values("customuser_id")
+        .annotate(subscriptions=Count("id"))
+        .order_by("-subscriptions")
+        .values_list("customuser_id", flat=True)[:200]
+    )
+    reader_id = next(
+        (pk for pk in heavy_readers if FeedEntry.objects.filter(reader_id=pk).exists()),
+        None,
+    )
+    if reader_id is None:
+        reader_id = CustomUser.objects.filter(role=CustomUser.READER).values_list("id", flat=True).first()
+
+    return {
+        CustomUser.READER: reader_id,
+        CustomUser.JOURNALIST: Article.objects.exclude(journalist=None)
+        .order_by("-id")
+        .values_list("journalist_id", flat=True)
+        .first(),
+        CustomUser.EDITOR: CustomUser.objects.filter(role=CustomUser.EDITOR).values_list("id", flat=True).first(),
+    }
+
+
+def pick_samples(journalist_id):
+    """
+    Returns the object ids that fill <pk> in the routes, newest first.
+    """
+    return {
+        "article": Article.objects.filter(approved=True).order_by("-id").values_list("id", flat=True).first(),
+        "pending_article": Article.objects.filter(approved=False, rejected=False).order_by("-id").values_list("id", flat=True).first(),
+        "newsletter": Newsletter.objects.order_by("-id").values_list("id", flat=True).first(),
+        "journalist_article": Article.objects.filter(journalist_id=journalist_id)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first(),
+        "journalist_newsletter": Newsletter.objects.filter(journalist_id=journalist_id)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first(),
+    }
+
+
+def row_counts():
+    return {
+        "articles": Article.objects.count(),
+        "approved_articles": Article.objects.filter(approved=True).count(),
+        "newsletters": Newsletter.objects.count(),
+        "users": CustomUser.objects.count(),
+        "publisher_subscriptions": CustomUser.subscribed_publishers.through.objects.count(),
+        "journalist_subscriptions": CustomUser.subscribed_journalists.through.objects.count(),
+    }
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests every route in news/urls.py through the test client and "
+        "records p50/p95 latency, SQL queries and peak memory as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=20, help="Timed requests per route.")
+        parser.add_argument("--only", action="append", help="Only this route name (repeatable).")
+        parser.add_argument("--cold", action="store_true", help="Clear every cache before each request.")
+        parser.add_argument("--output", default="-", help="JSON file to write, or - for stdout.")
+        parser.add_argument("--compare", help="Earlier JSON output to print the changes against.")
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be positive.")
+        names = route_names()
+        if options["only"]:
+            unknown = set(options["only"]) - set(names)
+            if unknown:
+                raise CommandError(f"Unknown route: {', '.join(sorted(unknown))}")
+            names = [name for name in names if name in options["only"]]
+
+        users = pick_users()
+        samples = pick_samples(users[CustomUser.JOURNALIST])
+        clients = {None: Client()}
+        for role, user_id in users.items():
+            if user_id is not None:
+                clients[role] = Client()
+                clients[role].force_login(CustomUser.objects.get(pk=user_id))
+
+        report = {
+            "started_at": timezone.now().isoformat(),
+            "vendor": connection.vendor,
+            "repeat": options["repeat"],
+            "cold": options["cold"],
+            "rows": row_counts(),
+            "users": users,
+            "samples": samples,
+            "views": {},
+            "skipped": {},
+        }
+
+        with override_settings(ALLOWED_HOSTS=["testserver"]):
+            for name in names:
+                spec = VIEW_SPECS.get(name)
+                reason = self.skip_reason(spec, clients, samples)
+                if reason:
+                    report["skipped"][name] = reason
+                    continue
+
+                kwargs = {"pk": samples[spec["sample"]]} if "sample" in spec else {}
+                report["views"][name] = self.measure(
+                    clients[spec["role"]], reverse(name, kwargs=kwargs), spec, options
+                )
+                if options["verbosity"] > 1:
+                    self.stderr.write(f"{name}: {report['views'][name]}")
+
+        text = json.dumps(report, indent=2)
+        if options["output"] == "-":
+            self.stdout.write(text)
+        else:
+            with open(options["output"], "w", encoding="utf-8") as handle:
+                handle.write(text + "\n")
+
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as handle:
+                self.compare(json.load(handle), report)
+
+    def skip_reason(self, spec, clients, samples):
+        if spec is None:
+            return "No entry in VIEW_SPECS."
+        if "skip" in spec:
+            return spec["skip"]
+        if spec["role"] not in clients:
+            return f"No {spec['role']} user; run seed_bench first."
+        if "sample" in spec and samples[spec["sample"]] is None:
+            return f"No {spec['sample'].replace('_', ' ')}; run seed_bench first."
+        return None
+
+    def measure(self, client, path, spec, options):
+        params = spec.get("params", {})
+
+        def fetch():
+            if options["cold"]:
+                clear_caches()
+            # getvalue() drains streaming responses too.
+            return client.get(path, params).getvalue()
+
+        fetch()
+        timings = time_call(fetch, options["repeat"])
+
+        if options["cold"]:
+            clear_caches()
+        # Counted with a wrapper rather than connection.queries, which the
+        # test client resets at the start of each request.
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+            response = client.get(path, params)
+            response.getvalue()
+
+        if options["cold"]:
+            clear_caches()
+        tracemalloc.start()
+        try:
+            fetch()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return dict(
+            summarize(timings),
+            path=path,
+            role=spec["role"],
+            status=response.status_code,
+            queries=len(queries),
+            peak_memory_kb=round(peak / 1024, 1),
+        )
+
+    def compare(self, before, after):
+        self.stderr.write(f"{'route':<30} {'p50 ms':>18} {'p95 ms':>18} {'queries':>13} {'peak KB':>20}")
+        for name, now in after["views"].items():
+            then = before.get("views", {}).get(name)
+            if then is None:
+                self.stderr.write(f"{name:<30} (new)")
+                continue
+            self.stderr.write(
+                f"{name:<30} "
+                f"{self.change(then['p50_ms'], now['p50_ms']):>18} "
+                f"{self.change(then['p95_ms'], now['p95_ms']):>18} "
+                f"{then['queries']:>5} -> {now['queries']:<4} "
+                f"{self.change(then['peak_memory_kb'], now['peak_memory_kb']):>20}"
+            )
+
+    def change(self, then, now):
+        if not then:
+            return f"{then} -> {now}"
+        return f"{then:g} -> {now:g} ({(now - then) / then:+.0%})"
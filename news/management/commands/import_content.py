@@ -0,0 +1,224 @@
+import csv
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from news import page_cache, search
+from news.bench import explicit_created_at
+from news.forms import content_error
+from news.jobs import enqueue
+from news.models import Article, CustomUser, Newsletter, Publisher
+
+MODELS = {"article": Article, "newsletter": Newsletter}
+
+TRUE_VALUES = {"1", "true", "yes", "y", "on"}
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_jsonl(handle):
+    for line_no, line in enumerate(handle, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_no, line.rstrip("\n"), f"Invalid JSON: {exc}"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, row, "Expected a JSON object."
+            continue
+        yield line_no, row, None
+
+
+def read_csv(handle):
+    reader = csv.DictReader(handle)
+    for row in reader:
+        yield reader.line_num, row, None
+
+
+READERS = {"jsonl": read_jsonl, "csv": read_csv}
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports articles or newsletters from JSONL/CSV files. Rows name their "
+        "publisher and journalist by name/username; invalid rows are written "
+        "to a reject file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="JSONL or CSV files.")
+        parser.add_argument("--model", choices=sorted(MODELS), default="article")
+        parser.add_argument("--format", choices=sorted(READERS), help="Defaults to the file extension.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per bulk insert and transaction.")
+        parser.add_argument("--rejects", help="Reject file (JSONL). Defaults to <first path>.rejects.jsonl.")
+
+    def handle(self, *args, **options):
+        self.model = MODELS[options["model"]]
+        self.verbosity = options["verbosity"]
+        self.batch_size = options["batch_size"]
+        if self.batch_size < 1:
+            raise CommandError("--batch-size must be positive.")
+
+        self.publishers = dict(Publisher.objects.values_list("name", "id"))
+        self.journalists = dict(
+            CustomUser.objects.filter(role=CustomUser.JOURNALIST).values_list("username", "id")
+        )
+        self.title_length = self.model._meta.get_field("title").max_length
+
+        self.rejects_path = options["rejects"] or f"{options['paths'][0]}.rejects.jsonl"
+        self.rejects_file = None
+        self.imported = 0
+        self.rejected = 0
+        self.ids_missing = False
+
+        started = time.perf_counter()
+        try:
+            for path in options["paths"]:
+                self.import_file(path, options["format"] or os.path.splitext(path)[1].lstrip(".").lower())
+        finally:
+            if self.rejects_file:
+                self.rejects_file.close()
+
+        if self.imported:
+            page_cache.invalidate_publisher()
+
+        elapsed = time.perf_counter() - started
+        rate = self.imported / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {self.imported} {options['model']}s in {elapsed:.1f}s ({rate:.0f} rows/s), "
+                f"rejected {self.rejected}."
+            )
+        )
+        if self.rejected:
+            self.stdout.write(f"Rejected rows were written to {self.rejects_path}.")
+        if self.ids_missing:
+            self.stdout.write(
+                self.style.WARNING(
+                    "This database does not return ids from bulk inserts, so approved articles were not "
+                    "fanned out. Run `manage.py backfill_feeds`."
+                )
+            )
+
+    def import_file(self, path, fmt):
+        if fmt not in READERS:
+            raise CommandError(f"Cannot tell the format of {path}; pass --format.")
+
+        batch = []
+        with open(path, newline="", encoding="utf-8-sig") as handle:
+            for line_no, row, error in READERS[fmt](handle):
+                if error is None:
+                    try:
+                        batch.append((line_no, row, self.build(row)))
+                    except RowError as exc:
+                        error = str(exc)
+                if error is not None:
+                    self.reject(path, line_no, row, error)
+
+                if len(batch) >= self.batch_size:
+                    self.insert(path, batch)
+                    batch = []
+
+        if batch:
+            self.insert(path, batch)
+
+    def build(self, row):
+        """
+        Validates a row with the views' rules and returns an unsaved instance.
+        """
+        title = str(row.get("title") or "").strip()
+        content = str(row.get("content") or "").strip()
+        publisher_name = str(row.get("publisher") or "").strip()
+        journalist_name = str(row.get("journalist") or "").strip()
+
+        publisher_id = self.publishers.get(publisher_name)
+        if publisher_name and publisher_id is None:
+            raise RowError(f"Unknown publisher: {publisher_name}")
+
+        error = content_error(title, content, publisher_id, publisher_required=True)
+        if error:
+            raise RowError(error)
+        if len(title) > self.title_length:
+            raise RowError(f"Title is longer than {self.title_length} characters.")
+
+        journalist_id = None
+        if journalist_name:
+            journalist_id = self.journalists.get(journalist_name)
+            if journalist_id is None:
+                raise RowError(f"Unknown journalist: {journalist_name}")
+
+        created_at = timezone.now()
+        if row.get("created_at"):
+            created_at = parse_datetime(str(row["created_at"]))
+            if created_at is None:
+                raise RowError(f"Invalid created_at: {row['created_at']}")
+            if timezone.is_naive(created_at):
+                created_at = timezone.make_aware(created_at)
+
+        fields = {
+            "title": title,
+            "content": content,
+            "publisher_id": publisher_id,
+            "journalist_id": journalist_id,
+            "created_at": created_at,
+        }
+        if self.model is Article:
+            fields["approved"] = str(row.get("approved", "")).strip().lower() in TRUE_VALUES
+        return self.model(**fields)
+
+    def insert(self, path, batch):
+        objs = [obj for _, _, obj in batch]
+        try:
+            with transaction.atomic():
+                self.save(objs)
+        except DatabaseError:
+            # Find the offending rows one by one.
+            for line_no, row, obj in batch:
+                obj.pk = None
+                try:
+                    with transaction.atomic():
+                        self.save([obj])
+                except DatabaseError as exc:
+                    self.reject(path, line_no, row, f"Database error: {exc}")
+                else:
+                    self.imported += 1
+        else:
+            self.imported += len(objs)
+
+        if self.verbosity > 1:
+            self.stderr.write(f"{path}: {self.imported} imported, {self.rejected} rejected")
+
+    def save(self, objs):
+        """
+        Inserts ``objs`` and does what the post_save signals would have done.
+        """
+        with explicit_created_at(self.model):
+            self.model.objects.bulk_create(objs)
+
+        if self.model is not Article:
+            return
+
+        approved = [obj for obj in objs if obj.approved]
+        if any(obj.pk is None for obj in approved):
+            self.ids_missing = True
+            return
+
+        ids = [obj.pk for obj in approved]
+        if ids:
+            search.index_articles(ids)
+            enqueue("fanout_articles", article_ids=ids)
+
+    def reject(self, path, line_no, row, error):
+        if self.rejects_file is None:
+            self.rejects_file = open(self.rejects_path, "w", encoding="utf-8")
+        self.rejects_file.write(json.dumps({"file": path, "line": line_no, "error": error, "row": row}) + "\n")
+        self.rejected += 1
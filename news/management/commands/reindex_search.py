@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from news.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the article full-text search index."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000, help="Articles copied per statement.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = get_backend().rebuild(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} articles."))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from news.feeds import sync_reader
+from news.models import CustomUser, FeedEntry
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares every materialized feed with its reader's subscriptions, "
+        "adding missing entries and removing stale ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reader", type=int, action="append", dest="readers", help="Only this reader id (repeatable).")
+        parser.add_argument("--dry-run", action="store_true", help="Report drift without changing anything.")
+
+    def handle(self, *args, **options):
+        # Include anyone who still has entries, e.g. users who stopped being readers.
+        reader_ids = set(CustomUser.objects.filter(role=CustomUser.READER).values_list("id", flat=True))
+        reader_ids |= set(FeedEntry.objects.values_list("reader_id", flat=True).distinct())
+        if options["readers"]:
+            reader_ids &= set(options["readers"])
+
+        added = removed = drifted = 0
+        for reader_id in sorted(reader_ids):
+            a, r = sync_reader(reader_id, dry_run=options["dry_run"])
+            if a or r:
+                drifted += 1
+                self.stdout.write(f"reader {reader_id}: +{a} -{r}")
+            added += a
+            removed += r
+
+        verb = "Would fix" if options["dry_run"] else "Fixed"
+        self.stdout.write(
+            self.style.SUCCESS(f"{verb} {drifted} feed(s): {added} missing, {removed} stale entries.")
+        )
@@ -0,0 +1,89 @@
+import logging
+import threading
+from contextlib import suppress
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+
+from news.jobs import claim, default_worker_id, retry_delay, run_job
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Runs queued background jobs with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=getattr(settings, "JOB_WORKERS", 4),
+            help="Number of concurrent worker threads.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=getattr(settings, "JOB_POLL_INTERVAL", 1.0),
+            help="Seconds an idle worker waits before polling again.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling forever.",
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options["workers"])
+        stop = threading.Event()
+        counts = [0] * workers
+
+        def work(index):
+            worker_id = default_worker_id(index)
+            failures = 0
+            try:
+                while not stop.is_set():
+                    close_old_connections()
+                    try:
+                        jobs = claim(worker_id)
+                        failures = 0
+                        if not jobs:
+                            if options["once"]:
+                                return
+                            stop.wait(options["poll_interval"])
+                            continue
+                        for job in jobs:
+                            run_job(job)
+                            counts[index] += 1
+                    except DatabaseError:
+                        # The database went away or picked this worker as a
+                        # deadlock victim: keep it alive and back off. A job whose
+                        # outcome was not recorded stays RUNNING until the
+                        # visibility timeout hands it out again.
+                        failures += 1
+                        logger.exception("Job worker %s lost the database.", worker_id)
+                        with suppress(DatabaseError):
+                            connection.close()
+                        stop.wait(retry_delay(failures))
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=work, args=(i,), name=f"job-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in threads:
+            t.start()
+
+        self.stdout.write(f"Started {workers} job worker(s).")
+
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for t in threads:
+                t.join()
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {sum(counts)} job(s)."))
@@ -0,0 +1,102 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from news import page_cache, subscriptions
+from news.bench import ensure_publishers, ensure_users, seed_articles, seed_newsletters, seed_subscriptions
+from news.feeds import sync_reader
+from news.models import CustomUser
+from news.search import get_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the database with benchmark publishers, journalists, editors, "
+        "readers, articles and newsletters. Readers get power-law subscription "
+        "counts, so a few follow dozens of sources and most follow one or two."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--publishers", type=int, default=50)
+        parser.add_argument("--journalists", type=int, default=500)
+        parser.add_argument("--editors", type=int, default=5)
+        parser.add_argument("--readers", type=int, default=10000)
+        parser.add_argument("--articles", type=int, default=1000000)
+        parser.add_argument("--newsletters", type=int, default=100000)
+        parser.add_argument("--approved-ratio", type=float, default=0.9, help="Share of articles that are approved.")
+        parser.add_argument("--days", type=int, default=3 * 365, help="Spread content over this many days.")
+        parser.add_argument("--subscription-alpha", type=float, default=1.5, help="Pareto shape of subscription counts.")
+        parser.add_argument("--max-subscriptions", type=int, default=50, help="Cap on one reader's subscriptions.")
+        parser.add_argument(
+            "--feed-readers",
+            type=int,
+            default=1000,
+            help="Materialize the feeds of this many readers (-1 for all). Feeds grow with "
+            "readers x subscriptions x articles, so all of them is rarely affordable at scale.",
+        )
+        parser.add_argument("--skip-search", action="store_true", help="Do not rebuild the search index.")
+        parser.add_argument("--random-seed", type=int, default=0, help="Seed for reproducible data.")
+
+    def handle(self, *args, **options):
+        if options["publishers"] < 1 or options["journalists"] < 1:
+            raise CommandError("At least one publisher and one journalist are needed.")
+        random.seed(options["random_seed"])
+        started = time.perf_counter()
+
+        publisher_ids = ensure_publishers(options["publishers"])
+        journalist_ids = ensure_users(CustomUser.JOURNALIST, options["journalists"])
+        ensure_users(CustomUser.EDITOR, options["editors"])
+        reader_ids = ensure_users(CustomUser.READER, options["readers"])
+        self.step(started, f"{len(publisher_ids)} publishers, {len(journalist_ids)} journalists, {len(reader_ids)} readers")
+
+        subscribed = seed_subscriptions(
+            reader_ids,
+            publisher_ids,
+            journalist_ids,
+            alpha=options["subscription_alpha"],
+            maximum=options["max_subscriptions"],
+        )
+        subscriptions.invalidate(
+            [(subscriptions.PUBLISHER_SUBSCRIBERS, pk) for pk in publisher_ids]
+            + [(subscriptions.JOURNALIST_SUBSCRIBERS, pk) for pk in journalist_ids]
+        )
+        self.step(started, f"{subscribed} subscriptions")
+
+        seed_articles(
+            options["articles"],
+            publisher_ids,
+            journalist_ids,
+            approved_ratio=options["approved_ratio"],
+            days=options["days"],
+            progress=lambda n: self.verbosity_step(options, started, f"{n} articles"),
+        )
+        self.step(started, f"{options['articles']} articles")
+
+        seed_newsletters(options["newsletters"], publisher_ids, journalist_ids, days=options["days"])
+        self.step(started, f"{options['newsletters']} newsletters")
+
+        # bulk_create sends no signals, so index and fan out what the
+        # Article signals would have.
+        if not options["skip_search"]:
+            with transaction.atomic():
+                indexed = get_backend().rebuild()
+            self.step(started, f"indexed {indexed} articles for search")
+
+        feed_readers = reader_ids if options["feed_readers"] < 0 else reader_ids[: options["feed_readers"]]
+        entries = 0
+        for reader_id in feed_readers:
+            added, _ = sync_reader(reader_id, delete_stale=False)
+            entries += added
+        self.step(started, f"{entries} feed entries for {len(feed_readers)} readers")
+
+        page_cache.invalidate_publisher()
+        self.stdout.write(self.style.SUCCESS(f"Seeded in {time.perf_counter() - started:.1f}s."))
+
+    def step(self, started, message):
+        self.stderr.write(f"[{time.perf_counter() - started:7.1f}s] {message}")
+
+    def verbosity_step(self, options, started, message):
+        if options["verbosity"] > 1:
+            self.step(started, message)
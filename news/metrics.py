@@ -0,0 +1,300 @@
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+
+from django.conf import settings
+
+# Every process keeps its counters in its own memory-mapped file under
+# METRICS_DIR and /metrics adds the files up, so web and job worker
+# processes are reported as one service. Files of processes that have
+# exited are still counted: counters and histograms are totals.
+
+_INITIAL_SIZE = 64 * 1024
+_USED = struct.Struct("<Q")
+_LENGTH = struct.Struct("<I")
+_VALUE = struct.Struct("<d")
+_FILE_RE = re.compile(r"metrics_(\d+)\.db")
+
+
+class _MmapDict:
+    """
+    A str -> float map in a file, written by one process and readable by
+    any. Entries are appended and then published by bumping the used
+    size in the header, so readers never see half an entry.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a+b")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < _INITIAL_SIZE:
+            self._file.truncate(_INITIAL_SIZE)
+            size = _INITIAL_SIZE
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._used = _USED.unpack_from(self._map, 0)[0] or _USED.size
+        self._positions = {key: pos for key, _, pos in _entries(self._map, self._used)}
+
+    def increment(self, key, amount):
+        pos = self._positions.get(key)
+        if pos is None:
+            pos = self._append(key)
+        _VALUE.pack_into(self._map, pos, _VALUE.unpack_from(self._map, pos)[0] + amount)
+
+    def _append(self, key):
+        data = key.encode("utf-8")
+        padding = -(_LENGTH.size + len(data)) % 8
+        needed = _LENGTH.size + len(data) + padding + _VALUE.size
+
+        if self._used + needed > len(self._map):
+            size = len(self._map)
+            while self._used + needed > size:
+                size *= 2
+            self._map.close()
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+
+        start = self._used
+        _LENGTH.pack_into(self._map, start, len(data))
+        self._map[start + _LENGTH.size:start + _LENGTH.size + len(data)] = data
+        pos = start + _LENGTH.size + len(data) + padding
+        _VALUE.pack_into(self._map, pos, 0.0)
+
+        self._used = pos + _VALUE.size
+        _USED.pack_into(self._map, 0, self._used)
+        self._positions[key] = pos
+        return pos
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def _entries(data, used):
+    pos = _USED.size
+    while pos < used:
+        length = _LENGTH.unpack_from(data, pos)[0]
+        key = bytes(data[pos + _LENGTH.size:pos + _LENGTH.size + length]).decode("utf-8")
+        value_pos = pos + _LENGTH.size + length + (-(_LENGTH.size + length) % 8)
+        yield key, _VALUE.unpack_from(data, value_pos)[0], value_pos
+        pos = value_pos + _VALUE.size
+
+
+def metrics_dir():
+    return str(getattr(settings, "METRICS_DIR", "/tmp/news_metrics"))
+
+
+_lock = threading.Lock()
+_store = None
+_store_owner = None
+
+
+def _increment(*changes):
+    """
+    Adds each (key, amount) in ``changes`` to this process's file.
+    """
+    global _store, _store_owner
+    # A forked worker must not write into its parent's file.
+    owner = (os.getpid(), metrics_dir())
+    with _lock:
+        if _store_owner != owner:
+            if _store is not None and _store_owner[0] == owner[0]:
+                _store.close()
+            os.makedirs(owner[1], exist_ok=True)
+            _store = _MmapDict(os.path.join(owner[1], f"metrics_{owner[0]}.db"))
+            _store_owner = owner
+        for key, amount in changes:
+            _store.increment(key, amount)
+
+
+# Encoded keys by (sample, labels); as bounded as the series themselves.
+_keys = {}
+
+
+def _key(sample, labels):
+    ident = (sample, tuple(sorted(labels.items())))
+    key = _keys.get(ident)
+    if key is None:
+        key = _keys[ident] = json.dumps([sample, list(ident[1])])
+    return key
+
+
+REGISTRY = []
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _labels(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return {name: str(value) for name, value in labels.items()}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        _increment((_key(self.name, self._labels(labels)), amount))
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        le = _format(self.buckets[index]) if index < len(self.buckets) else "+Inf"
+        _increment(
+            (_key(f"{self.name}_bucket", dict(labels, le=le)), 1),
+            (_key(f"{self.name}_count", labels), 1),
+            (_key(f"{self.name}_sum", labels), value),
+        )
+
+
+def _format(value):
+    return repr(float(value))
+
+
+def collect():
+    """
+    Returns {(sample name, ((label, value), ...)): value} summed over the
+    files of every process.
+    """
+    directory = metrics_dir()
+    totals = {}
+    if not os.path.isdir(directory):
+        return totals
+
+    for filename in os.listdir(directory):
+        if not _FILE_RE.fullmatch(filename):
+            continue
+        try:
+            with open(os.path.join(directory, filename), "rb") as handle:
+                data = handle.read()
+        except OSError:
+            continue
+        if len(data) < _USED.size:
+            continue
+        used = min(_USED.unpack_from(data, 0)[0], len(data))
+        for key, value, _ in _entries(data, used):
+            sample, labels = json.loads(key)
+            ident = (sample, tuple(tuple(pair) for pair in labels))
+            totals[ident] = totals.get(ident, 0) + value
+    return totals
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample_line(sample, labels, value):
+    if labels:
+        inner = ",".join(f'{name}="{_escape(label)}"' for name, label in labels)
+        sample = f"{sample}{{{inner}}}"
+    return f"{sample} {_format(value)}"
+
+
+def render():
+    """
+    Returns every registered metric in the Prometheus text format.
+    """
+    totals = collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+
+        if metric.kind == "counter":
+            for (sample, labels), value in sorted(totals.items()):
+                if sample == metric.name:
+                    lines.append(_sample_line(sample, labels, value))
+            continue
+
+        series = sorted(labels for sample, labels in totals if sample == f"{metric.name}_count")
+        for labels in series:
+            cumulative = 0
+            for le in [_format(bound) for bound in metric.buckets] + ["+Inf"]:
+                bucket_labels = tuple(sorted(labels + (("le", le),)))
+                cumulative += totals.get((f"{metric.name}_bucket", bucket_labels), 0)
+                lines.append(_sample_line(f"{metric.name}_bucket", labels + (("le", le),), cumulative))
+            lines.append(_sample_line(f"{metric.name}_sum", labels, totals[(f"{metric.name}_sum", labels)]))
+            lines.append(_sample_line(f"{metric.name}_count", labels, totals[(f"{metric.name}_count", labels)]))
+    return "\n".join(lines) + "\n"
+
+
+REQUESTS = Counter(
+    "news_http_requests_total",
+    "Requests by URL name, method and status.",
+    ("view", "method", "status"),
+)
+REQUEST_DURATION = Histogram(
+    "news_http_request_duration_seconds",
+    "Request latency by URL name.",
+    ("view",),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_QUERIES = Histogram(
+    "news_http_request_queries",
+    "SQL queries per request by URL name.",
+    ("view",),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+PAGE_CACHE = Counter(
+    "news_page_cache_events_total",
+    "Page cache hits, misses, waits and builds.",
+    ("event",),
+)
+ARTICLES_APPROVED = Counter(
+    "news_articles_approved_total",
+    "Articles approved by editors.",
+)
+JOBS = Counter(
+    "news_jobs_total",
+    "Background jobs run, by kind and result (done, retry or failed).",
+    ("kind", "result"),
+)
+EMAILS = Counter(
+    "news_emails_total",
+    "Subscriber emails by result (sent or failed).",
+    ("result",),
+)
+SOCIAL_POSTS = Counter(
+    "news_social_posts_total",
+    "Social posts by adapter and result (published, failed or short_circuited).",
+    ("adapter", "result"),
+)
+SOCIAL_REQUESTS = Counter(
+    "news_social_requests_total",
+    "HTTP calls to the social API by adapter and event (attempts, successes, failures, retries).",
+    ("adapter", "event"),
+)
+REPLICA_HEALTH_CHECKS = Counter(
+    "news_db_replica_health_checks_total",
+    "Read replica health checks by alias and result (healthy or unhealthy).",
+    ("alias", "result"),
+)
+STREAMS = Counter(
+    "news_article_streams_total",
+    "Article streams served outside Django by event (opened or closed); the difference is the number open.",
+    ("event",),
+)
+SOCIAL_DURATION = Histogram(
+    "news_social_request_duration_seconds",
+    "Social API call latency by adapter.",
+    ("adapter",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
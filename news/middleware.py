@@ -0,0 +1,377 @@
+import cProfile
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction
+from django import shortcuts
+from django.conf import settings
+from django.template import loader
+
+from . import metrics, profiling, replicas
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar("news_request_timing", default=None)
+_observers = ContextVar("news_query_observers", default=())
+
+
+def observe_queries(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection (see apps.py) that
+    reports each query and its duration in ms to the current request's
+    observers.
+
+    Under ASGI the ORM runs in worker threads, each with its own
+    connections, so a wrapper added to the connections of the thread
+    that started the request would miss them; the context variable
+    follows the request into those threads.
+    """
+    observers = _observers.get()
+    if not observers:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        for observer in observers:
+            observer(sql, elapsed)
+
+
+def install_query_observer(sender, connection, **kwargs):
+    """
+    connection_created receiver. A connection object fires it again each
+    time it reconnects, so the wrapper is only added once.
+    """
+    if observe_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(observe_queries)
+
+
+@contextmanager
+def observing(observer):
+    """
+    Reports the queries run inside the block to ``observer(sql, ms)``.
+    """
+    token = _observers.set(_observers.get() + (observer,))
+    try:
+        yield
+    finally:
+        _observers.reset(token)
+
+
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+
+class _QueryCount:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, sql, ms):
+        self.count += 1
+
+
+class MetricsMiddleware:
+    """
+    Counts requests and records their latency and SQL query count per
+    URL name for /metrics.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        queries = _QueryCount()
+        started = time.perf_counter()
+        with observing(queries):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, queries.count)
+        return response
+
+    async def __acall__(self, request):
+        queries = _QueryCount()
+        started = time.perf_counter()
+        with observing(queries):
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, queries.count)
+        return response
+
+    def record(self, request, response, elapsed, queries):
+        # Label by route name, never by path, so the series stay bounded.
+        view = getattr(request.resolver_match, "url_name", None) or "unmatched"
+        method = request.method if request.method in METHODS else "other"
+        metrics.REQUESTS.inc(view=view, method=method, status=response.status_code)
+        metrics.REQUEST_DURATION.observe(elapsed, view=view)
+        metrics.REQUEST_QUERIES.observe(queries, view=view)
+
+
+class ReplicaMiddleware:
+    """
+    Lets GET and HEAD requests read from a replica (see news.replicas).
+
+    A request that writes gets a cookie that keeps its client on the
+    primary for REPLICA_PIN_SECONDS, until the replicas have its changes.
+    Writes from a streamed body come after the headers and pin nothing.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        routing = self.routing(request)
+        with replicas.routed(routing):
+            response = self.get_response(request)
+        return self.finish(response, routing)
+
+    async def __acall__(self, request):
+        routing = self.routing(request)
+        with replicas.routed(routing):
+            response = await self.get_response(request)
+        return self.finish(response, routing)
+
+    def routing(self, request):
+        return replicas.RequestRouting(
+            request.method in ("GET", "HEAD") and replicas.PIN_COOKIE not in request.COOKIES
+        )
+
+    def finish(self, response, routing):
+        if response.streaming and response.is_async:
+            response.streaming_content = replicas.aroute(response.streaming_content, routing)
+        elif response.streaming:
+            response.streaming_content = replicas.route(response.streaming_content, routing)
+
+        if routing.wrote:
+            response.set_cookie(
+                replicas.PIN_COOKIE,
+                "1",
+                max_age=getattr(settings, "REPLICA_PIN_SECONDS", 20),
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+
+class RequestTiming:
+    """
+    What one request spent on SQL, template rendering and its view.
+    """
+
+    def __init__(self):
+        self.query_count = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.view_ms = 0.0
+        self.view_started = None
+        # SQL text -> [calls, total ms]
+        self.queries = {}
+
+    def __call__(self, sql, ms):
+        self.query_count += 1
+        self.db_ms += ms
+        stats = self.queries.setdefault(sql, [0, 0.0])
+        stats[0] += 1
+        stats[1] += ms
+
+    def top_queries(self, count):
+        """
+        Returns the ``count`` statements that took longest in total.
+        """
+        ranked = sorted(self.queries.items(), key=lambda item: item[1][1], reverse=True)
+        return [{"sql": sql[:1000], "calls": calls, "ms": round(ms, 3)} for sql, (calls, ms) in ranked[:count]]
+
+
+@contextmanager
+def timing_templates():
+    """
+    Counts the block as template time in the current request's
+    Server-Timing header.
+    """
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.template_ms += (time.perf_counter() - started) * 1000
+
+
+def render(request, template_name, context=None, *args, **kwargs):
+    """
+    django.shortcuts.render, timed for RequestTimingMiddleware.
+    """
+    with timing_templates():
+        return shortcuts.render(request, template_name, context, *args, **kwargs)
+
+
+def render_to_string(template_name, context=None, *args, **kwargs):
+    """
+    django.template.loader.render_to_string, timed for
+    RequestTimingMiddleware.
+    """
+    with timing_templates():
+        return loader.render_to_string(template_name, context, *args, **kwargs)
+
+
+def _view_started():
+    timing = _current.get()
+    if timing is not None:
+        timing.view_started = time.perf_counter()
+
+
+class RequestTimingMiddleware:
+    """
+    Adds a Server-Timing header with the request's query count, DB time,
+    template time and view time. When the request takes more than
+    REQUEST_TIMING_SLOW_MS it logs a JSON line with the top queries.
+
+    Template time covers what views render through this module's
+    ``render`` and ``render_to_string``. Streamed bodies are generated
+    after the headers are sent, so their queries are not included.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Django runs a sync process_view in a worker thread when the
+            # handler is async; this one would cost every request a hop.
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timing = RequestTiming()
+        token = _current.set(timing)
+        started = time.perf_counter()
+        try:
+            with observing(timing):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, started)
+
+    async def __acall__(self, request):
+        timing = RequestTiming()
+        token = _current.set(timing)
+        started = time.perf_counter()
+        try:
+            with observing(timing):
+                response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, started)
+
+    def finish(self, request, response, timing, started):
+        total_ms = (time.perf_counter() - started) * 1000
+        if timing.view_started is not None:
+            timing.view_ms = (time.perf_counter() - timing.view_started) * 1000
+
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={timing.db_ms:.1f};desc="{timing.query_count} queries"',
+                f"tpl;dur={timing.template_ms:.1f}",
+                f"view;dur={timing.view_ms:.1f}",
+                f"total;dur={total_ms:.1f}",
+            ]
+        )
+
+        if total_ms >= getattr(settings, "REQUEST_TIMING_SLOW_MS", 500):
+            self.log_slow(request, response, timing, total_ms)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _view_started()
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        _view_started()
+
+    def log_slow(self, request, response, timing, total_ms):
+        entry = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "view": getattr(request.resolver_match, "view_name", None),
+            "total_ms": round(total_ms, 1),
+            "view_ms": round(timing.view_ms, 1),
+            "db_ms": round(timing.db_ms, 1),
+            "template_ms": round(timing.template_ms, 1),
+            "queries": timing.query_count,
+            "top_queries": timing.top_queries(getattr(settings, "REQUEST_TIMING_TOP_QUERIES", 5)),
+        }
+        logger.warning(json.dumps(entry), extra={"request_timing": entry})
+
+
+class ProfilingMiddleware:
+    """
+    Runs the view under cProfile when a staff user asks for it with a
+    signed token (see news.profiling), and stores the profile.
+
+    Keep it last in MIDDLEWARE: returning the response from process_view
+    skips the process_view of any middleware listed after it.
+
+    It is sync only, so under ASGI Django runs it in a worker thread.
+    Async views are driven from that thread with async_to_sync: the ORM
+    and other sync work they hand to threads is profiled, what runs on
+    the event loop is not.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not profiling.requested(request):
+            return None
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            if iscoroutinefunction(view_func):
+                response = async_to_sync(view_func)(request, *view_args, **view_kwargs)
+            else:
+                response = view_func(request, *view_args, **view_kwargs)
+            # Streamed bodies (the XML feed) do their work while being
+            # iterated, so produce them inside the profile.
+            if response.streaming and response.is_async:
+                response.streaming_content = async_to_sync(_collect)(response.streaming_content)
+            elif response.streaming:
+                response.streaming_content = list(response.streaming_content)
+        finally:
+            profiler.disable()
+        duration_ms = (time.perf_counter() - started) * 1000
+
+        response["X-Profile"] = profiling.save(profiler, request, response, duration_ms)
+        return response
+
+
+async def _collect(chunks):
+    return [chunk async for chunk in chunks]
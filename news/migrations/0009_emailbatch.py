@@ -0,0 +1,31 @@
+# Generated by Django 5.2.9 on 2026-10-17 06:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0008_feedentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_recipient_id', models.BigIntegerField()),
+                ('last_recipient_id', models.BigIntegerField()),
+                ('recipients', models.PositiveIntegerField()),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='email_batches', to='news.article')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['article', 'last_recipient_id'], name='emailbatch_article_last_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE news_article_fts USING fts5("
+            "title, content, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        # Title matches count ten times as much as content matches.
+        schema_editor.execute(
+            "INSERT INTO news_article_fts(news_article_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')"
+        )
+        schema_editor.execute(
+            "INSERT INTO news_article_fts(rowid, title, content) "
+            "SELECT id, title, content FROM news_article WHERE approved"
+        )
+    elif connection.vendor == "mysql":
+        schema_editor.execute("CREATE FULLTEXT INDEX article_fulltext_idx ON news_article (title, content)")
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS news_article_fts")
+    elif connection.vendor == "mysql":
+        schema_editor.execute("DROP INDEX article_fulltext_idx ON news_article")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0009_emailbatch'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
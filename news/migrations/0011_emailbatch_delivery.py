@@ -0,0 +1,26 @@
+# Generated by Django 5.2.9 on 2026-10-17 08:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0010_article_search'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='emailbatch',
+            name='emailbatch_article_last_idx',
+        ),
+        migrations.AddField(
+            model_name='emailbatch',
+            name='delivery',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='emailbatch',
+            index=models.Index(fields=['delivery', 'last_recipient_id'], name='emailbatch_delivery_last_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-17 08:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0011_emailbatch_delivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailbatch',
+            name='failures',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
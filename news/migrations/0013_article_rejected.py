@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-17 09:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('news', '0012_emailbatch_failures'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='rejected',
+            field=models.BooleanField(default=False),
+        ),
+    ]
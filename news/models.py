@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
 
 class Publisher(models.Model):
@@ -95,8 +96,25 @@ class Article(models.Model):
     )
 
     approved = models.BooleanField(default=False)
+    # Set by an editor's bulk reject; the article leaves the review queue
+    # until its journalist edits it again.
+    rejected = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # One index per listing query shape, each ending in created_at so the
+        # newest-first ORDER BY is read straight off the index:
+        # public list / review queue (approved), editor list (all rows),
+        # reader feed (publisher or journalist, approved) and the
+        # journalist's own list (journalist).
+        indexes = [
+            models.Index(fields=["approved", "created_at"], name="article_appr_created_idx"),
+            models.Index(fields=["created_at"], name="article_created_idx"),
+            models.Index(fields=["publisher", "approved", "created_at"], name="article_pub_appr_created_idx"),
+            models.Index(fields=["journalist", "approved", "created_at"], name="article_jour_appr_created_idx"),
+            models.Index(fields=["journalist", "created_at"], name="article_jour_created_idx"),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -125,5 +143,121 @@ class Newsletter(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="newsletter_created_idx"),
+            models.Index(fields=["journalist", "created_at"], name="newsletter_jour_created_idx"),
+        ]
+
     def __str__(self):
         return self.title
+
+
+class Job(models.Model):
+    """
+    Stores a unit of background work for the job worker.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=255, blank=True)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="job_status_run_after_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class FeedEntry(models.Model):
+    """
+    Stores one approved article in a reader's materialized feed.
+    """
+    reader = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name="feed_entries",
+    )
+
+    article = models.ForeignKey(
+        Article,
+        on_delete=models.CASCADE,
+        related_name="feed_entries",
+    )
+
+    # Copy of article.created_at so a feed page is one range scan of the
+    # (reader, created_at, article) index.
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["reader", "article"], name="feedentry_reader_article_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["reader", "created_at", "article"], name="feedentry_reader_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.reader_id} <- {self.article_id}"
+
+
+class EmailBatch(models.Model):
+    """
+    Stores the outcome of one batch of subscriber emails.
+    """
+    article = models.ForeignKey(
+        Article,
+        on_delete=models.CASCADE,
+        related_name="email_batches",
+    )
+    # One send of a message, such as one job's; an article approved again
+    # later gets a new delivery.
+    delivery = models.CharField(max_length=64, default="")
+
+    # Recipients are sent to in user id order, so a failed delivery can
+    # resume after the last batch that went out.
+    first_recipient_id = models.BigIntegerField()
+    last_recipient_id = models.BigIntegerField()
+
+    recipients = models.PositiveIntegerField()
+    sent = models.PositiveIntegerField(default=0)
+    # [{"recipient": user id, "error": ...}] for messages that were refused;
+    # they are not sent again.
+    failures = models.JSONField(default=list, blank=True)
+    # Set when the connection failed; the batch's recipients are sent to
+    # when the delivery is resumed.
+    error = models.TextField(blank=True)
+    duration_ms = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["delivery", "last_recipient_id"], name="emailbatch_delivery_last_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.article_id}: {self.sent}/{self.recipients}"
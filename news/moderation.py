@@ -0,0 +1,84 @@
+import logging
+
+from django.db import transaction
+
+from . import feed_cache, metrics, page_cache, search, stream
+from .delivery import new_delivery
+from .jobs import enqueue
+from .models import Article
+
+logger = logging.getLogger(__name__)
+
+APPROVE = "approve"
+REJECT = "reject"
+
+
+def _editor_name(editor):
+    return editor.get_username() if editor is not None else "-"
+
+
+def approve_articles(article_ids, editor=None):
+    """
+    Approves the pending articles among ``article_ids`` with one UPDATE.
+
+    update() sends no post_save, so this does what the Article signals do
+    for a single approval, once for the whole batch: index for search,
+    fan out to feeds, bump feed versions and drop cached pages. Subscribers
+    get one email per reader for the batch rather than one per article.
+    Returns the ids that were approved.
+    """
+    with transaction.atomic():
+        pending = Article.objects.select_for_update().filter(pk__in=article_ids, approved=False)
+        rows = list(pending.order_by("id").values_list("id", "publisher_id", "journalist_id"))
+        ids = [pk for pk, _, _ in rows]
+        if not ids:
+            return []
+
+        Article.objects.filter(pk__in=ids, approved=False).update(approved=True, rejected=False)
+
+        search.index_articles(ids)
+        enqueue("fanout_articles", article_ids=ids)
+        enqueue("email_digest", article_ids=ids, delivery=new_delivery())
+        for pk in ids:
+            enqueue("post_to_x", article_id=pk)
+
+        feed_cache.bump(feed_cache.PUBLISHER, {publisher_id for _, publisher_id, _ in rows})
+        feed_cache.bump(feed_cache.JOURNALIST, {journalist_id for _, _, journalist_id in rows})
+        page_cache.invalidate_articles(ids)
+        transaction.on_commit(lambda: metrics.ARTICLES_APPROVED.inc(len(ids)))
+        transaction.on_commit(lambda: stream.publish_approved(ids))
+
+    logger.info("%s approved articles %s", _editor_name(editor), ids)
+    return ids
+
+
+def reject_articles(article_ids, editor=None):
+    """
+    Marks the pending articles among ``article_ids`` rejected. They are
+    kept, with their history, for the journalist to revise. Returns their
+    ids.
+    """
+    with transaction.atomic():
+        pending = Article.objects.select_for_update().filter(pk__in=article_ids, approved=False, rejected=False)
+        ids = list(pending.order_by("id").values_list("id", flat=True))
+        Article.objects.filter(pk__in=ids).update(rejected=True)
+
+    if ids:
+        logger.info("%s rejected articles %s", _editor_name(editor), ids)
+    return ids
+
+
+ACTIONS = {
+    APPROVE: approve_articles,
+    REJECT: reject_articles,
+}
+
+
+def moderate(action, article_ids, editor=None):
+    """
+    Applies a bulk moderation action on behalf of ``editor``. Raises
+    ValueError for unknown actions.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action: {action}")
+    return ACTIONS[action](article_ids, editor=editor)
@@ -0,0 +1,96 @@
+import logging
+
+from .delivery import DeliveryError, deliver_article_email, deliver_digest_email
+from .models import Article
+from .social import SocialPublishError, get_client
+
+logger = logging.getLogger(__name__)
+
+
+def article_message(article):
+    """
+    Returns the subject and body announcing one article.
+    """
+    return f"New Article Approved: {article.title}", f"{article.title}\n\n{article.content}"
+
+
+def digest_message(articles):
+    """
+    Returns the subject and body announcing several articles at once.
+    """
+    if len(articles) == 1:
+        return article_message(articles[0])
+
+    subject = f"{len(articles)} New Articles Approved"
+    body = "\n\n---\n\n".join(f"{article.title}\n\n{article.content}" for article in articles)
+    return subject, body
+
+
+def email_subscribers(article, fail_silently=True, delivery=None):
+    """
+    Sends email about new article to each subscriber.
+    """
+    subject, message = article_message(article)
+
+    try:
+        return deliver_article_email(article, subject, message, delivery)
+    except DeliveryError:
+        if not fail_silently:
+            raise
+        return 0
+
+
+def _approved_article(article_id):
+    return (
+        Article.objects.select_related("publisher", "journalist")
+        .filter(pk=article_id, approved=True)
+        .first()
+    )
+
+
+def email_subscribers_job(article_id, delivery=None):
+    """
+    Job handler that emails subscribers about an approved article.
+    Retries of the job share its ``delivery`` key and resume where the
+    last attempt stopped.
+    """
+    article = _approved_article(article_id)
+    if article is None:
+        return
+
+    email_subscribers(article, fail_silently=False, delivery=delivery)
+
+
+def email_digest_job(article_ids, delivery=None):
+    """
+    Job handler that emails each subscriber once about a batch of approved
+    articles, resuming by ``delivery`` like ``email_subscribers_job``.
+    """
+    articles = list(
+        Article.objects.select_related("publisher", "journalist")
+        .filter(pk__in=article_ids, approved=True)
+        .order_by("id")
+    )
+    deliver_digest_email(articles, digest_message, delivery)
+
+
+def post_to_x_job(article_id):
+    """
+    Job handler that posts an approved article to X.
+    """
+    client = get_client()
+    if not client.adapter.is_configured():
+        return
+
+    article = _approved_article(article_id)
+    if article is None:
+        return
+
+    # Let the job queue retry; an open circuit defers the job the same way.
+    # Errors the client would not retry itself end the job instead.
+    try:
+        client.publish(article)
+    except SocialPublishError as exc:
+        if exc.retryable:
+            raise
+        logger.error("Posting article %s to X failed for good: %s", article.pk, exc)
@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import metrics, replicas
+
+# Rendered public pages are cached under keys that embed generation tokens:
+# any article change starts a new generation of list pages, a publisher
+# change a new generation of detail pages. An article's own detail page is
+# also dropped directly when it changes. Pages are built from the primary
+# database, never from a replica that may be behind (see news.replicas).
+LIST_GENERATION = "news:pages:list-generation"
+PUBLISHER_GENERATION = "news:pages:publisher-generation"
+
+# Striped so that unrelated keys rarely wait on each other.
+_build_locks = [threading.Lock() for _ in range(64)]
+
+
+def _cache():
+    return caches[getattr(settings, "PAGE_CACHE_ALIAS", "default")]
+
+
+def _count(name):
+    metrics.PAGE_CACHE.inc(event=name)
+
+
+def _generation(key):
+    cache = _cache()
+    token = cache.get(key)
+    if token is None:
+        token = uuid.uuid4().hex
+        if not cache.add(key, token, timeout=None):
+            token = cache.get(key, token)
+    return token
+
+
+async def _ageneration(key):
+    cache = _cache()
+    token = await cache.aget(key)
+    if token is None:
+        token = uuid.uuid4().hex
+        if not await cache.aadd(key, token, timeout=None):
+            token = await cache.aget(key, token)
+    return token
+
+
+def _bump(key):
+    _cache().set(key, uuid.uuid4().hex, timeout=None)
+
+
+def _list_variant(after, before):
+    return hashlib.sha256(f"{after}|{before}|{settings.PAGE_SIZE}".encode()).hexdigest()
+
+
+def article_list_key(after, before):
+    """
+    Returns the cache key for one page of the public article list.
+    """
+    return f"news:pages:list:{_generation(LIST_GENERATION)}:{_list_variant(after, before)}"
+
+
+async def aarticle_list_key(after, before):
+    return f"news:pages:list:{await _ageneration(LIST_GENERATION)}:{_list_variant(after, before)}"
+
+
+def article_detail_key(pk):
+    """
+    Returns the cache key for a public article page.
+    """
+    return f"news:pages:detail:{pk}:{_generation(PUBLISHER_GENERATION)}"
+
+
+async def aarticle_detail_key(pk):
+    return f"news:pages:detail:{pk}:{await _ageneration(PUBLISHER_GENERATION)}"
+
+
+def _now_and_on_commit(drop):
+    # Dropped again on commit, so a request that rendered the old rows
+    # before our transaction committed cannot leave them cached.
+    drop()
+    transaction.on_commit(drop)
+
+
+def invalidate_article(pk):
+    """
+    Drops cached pages that may show an article.
+    """
+    invalidate_articles([pk])
+
+
+def invalidate_articles(pks):
+    """
+    Drops cached pages that may show any of several articles.
+    """
+
+    def drop():
+        _cache().delete_many([article_detail_key(pk) for pk in pks])
+        _bump(LIST_GENERATION)
+
+    _now_and_on_commit(drop)
+
+
+def invalidate_publisher():
+    """
+    Drops cached pages that may show a publisher.
+    """
+
+    def drop():
+        _bump(PUBLISHER_GENERATION)
+        _bump(LIST_GENERATION)
+
+    _now_and_on_commit(drop)
+
+
+def _build_shared(cache, key, build, lock_timeout):
+    lock_key = f"{key}:lock"
+
+    if cache.add(lock_key, os.getpid(), lock_timeout):
+        try:
+            _count("builds")
+            with replicas.primary():
+                value = build()
+            cache.set(key, value, getattr(settings, "PAGE_CACHE_TIMEOUT", 300))
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    # Another process is rebuilding this key.
+    _count("waits")
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if cache.get(lock_key) is None:
+            break
+
+    _count("builds")
+    with replicas.primary():
+        return build()
+
+
+def get_or_build(key, build):
+    """
+    Returns the cached value for ``key``, building and storing it on a miss.
+
+    Only one caller rebuilds a missing key at a time. Threads of one process
+    queue on a local lock; across processes the first caller takes a short
+    lock in the cache and the others poll for its result, building
+    themselves only if it does not show up within PAGE_CACHE_LOCK_TIMEOUT.
+    The cache lock relies on an atomic ``add``, as Redis, Memcached and
+    locmem have; the file-based backend's is not.
+    """
+    cache = _cache()
+    value = cache.get(key)
+    if value is not None:
+        _count("hits")
+        return value
+
+    _count("misses")
+    lock_timeout = getattr(settings, "PAGE_CACHE_LOCK_TIMEOUT", 10)
+    lock = _build_locks[hash(key) % len(_build_locks)]
+
+    acquired = lock.acquire(blocking=False)
+    waited = not acquired
+    if waited:
+        _count("waits")
+        acquired = lock.acquire(timeout=lock_timeout)
+
+    try:
+        if waited:
+            value = cache.get(key)
+            if value is not None:
+                return value
+        return _build_shared(cache, key, build, lock_timeout)
+    finally:
+        if acquired:
+            lock.release()
+
+
+async def aget_or_build(key, build):
+    """
+    Async version of ``get_or_build`` for a coroutine ``build``.
+
+    Coroutines do not hold a thread while they wait, so there is no local
+    lock: every caller goes through the lock in the cache and polls for
+    the result with asyncio.sleep.
+    """
+    cache = _cache()
+    value = await cache.aget(key)
+    if value is not None:
+        _count("hits")
+        return value
+
+    _count("misses")
+    lock_timeout = getattr(settings, "PAGE_CACHE_LOCK_TIMEOUT", 10)
+    lock_key = f"{key}:lock"
+
+    if await cache.aadd(lock_key, os.getpid(), lock_timeout):
+        try:
+            _count("builds")
+            with replicas.primary():
+                value = await build()
+            await cache.aset(key, value, getattr(settings, "PAGE_CACHE_TIMEOUT", 300))
+            return value
+        finally:
+            await cache.adelete(lock_key)
+
+    _count("waits")
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        value = await cache.aget(key)
+        if value is not None:
+            return value
+        if await cache.aget(lock_key) is None:
+            break
+
+    _count("builds")
+    with replicas.primary():
+        return await build()
@@ -0,0 +1,157 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousOperation
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a client sends a cursor we did not issue.
+    """
+
+
+def encode_cursor(created_at, pk):
+    """
+    Builds an opaque cursor pointing at one row of a (created_at, id) ordering.
+    """
+    raw = json.dumps([created_at.isoformat(), pk], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (created_at, id) pair stored in a cursor.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, TypeError, ValueError, UnicodeError) as exc:
+        raise InvalidCursor("Invalid cursor.") from exc
+
+
+def after_cursor(qs, cursor, created_field="created_at", id_field="id"):
+    """
+    Restricts a newest-first queryset to the rows that come after a cursor.
+
+    This is a keyset (seek) condition, so the database can continue an
+    index scan from the cursor instead of counting past an OFFSET.
+    """
+    created_at, pk = decode_cursor(cursor)
+    return qs.filter(
+        Q(**{f"{created_field}__lt": created_at})
+        | Q(**{created_field: created_at, f"{id_field}__lt": pk})
+    )
+
+
+def before_cursor(qs, cursor, created_field="created_at", id_field="id"):
+    """
+    Restricts a queryset to the rows that come before (are newer than) a cursor.
+    """
+    created_at, pk = decode_cursor(cursor)
+    return qs.filter(
+        Q(**{f"{created_field}__gt": created_at})
+        | Q(**{created_field: created_at, f"{id_field}__gt": pk})
+    )
+
+
+class KeysetPage:
+    """
+    One page of a newest-first (created_at, id) listing.
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _keyset_query(request, qs, page_size):
+    after = request.GET.get("after")
+    before = request.GET.get("before")
+
+    try:
+        if before:
+            return before_cursor(qs, before).order_by("created_at", "id")[: page_size + 1], after, before
+        if after:
+            qs = after_cursor(qs, after)
+        return qs.order_by("-created_at", "-id")[: page_size + 1], after, before
+    except InvalidCursor as exc:
+        raise SuspiciousOperation(str(exc)) from exc
+
+
+def _keyset_page(rows, page_size, after, before):
+    if before:
+        has_newer = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+        has_older = True
+    else:
+        has_older = len(rows) > page_size
+        rows = rows[:page_size]
+        has_newer = bool(after)
+
+    next_cursor = previous_cursor = None
+    if rows and has_older:
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].pk)
+    if rows and has_newer:
+        previous_cursor = encode_cursor(rows[0].created_at, rows[0].pk)
+
+    return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+def paginate_keyset(request, qs, page_size=None):
+    """
+    Returns the page of ``qs`` selected by the ``after``/``before`` query
+    parameters, newest first.
+
+    At most ``page_size + 1`` rows are fetched; the extra row only tells us
+    whether there is another page in that direction.
+    """
+    page_size = page_size or settings.PAGE_SIZE
+    rows, after, before = _keyset_query(request, qs, page_size)
+    return _keyset_page(list(rows), page_size, after, before)
+
+
+async def apaginate_keyset(request, qs, page_size=None):
+    """
+    Async version of ``paginate_keyset``.
+    """
+    page_size = page_size or settings.PAGE_SIZE
+    rows, after, before = _keyset_query(request, qs, page_size)
+    return _keyset_page([row async for row in rows], page_size, after, before)
+
+
+def parse_limit(value, maximum):
+    """
+    Validates a ``limit`` query parameter. Returns None when it is absent.
+    """
+    if value in (None, ""):
+        return None
+
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("Limit must be a number.") from None
+
+    if limit < 1:
+        raise ValueError("Limit must be positive.")
+    return min(limit, maximum)
@@ -0,0 +1,193 @@
+import json
+import os
+import pstats
+import re
+import uuid
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+HEADER = "X-Profile-Token"
+PARAM = "_profile"
+SALT = "news.profiling"
+
+KINDS = {"pstats": ".pstats", "collapsed": ".collapsed"}
+NAME_RE = re.compile(r"[0-9]{8}T[0-9]{6}-[\w-]+-[0-9a-f]{8}")
+
+# Collapsed stacks are rebuilt from cProfile's caller/callee edges, which
+# can fan out; paths deeper than this or cheaper than a microsecond are
+# dropped.
+MAX_DEPTH = 100
+
+
+def profile_dir():
+    return str(getattr(settings, "PROFILE_DIR", "/tmp/news_profiles"))
+
+
+def make_token(user):
+    """
+    Returns a signed token that lets ``user`` profile their own requests.
+    """
+    return signing.TimestampSigner(salt=SALT).sign(str(user.pk))
+
+
+def requested(request):
+    """
+    True when a staff user sent a valid, unexpired profiling token of
+    their own in the X-Profile-Token header or the _profile parameter.
+    """
+    token = request.headers.get(HEADER) or request.GET.get(PARAM)
+    user = getattr(request, "user", None)
+    if not token or user is None or not user.is_authenticated or not user.is_staff:
+        return False
+    try:
+        value = signing.TimestampSigner(salt=SALT).unsign(
+            token, max_age=getattr(settings, "PROFILE_TOKEN_MAX_AGE", 3600)
+        )
+    except signing.BadSignature:
+        return False
+    return value == str(user.pk)
+
+
+def _label(func):
+    filename, lineno, name = func
+    if filename == "~":
+        return name.replace(";", ",")
+    return f"{name} ({os.path.basename(filename)}:{lineno})".replace(";", ",")
+
+
+def collapsed_stacks(stats):
+    """
+    Returns {"frame;frame;frame": microseconds} for flamegraph.pl/speedscope.
+
+    cProfile only records caller -> callee edges, so a function reached by
+    several paths has its time split between them in proportion to each
+    caller's share.
+    """
+    entries = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    stacks = {}
+
+    def visit(func, path, labels, time):
+        _, _, own, total, _ = entries[func]
+        share = time / total if total else 0
+        labels = labels + [_label(func)]
+        key = ";".join(labels)
+        stacks[key] = stacks.get(key, 0) + own * share
+
+        if len(labels) >= MAX_DEPTH:
+            return
+        path = path | {func}
+        for callee, edge_total in callees.get(func, ()):
+            child = edge_total * share
+            if callee not in path and child >= 1e-6:
+                visit(callee, path, labels, child)
+
+    for func, (_, _, _, total, callers) in entries.items():
+        if not callers:
+            visit(func, frozenset(), [], total)
+
+    return {key: round(seconds * 1e6) for key, seconds in stacks.items() if round(seconds * 1e6) > 0}
+
+
+def _public_path(request):
+    params = request.GET.copy()
+    params.pop(PARAM, None)
+    query = urlencode(sorted(params.lists()), doseq=True)
+    return f"{request.path}?{query}" if query else request.path
+
+
+def _write_collapsed(pstats_path, path):
+    stats = pstats.Stats(pstats_path)
+    partial = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(partial, "w", encoding="utf-8") as handle:
+        for stack, micros in sorted(collapsed_stacks(stats).items()):
+            handle.write(f"{stack} {micros}\n")
+    # Whole or not at all, should two downloads build it at once.
+    os.replace(partial, path)
+
+
+def save(profiler, request, response, duration_ms):
+    """
+    Writes a profile as <name>.pstats and <name>.json under PROFILE_DIR,
+    prunes old ones and returns the name. The collapsed stacks are built
+    on first download, outside the profiled request.
+    """
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    view = getattr(request.resolver_match, "url_name", None) or "view"
+    name = f"{timezone.now():%Y%m%dT%H%M%S}-{view}-{uuid.uuid4().hex[:8]}"
+    base = os.path.join(directory, name)
+
+    profiler.dump_stats(base + KINDS["pstats"])
+    stats = pstats.Stats(profiler)
+
+    meta = {
+        "name": name,
+        "created_at": timezone.now().isoformat(),
+        "method": request.method,
+        "path": _public_path(request),
+        "view": view,
+        "status": response.status_code,
+        "user": request.user.get_username(),
+        "duration_ms": round(duration_ms, 1),
+        "calls": stats.total_calls,
+    }
+    with open(base + ".json", "w", encoding="utf-8") as handle:
+        json.dump(meta, handle)
+
+    prune(getattr(settings, "PROFILE_KEEP", 200))
+    return name
+
+
+def list_profiles():
+    """
+    Returns the metadata of the stored profiles, newest first.
+    """
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+
+    profiles = []
+    for filename in os.listdir(directory):
+        stem, ext = os.path.splitext(filename)
+        if ext != ".json" or not NAME_RE.fullmatch(stem):
+            continue
+        try:
+            with open(os.path.join(directory, filename), encoding="utf-8") as handle:
+                profiles.append(json.load(handle))
+        except (OSError, ValueError):
+            continue
+    return sorted(profiles, key=lambda meta: meta["name"], reverse=True)
+
+
+def profile_path(name, kind):
+    """
+    Returns the file holding a profile, or None if there is no such profile.
+    Collapsed stacks are built from the pstats file the first time.
+    """
+    if kind not in KINDS or not NAME_RE.fullmatch(name):
+        return None
+    path = os.path.join(profile_dir(), name + KINDS[kind])
+    if kind == "collapsed" and not os.path.exists(path):
+        pstats_path = profile_path(name, "pstats")
+        if pstats_path is None:
+            return None
+        _write_collapsed(pstats_path, path)
+    return path if os.path.exists(path) else None
+
+
+def prune(keep):
+    for meta in list_profiles()[keep:]:
+        for ext in [*KINDS.values(), ".json"]:
+            try:
+                os.remove(os.path.join(profile_dir(), meta["name"] + ext))
+            except FileNotFoundError:
+                pass
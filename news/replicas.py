@@ -0,0 +1,211 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# ReplicaMiddleware lets GET and HEAD requests read from a replica; every
+# other query, and every query outside a request (jobs, commands), goes
+# to the primary. The request's RequestRouting sits in a context
+# variable, which follows it into the threads the async ORM runs in.
+#
+# Set by a request that wrote; while the client sends it back, its
+# requests read from the primary.
+PIN_COOKIE = "news_primary"
+
+_routing = ContextVar("news_replica_routing", default=None)
+_DONE = object()
+
+
+class RequestRouting:
+    """
+    Where one request reads from. The replica is picked on the first read
+    so the request sees a single replica; once it writes, it reads from
+    the primary.
+    """
+
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.alias = None
+        self.wrote = False
+
+
+@contextmanager
+def routed(routing):
+    token = _routing.set(routing)
+    try:
+        yield
+    finally:
+        _routing.reset(token)
+
+
+@contextmanager
+def primary():
+    """
+    Sends the reads inside the block to the primary. For what outlives
+    the request, such as cache entries: built from a replica that has not
+    applied the write that invalidated the entry yet, one would stay stale
+    after the replica caught up.
+    """
+    routing = _routing.get()
+    if routing is None or not routing.use_replica:
+        yield
+        return
+
+    inner = RequestRouting(False)
+    token = _routing.set(inner)
+    try:
+        yield
+    finally:
+        _routing.reset(token)
+        routing.wrote = routing.wrote or inner.wrote
+
+
+def route(chunks, routing):
+    """
+    Yields ``chunks``, producing each one under ``routing``. For streamed
+    response bodies, which are generated after the middleware returns.
+    """
+    chunks = iter(chunks)
+    while True:
+        with routed(routing):
+            chunk = next(chunks, _DONE)
+        if chunk is _DONE:
+            return
+        yield chunk
+
+
+async def aroute(chunks, routing):
+    """
+    Async version of ``route``.
+    """
+    chunks = aiter(chunks)
+    while True:
+        with routed(routing):
+            chunk = await anext(chunks, _DONE)
+        if chunk is _DONE:
+            return
+        yield chunk
+
+
+# Alias -> (healthy, monotonic time of the check). None until the first
+# check of the alias has finished.
+_health = {}
+_health_lock = threading.Lock()
+
+
+def check_replica(alias):
+    """
+    Returns whether ``alias`` answers a query and, on MySQL, trails the
+    primary by at most REPLICA_MAX_LAG seconds.
+    """
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor != "mysql":
+                cursor.execute("SELECT 1")
+                healthy = True
+            else:
+                cursor.execute("SHOW REPLICA STATUS")
+                row = cursor.fetchone()
+                if row is None:
+                    # Not replicating from anything, so nothing to trail.
+                    healthy = True
+                else:
+                    status = dict(zip([column[0] for column in cursor.description], row))
+                    # NULL while replication is stopped.
+                    lag = status.get("Seconds_Behind_Source")
+                    healthy = lag is not None and lag <= getattr(settings, "REPLICA_MAX_LAG", 10)
+                    if not healthy:
+                        logger.warning("Replica %s is %s seconds behind.", alias, lag)
+    except DatabaseError as exc:
+        logger.warning("Replica %s failed its health check: %s", alias, exc)
+        with suppress(DatabaseError):
+            connection.close()
+        healthy = False
+
+    metrics.REPLICA_HEALTH_CHECKS.inc(alias=alias, result="healthy" if healthy else "unhealthy")
+    return healthy
+
+
+def is_healthy(alias):
+    """
+    Returns the result of the last health check of ``alias``, checking it
+    again once it is REPLICA_CHECK_INTERVAL seconds old. One thread runs
+    the check while the others keep using the previous result.
+    """
+    now = time.monotonic()
+    with _health_lock:
+        healthy, checked_at = _health.get(alias, (None, None))
+        due = checked_at is None or now - checked_at >= getattr(settings, "REPLICA_CHECK_INTERVAL", 5)
+        if due:
+            _health[alias] = (healthy, now)
+    if not due:
+        return bool(healthy)
+
+    healthy = check_replica(alias)
+    with _health_lock:
+        _health[alias] = (healthy, now)
+    return healthy
+
+
+def pick_replica():
+    """
+    Returns a random healthy replica alias, or None.
+    """
+    healthy = [alias for alias in getattr(settings, "REPLICA_DATABASES", []) if is_healthy(alias)]
+    return random.choice(healthy) if healthy else None
+
+
+def read_alias():
+    routing = _routing.get()
+    if routing is None or not routing.use_replica or routing.wrote:
+        return DEFAULT_DB_ALIAS
+    # Reads inside a transaction on the primary must see its writes.
+    if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+    if routing.alias is None:
+        routing.alias = pick_replica() or DEFAULT_DB_ALIAS
+    return routing.alias
+
+
+class ReplicaRouter:
+    """
+    Sends reads where the request's routing says and everything else to
+    the primary.
+
+    Both methods always name an alias: for None Django would fall back to
+    the database an instance was loaded from, saving objects read from a
+    replica to that replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the primary's rows, so objects from any of them
+        # may be related.
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, "REPLICA_DATABASES", [])}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        if db in getattr(settings, "REPLICA_DATABASES", []):
+            return False
+        return None
@@ -0,0 +1,281 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Article
+from .serializers import article_rows
+
+# Matched terms are marked with these control characters in snippets and
+# turned into <mark> only after the text has been escaped.
+MARK_START = "\x02"
+MARK_END = "\x03"
+ELLIPSIS = "…"
+
+MAX_TERMS = 10
+
+FTS_TABLE = "news_article_fts"
+
+
+def query_terms(query):
+    """
+    Splits a search box string into lower-cased word terms.
+    """
+    return re.findall(r"\w+", (query or "").lower())[:MAX_TERMS]
+
+
+def _chunks(values, size=500):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def _text_snippet(text, terms, words=None):
+    """
+    Cuts a window of ``words`` words around the first matched term and
+    marks every term match in it.
+    """
+    words = words or getattr(settings, "SEARCH_SNIPPET_WORDS", 16)
+    tokens = text.replace(MARK_START, "").replace(MARK_END, "").split()
+    pattern = None
+    if terms:
+        pattern = re.compile(r"\b(?:%s)\b" % "|".join(re.escape(term) for term in terms), re.IGNORECASE)
+
+    first = 0
+    if pattern:
+        first = next((i for i, token in enumerate(tokens) if pattern.search(token)), 0)
+    start = max(0, first - words // 2)
+    window = " ".join(tokens[start:start + words])
+
+    if pattern:
+        window = pattern.sub(lambda m: f"{MARK_START}{m.group(0)}{MARK_END}", window)
+    if start > 0:
+        window = ELLIPSIS + window
+    if start + words < len(tokens):
+        window += ELLIPSIS
+    return window
+
+
+def highlight(snippet):
+    """
+    Returns a backend snippet as safe HTML with matches in <mark>.
+    """
+    html = escape(snippet).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+    return mark_safe(html)
+
+
+class SearchBackend:
+    """
+    Full-text index over approved articles.
+
+    ``search`` returns (article id, score) pairs for articles matching every
+    term, best match first.
+    """
+
+    def index(self, article_ids):
+        """
+        Brings the given articles' index entries up to date.
+        """
+
+    def remove(self, article_ids):
+        """
+        Drops the given articles from the index.
+        """
+
+    def rebuild(self, batch_size=10000):
+        """
+        Rebuilds the whole index. Returns the number of articles indexed.
+        """
+        return Article.objects.filter(approved=True).count()
+
+    def search(self, terms, limit, offset=0):
+        raise NotImplementedError
+
+
+class SQLiteBackend(SearchBackend):
+    """
+    FTS5 table holding the title and content of approved articles, keyed
+    by article id. Ranked by bm25 with title matches weighted up.
+    """
+
+    def remove(self, article_ids):
+        with connection.cursor() as cursor:
+            for chunk in _chunks(article_ids):
+                cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({_placeholders(chunk)})", chunk)
+
+    def index(self, article_ids):
+        self.remove(article_ids)
+        with connection.cursor() as cursor:
+            for chunk in _chunks(article_ids):
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE}(rowid, title, content) "
+                    f"SELECT id, title, content FROM news_article WHERE approved AND id IN ({_placeholders(chunk)})",
+                    chunk,
+                )
+
+    def rebuild(self, batch_size=10000):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM news_article")
+            last_id = cursor.fetchone()[0]
+            for start in range(0, last_id, batch_size):
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE}(rowid, title, content) "
+                    "SELECT id, title, content FROM news_article WHERE approved AND id > %s AND id <= %s",
+                    [start, start + batch_size],
+                )
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+            cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+            return cursor.fetchone()[0]
+
+    def search(self, terms, limit, offset=0):
+        if not terms:
+            return []
+
+        # Terms are \w+ only, so quoting them is enough to keep user input
+        # out of the FTS5 query syntax. bm25 is computed only for the newest
+        # SEARCH_CANDIDATES matches: scoring every match of a common word
+        # would take seconds on a large table.
+        match = " ".join(f'"{term}"' for term in terms)
+        candidates = getattr(settings, "SEARCH_CANDIDATES", 1000)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid, score FROM ("
+                f"SELECT rowid, rank AS score FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                "ORDER BY rowid DESC LIMIT %s"
+                ") ORDER BY score, rowid DESC LIMIT %s OFFSET %s",
+                [match, candidates, limit, offset],
+            )
+            return [(pk, -score) for pk, score in cursor.fetchall()]
+
+
+class MySQLBackend(SearchBackend):
+    """
+    InnoDB FULLTEXT index on news_article(title, content). MySQL keeps it
+    up to date itself, so only searching needs code here.
+    """
+
+    def __init__(self):
+        # (innodb_ft_min_token_size, stopwords), read on first search.
+        self._unindexed = None
+
+    def rebuild(self, batch_size=10000):
+        with connection.cursor() as cursor:
+            cursor.execute("OPTIMIZE TABLE news_article")
+        return super().rebuild(batch_size)
+
+    def _load_unindexed(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT @@innodb_ft_min_token_size, @@innodb_ft_enable_stopword, @@innodb_ft_server_stopword_table"
+            )
+            min_size, stopwords_enabled, stopword_table = cursor.fetchone()
+            stopwords = set()
+            if stopwords_enabled:
+                if stopword_table:
+                    # Named as db_name/table_name.
+                    table = ".".join(f"`{part}`" for part in stopword_table.split("/", 1))
+                else:
+                    table = "INFORMATION_SCHEMA.INNODB_FT_DEFAULT_STOPWORD"
+                cursor.execute(f"SELECT value FROM {table}")
+                stopwords = {value.lower() for (value,) in cursor.fetchall()}
+        return min_size, stopwords
+
+    def boolean_query(self, terms):
+        """
+        Returns the BOOLEAN MODE query requiring every term the index
+        holds. Words shorter than innodb_ft_min_token_size and stopwords
+        are not indexed, so requiring one would match nothing; they are
+        left out. Empty if no term is left.
+        """
+        if self._unindexed is None:
+            self._unindexed = self._load_unindexed()
+        min_size, stopwords = self._unindexed
+        return " ".join(f"+{term}" for term in terms if len(term) >= min_size and term not in stopwords)
+
+    def search(self, terms, limit, offset=0):
+        match = self.boolean_query(terms) if terms else ""
+        if not match:
+            return []
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, MATCH(title, content) AGAINST (%s IN BOOLEAN MODE) AS score "
+                "FROM news_article "
+                "WHERE approved AND MATCH(title, content) AGAINST (%s IN BOOLEAN MODE) "
+                "ORDER BY score DESC, id DESC LIMIT %s OFFSET %s",
+                [match, match, limit, offset],
+            )
+            return cursor.fetchall()
+
+
+class ScanBackend(SearchBackend):
+    """
+    Fallback for databases without a native index: a LIKE scan, newest first.
+    """
+
+    def search(self, terms, limit, offset=0):
+        if not terms:
+            return []
+
+        qs = Article.objects.filter(approved=True)
+        for term in terms:
+            qs = qs.filter(Q(title__icontains=term) | Q(content__icontains=term))
+        return [(pk, 0.0) for pk in qs.order_by("-created_at", "-id").values_list("id", flat=True)[offset:offset + limit]]
+
+
+BACKENDS = {
+    "sqlite": SQLiteBackend,
+    "mysql": MySQLBackend,
+}
+
+_backends = {}
+
+
+def get_backend():
+    """
+    Returns the search backend for the default database's engine.
+    """
+    vendor = connection.vendor
+    if vendor not in _backends:
+        _backends[vendor] = BACKENDS.get(vendor, ScanBackend)()
+    return _backends[vendor]
+
+
+def index_articles(article_ids):
+    get_backend().index(article_ids)
+
+
+def remove_articles(article_ids):
+    get_backend().remove(article_ids)
+
+
+def search_articles(query, limit, offset=0):
+    """
+    Returns ranked rows shaped like ``article_rows`` plus ``score`` and an
+    HTML ``snippet``.
+    """
+    terms = query_terms(query)
+    hits = get_backend().search(terms, limit, offset)
+    if not hits:
+        return []
+
+    rows = {
+        row["id"]: row
+        for row in article_rows(Article.objects.filter(pk__in=[pk for pk, _ in hits], approved=True))
+    }
+
+    results = []
+    for pk, score in hits:
+        row = rows.get(pk)
+        if row is not None:
+            results.append(dict(row, score=score, snippet=highlight(_text_snippet(row["content"], terms))))
+    return results
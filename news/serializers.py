@@ -1,4 +1,49 @@
-import xml.etree.ElementTree as ET
+import json
+
+from .pagination import encode_cursor
+
+# Columns the feed serializers read. ``article_rows`` fetches exactly these
+# in one query, joining publisher and journalist, so serializing a feed
+# never builds model instances or follows a foreign key per row.
+ARTICLE_FIELDS = (
+    "id",
+    "title",
+    "content",
+    "approved",
+    "created_at",
+    "publisher__name",
+    "journalist__username",
+)
+
+
+def article_rows(qs):
+    """
+    Projects an article queryset onto the columns the serializers need.
+    """
+    return qs.values(*ARTICLE_FIELDS)
+
+
+# The same columns reached from a FeedEntry row.
+FEED_FIELDS = tuple(f"article__{name}" for name in ARTICLE_FIELDS)
+
+
+def feed_rows(qs, chunk_size):
+    """
+    Streams a FeedEntry queryset as rows shaped like ``article_rows``.
+    """
+    for row in qs.values_list(*FEED_FIELDS).iterator(chunk_size=chunk_size):
+        yield dict(zip(ARTICLE_FIELDS, row))
+
+
+async def afeed_rows(qs, chunk_size):
+    """
+    ``feed_rows`` with the async ORM.
+    """
+    # values_list().aiterator() runs the query on the event loop in
+    # Django 5.2, which raises SynchronousOnlyOperation; values() fetches
+    # every chunk in a worker thread.
+    async for row in qs.values(*FEED_FIELDS).aiterator(chunk_size=chunk_size):
+        yield {name: row[field] for name, field in zip(ARTICLE_FIELDS, FEED_FIELDS)}
 
 
 def serialize_article(article):
@@ -13,17 +58,156 @@ def serialize_article(article):
     }
 
 
+def serialize_article_row(row):
+    """
+    Same output as ``serialize_article`` for a row from ``article_rows``.
+    """
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "content": row["content"],
+        "approved": row["approved"],
+        "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+        "publisher": row["publisher__name"],
+        "journalist": row["journalist__username"],
+    }
+
+
+NEWSLETTER_FIELDS = (
+    "id",
+    "title",
+    "content",
+    "created_at",
+    "publisher__name",
+    "journalist__username",
+)
+
+
+def serialize_newsletter_row(row):
+    """
+    Serializes a ``values(*NEWSLETTER_FIELDS)`` row like ``serialize_article_row``.
+    """
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "content": row["content"],
+        "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+        "publisher": row["publisher__name"],
+        "journalist": row["journalist__username"],
+    }
+
+
+def _xml_escape(text):
+    # Same replacements ElementTree applies to element text.
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _xml_element(tag, text):
+    if not text:
+        return f"<{tag} />"
+    return f"<{tag}>{_xml_escape(text)}</{tag}>"
+
+
+def serialize_article_to_xml(row):
+    """
+    Returns one ``<article>`` element as UTF-8 bytes.
+    """
+    parts = [
+        _xml_element("id", str(row["id"])),
+        _xml_element("title", row["title"]),
+        _xml_element("content", row["content"]),
+        _xml_element("approved", "true" if row["approved"] else "false"),
+        _xml_element("created_at", row["created_at"].isoformat() if row["created_at"] else ""),
+        _xml_element("publisher", row["publisher__name"] or ""),
+        _xml_element("journalist", row["journalist__username"] or ""),
+    ]
+    return ("<article>" + "".join(parts) + "</article>").encode("utf-8", "xmlcharrefreplace")
+
+
+def iter_articles_xml(rows):
+    """
+    Yields the XML feed document in chunks, one article at a time.
+
+    The output is byte-for-byte what ``ET.tostring`` produced for the whole
+    tree, but only one article is held in memory at once.
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+
+    if first is None:
+        yield b"<articles />"
+        return
+
+    yield b"<articles>"
+    yield serialize_article_to_xml(first)
+    for row in rows:
+        yield serialize_article_to_xml(row)
+    yield b"</articles>"
+
+
+async def aiter_articles_xml(rows):
+    """
+    ``iter_articles_xml`` for an async iterator of rows.
+    """
+    first = await anext(rows, None)
+
+    if first is None:
+        yield b"<articles />"
+        return
+
+    yield b"<articles>"
+    yield serialize_article_to_xml(first)
+    async for row in rows:
+        yield serialize_article_to_xml(row)
+    yield b"</articles>"
+
+
 def serialize_articles_to_xml(qs):
-    root = ET.Element("articles")
-
-    for a in qs:
-        node = ET.SubElement(root, "article")
-        ET.SubElement(node, "id").text = str(a.id)
-        ET.SubElement(node, "title").text = a.title
-        ET.SubElement(node, "content").text = a.content
-        ET.SubElement(node, "approved").text = "true" if a.approved else "false"
-        ET.SubElement(node, "created_at").text = a.created_at.isoformat() if a.created_at else ""
-        ET.SubElement(node, "publisher").text = a.publisher.name if a.publisher else ""
-        ET.SubElement(node, "journalist").text = a.journalist.username if a.journalist else ""
-
-    return ET.tostring(root, encoding="utf-8")
\ No newline at end of file
+    return b"".join(iter_articles_xml(article_rows(qs).iterator()))
+
+
+def iter_articles_json(rows, limit=None):
+    """
+    Yields the JSON feed document in chunks, one article at a time.
+
+    When ``limit`` is set, ``rows`` should hold up to ``limit + 1`` rows;
+    the extra row only tells us that another page exists.
+    """
+    yield b'{"articles": ['
+
+    last = None
+    for count, row in enumerate(rows):
+        if limit is not None and count >= limit:
+            yield b'], "next_cursor": '
+            yield json.dumps(encode_cursor(last["created_at"], last["id"])).encode()
+            yield b"}"
+            return
+
+        prefix = b", " if count else b""
+        yield prefix + json.dumps(serialize_article_row(row)).encode()
+        last = row
+
+    yield b'], "next_cursor": null}'
+
+
+async def aiter_articles_json(rows, limit=None):
+    """
+    ``iter_articles_json`` for an async iterator of rows.
+    """
+    yield b'{"articles": ['
+
+    last = None
+    count = 0
+    async for row in rows:
+        if limit is not None and count >= limit:
+            yield b'], "next_cursor": '
+            yield json.dumps(encode_cursor(last["created_at"], last["id"])).encode()
+            yield b"}"
+            return
+
+        prefix = b", " if count else b""
+        yield prefix + json.dumps(serialize_article_row(row)).encode()
+        last = row
+        count += 1
+
+    yield b'], "next_cursor": null}'
@@ -1,43 +1,30 @@
 from django.apps import apps
 from django.contrib.auth.models import Group, Permission
 from django.contrib.auth.management import create_permissions
-from django.db.models.signals import post_migrate, post_save
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
 from django.dispatch import receiver
 
+from . import feed_cache, page_cache, search, stream, subscriptions
+from .feeds import add_sources, remove_article, remove_sources
+from .jobs import enqueue
+from .models import Article, CustomUser, Publisher
 
-@receiver(post_migrate)
-def create_groups_and_permissions(sender, **kwargs):
-    try:
-        news_config = apps.get_app_config("news")
-    except Exception:
-        return
-
-    create_permissions(news_config, verbosity=0)
-
-    reader_group, _ = Group.objects.get_or_create(name="Reader")
-    editor_group, _ = Group.objects.get_or_create(name="Editor")
-    journalist_group, _ = Group.objects.get_or_create(name="Journalist")
-
-    perms = Permission.objects.filter(content_type__app_label="news")
-
-    def add_perms(group, codenames):
-        group.permissions.set(list(perms.filter(codename__in=codenames)))
 
-    reader_codenames = [
+GROUP_PERMISSIONS = {
+    "Reader": [
         "view_article",
         "view_newsletter",
-    ]
-
-    editor_codenames = [
+    ],
+    "Editor": [
         "view_article",
         "change_article",
         "delete_article",
         "view_newsletter",
         "change_newsletter",
         "delete_newsletter",
-    ]
-
-    journalist_codenames = [
+    ],
+    "Journalist": [
         "add_article",
         "view_article",
         "change_article",
@@ -46,40 +33,285 @@ def create_groups_and_permissions(sender, **kwargs):
         "view_newsletter",
         "change_newsletter",
         "delete_newsletter",
-    ]
+    ],
+}
+
+
+def create_groups_and_permissions(sender, using="default", **kwargs):
+    """
+    Makes the role groups hold exactly their permissions.
+
+    Connected in NewsConfig.ready() for the news app only. Writes nothing
+    when everything is already in place.
+    """
+    codenames = {codename for names in GROUP_PERMISSIONS.values() for codename in names}
+
+    def load_perms():
+        return dict(
+            Permission.objects.using(using)
+            .filter(content_type__app_label="news", codename__in=codenames)
+            .values_list("codename", "id")
+        )
+
+    perms = load_perms()
+    if len(perms) < len(codenames):
+        # auth's own post_migrate handler normally created these already.
+        create_permissions(apps.get_app_config("news"), verbosity=0, using=using)
+        perms = load_perms()
+
+    groups = dict(Group.objects.using(using).filter(name__in=GROUP_PERMISSIONS).values_list("name", "id"))
+    missing = [Group(name=name) for name in GROUP_PERMISSIONS if name not in groups]
+    if missing:
+        Group.objects.using(using).bulk_create(missing, ignore_conflicts=True)
+        groups = dict(Group.objects.using(using).filter(name__in=GROUP_PERMISSIONS).values_list("name", "id"))
+        forget_role_groups()
+
+    wanted = {
+        (groups[name], perms[codename])
+        for name, names in GROUP_PERMISSIONS.items()
+        for codename in names
+        if codename in perms
+    }
+    through = Group.permissions.through
+    existing = set(
+        through.objects.using(using)
+        .filter(group_id__in=groups.values())
+        .values_list("group_id", "permission_id")
+    )
+
+    extra = existing - wanted
+    if extra:
+        for group_id in {group_id for group_id, _ in extra}:
+            through.objects.using(using).filter(
+                group_id=group_id,
+                permission_id__in=[perm_id for g, perm_id in extra if g == group_id],
+            ).delete()
+
+    through.objects.using(using).bulk_create(
+        [through(group_id=group_id, permission_id=perm_id) for group_id, perm_id in wanted - existing],
+        ignore_conflicts=True,
+    )
+
+
+ROLE_GROUPS = {
+    CustomUser.READER: "Reader",
+    CustomUser.EDITOR: "Editor",
+    CustomUser.JOURNALIST: "Journalist",
+}
 
-    add_perms(reader_group, reader_codenames)
-    add_perms(editor_group, editor_codenames)
-    add_perms(journalist_group, journalist_codenames)
+# Relations a user keeps only while they have a role that uses them.
+ROLE_RELATIONS = {
+    CustomUser.READER: ("published_articles", "published_newsletters"),
+    CustomUser.EDITOR: (
+        "subscribed_publishers",
+        "subscribed_journalists",
+        "published_articles",
+        "published_newsletters",
+    ),
+    CustomUser.JOURNALIST: ("subscribed_publishers", "subscribed_journalists"),
+}
 
+# Role group ids, loaded once per process and dropped whenever the groups
+# may have been recreated.
+_role_group_ids = {}
 
-@receiver(post_save)
-def assign_group_by_role(sender, instance, created=False, **kwargs):
-    if sender._meta.label_lower != "news.customuser":
+
+def role_group_id(role):
+    if not _role_group_ids:
+        _role_group_ids.update(
+            Group.objects.filter(name__in=ROLE_GROUPS.values()).values_list("name", "id")
+        )
+    return _role_group_ids.get(ROLE_GROUPS.get(role))
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Group)
+def forget_role_groups(sender=None, **kwargs):
+    _role_group_ids.clear()
+
+
+@receiver(post_init, sender=CustomUser)
+def remember_role(sender, instance, **kwargs):
+    # Deferred loads (e.g. .only("id")) leave the role unknown.
+    instance._saved_role = instance.__dict__.get("role")
+
+
+@receiver(post_save, sender=CustomUser)
+def assign_group_by_role(sender, instance, created=False, update_fields=None, **kwargs):
+    if update_fields is not None and "role" not in update_fields:
+        return
+    if "role" not in instance.__dict__:
         return
 
     role = (instance.role or "").lower()
-    instance.groups.clear()
-
-    if role == "reader":
-        group = Group.objects.filter(name="Reader").first()
-        if group:
-            instance.groups.add(group)
-        instance.published_articles.clear()
-        instance.published_newsletters.clear()
-
-    elif role == "editor":
-        group = Group.objects.filter(name="Editor").first()
-        if group:
-            instance.groups.add(group)
-        instance.subscribed_publishers.clear()
-        instance.subscribed_journalists.clear()
-        instance.published_articles.clear()
-        instance.published_newsletters.clear()
-
-    elif role == "journalist":
-        group = Group.objects.filter(name="Journalist").first()
-        if group:
-            instance.groups.add(group)
-        instance.subscribed_publishers.clear()
-        instance.subscribed_journalists.clear()
+    if not created and role == (instance._saved_role or "").lower():
+        return
+
+    memberships = CustomUser.groups.through.objects
+    group_id = role_group_id(role)
+    if not created:
+        memberships.filter(customuser_id=instance.pk).exclude(group_id=group_id).delete()
+    if group_id:
+        memberships.bulk_create(
+            [CustomUser.groups.through(customuser_id=instance.pk, group_id=group_id)],
+            ignore_conflicts=True,
+        )
+
+    # A new user has nothing to clear. clear() rather than a raw delete so
+    # that subscription changes still reach the feed and cache receivers.
+    if not created:
+        for name in ROLE_RELATIONS.get(role, ()):
+            getattr(instance, name).clear()
+
+    instance._saved_role = instance.role
+
+
+@receiver(post_save, sender=Article)
+def sync_article_feeds(sender, instance, created=False, **kwargs):
+    # Fan-out to every subscriber can be large, so it runs in the job
+    # worker. Hiding an article that lost its approval must not wait.
+    if instance.approved:
+        enqueue("fanout_article", article_id=instance.pk)
+    elif not created:
+        remove_article(instance.pk)
+
+    if instance.approved or not created:
+        bump_article_feed_versions(sender, instance)
+
+
+@receiver(post_delete, sender=Article)
+def bump_article_feed_versions(sender, instance, **kwargs):
+    feed_cache.bump(feed_cache.PUBLISHER, [instance.publisher_id])
+    feed_cache.bump(feed_cache.JOURNALIST, [instance.journalist_id])
+
+
+@receiver(post_save, sender=Publisher)
+def bump_publisher_feed_version(sender, instance, created=False, **kwargs):
+    # Feeds include the publisher's name.
+    if not created:
+        feed_cache.bump(feed_cache.PUBLISHER, [instance.pk])
+
+
+@receiver(post_init, sender=CustomUser)
+def remember_username(sender, instance, **kwargs):
+    instance._saved_username = instance.__dict__.get("username")
+
+
+@receiver(post_save, sender=CustomUser)
+def bump_journalist_feed_version(sender, instance, created=False, **kwargs):
+    # Feeds and article pages include the journalist's username. Readers
+    # may see the articles through the journalist or their publishers.
+    if created or "username" not in instance.__dict__:
+        return
+    if instance.username != instance._saved_username:
+        articles = Article.objects.filter(journalist=instance)
+        feed_cache.bump(feed_cache.JOURNALIST, [instance.pk])
+        feed_cache.bump(feed_cache.PUBLISHER, articles.values_list("publisher_id", flat=True).distinct())
+        page_cache.invalidate_articles(list(articles.values_list("pk", flat=True)))
+    instance._saved_username = instance.username
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+def invalidate_article_pages(sender, instance, **kwargs):
+    page_cache.invalidate_article(instance.pk)
+
+
+@receiver(post_save, sender=Article)
+def index_article(sender, instance, created=False, **kwargs):
+    if instance.approved:
+        search.index_articles([instance.pk])
+    elif not created:
+        search.remove_articles([instance.pk])
+
+
+@receiver(post_delete, sender=Article)
+def unindex_article(sender, instance, **kwargs):
+    search.remove_articles([instance.pk])
+
+
+@receiver(post_init, sender=Article)
+def remember_approval(sender, instance, **kwargs):
+    instance._saved_approved = instance.__dict__.get("approved")
+
+
+@receiver(post_save, sender=Article)
+def stream_approved_article(sender, instance, created=False, **kwargs):
+    if instance.approved and instance._saved_approved is not True:
+        pk = instance.pk
+        transaction.on_commit(lambda: stream.publish_approved([pk]))
+    instance._saved_approved = instance.approved
+
+
+@receiver(post_save, sender=Publisher)
+@receiver(post_delete, sender=Publisher)
+def invalidate_publisher_pages(sender, instance, **kwargs):
+    page_cache.invalidate_publisher()
+
+
+SUBSCRIPTION_RELATIONS = {
+    "publishers": {
+        "forward": "subscribed_publishers",
+        "reverse": "subscribers",
+        "reader_kind": subscriptions.READER_PUBLISHERS,
+        "source_kind": subscriptions.PUBLISHER_SUBSCRIBERS,
+        "feed_source": "publisher_ids",
+    },
+    "journalists": {
+        "forward": "subscribed_journalists",
+        "reverse": "journalist_subscribers",
+        "reader_kind": subscriptions.READER_JOURNALISTS,
+        "source_kind": subscriptions.JOURNALIST_SUBSCRIBERS,
+        "feed_source": "journalist_ids",
+    },
+}
+
+
+def _subscriptions_changed(relation, instance, action, reverse, pk_set):
+    if action == "pre_clear":
+        related = getattr(instance, relation["reverse"] if reverse else relation["forward"])
+        instance._cleared_subscription_ids = set(related.values_list("pk", flat=True))
+        return
+
+    if action == "post_clear":
+        pk_set = instance.__dict__.pop("_cleared_subscription_ids", set())
+        action = "post_remove"
+    elif action not in ("post_add", "post_remove"):
+        return
+
+    pk_set = pk_set or set()
+    if reverse:
+        reader_ids, source_ids = pk_set, {instance.pk}
+    else:
+        reader_ids, source_ids = {instance.pk}, pk_set
+
+    # The cached sets go first: the feed sync below reads them.
+    subscriptions.invalidate(
+        [(relation["reader_kind"], pk) for pk in reader_ids]
+        + [(relation["source_kind"], pk) for pk in source_ids]
+    )
+
+    if pk_set:
+        sync = add_sources if action == "post_add" else remove_sources
+        sync(reader_ids, **{relation["feed_source"]: source_ids})
+
+
+@receiver(m2m_changed, sender=CustomUser.subscribed_publishers.through)
+def publisher_subscriptions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    _subscriptions_changed(SUBSCRIPTION_RELATIONS["publishers"], instance, action, reverse, pk_set)
+
+
+@receiver(m2m_changed, sender=CustomUser.subscribed_journalists.through)
+def journalist_subscriptions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    _subscriptions_changed(SUBSCRIPTION_RELATIONS["journalists"], instance, action, reverse, pk_set)
+
+
+@receiver(pre_delete, sender=CustomUser)
+def forget_user_subscriptions(sender, instance, **kwargs):
+    # Cascade deletes of subscription rows send no m2m_changed.
+    subscriptions.invalidate_user(instance.pk)
+
+
+@receiver(pre_delete, sender=Publisher)
+def forget_publisher_subscriptions(sender, instance, **kwargs):
+    subscriptions.invalidate_publisher(instance.pk)
@@ -0,0 +1,260 @@
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SocialPublishError(Exception):
+    """
+    Raised when a post could not be published. ``retryable`` is False when
+    trying again would fail the same way or could publish the post twice.
+    """
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class CircuitOpenError(SocialPublishError):
+    """
+    Raised instead of calling an endpoint that keeps failing.
+    """
+
+
+class SocialAdapter:
+    """
+    Describes how to publish to one social network.
+
+    Subclasses build the HTTP request for an article and decide whether a
+    response means success, so tests can point the client at a local stub.
+    """
+
+    name = "social"
+
+    def is_configured(self):
+        return True
+
+    def build_request(self, article):
+        """
+        Returns (method, url, kwargs) for ``requests.Session.request``.
+        """
+        raise NotImplementedError
+
+    def is_success(self, response):
+        return 200 <= response.status_code < 300
+
+    def idempotency_key(self, article):
+        """
+        Returns the key ``build_request`` sends for the endpoint to drop
+        repeats of a post, or None if the endpoint has none.
+        """
+        return None
+
+
+class XAdapter(SocialAdapter):
+    """
+    Posts an article's title and start of its content to X.
+    """
+
+    name = "x"
+
+    def __init__(self, url=None, token=None):
+        self.url = url or getattr(settings, "X_API_URL", "https://api.twitter.com/2/tweets")
+        self.token = token if token is not None else os.environ.get("X_BEARER_TOKEN")
+
+    def is_configured(self):
+        return bool(self.token)
+
+    def build_request(self, article):
+        text = f"{article.title}\n\n{article.content}"
+        return (
+            "POST",
+            self.url,
+            {
+                "json": {"text": text[:270]},
+                "headers": {"Authorization": f"Bearer {self.token}"},
+            },
+        )
+
+    def is_success(self, response):
+        return response.status_code in (200, 201)
+
+
+class CircuitBreaker:
+    """
+    Stops calls after ``threshold`` consecutive failures, then lets a single
+    trial call through every ``reset_timeout`` seconds until one succeeds.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half-open: restart the timer so only this call goes through.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class SocialClient:
+    """
+    Publishes through an adapter over a pooled, keep-alive HTTP session,
+    with bounded jittered retries and a circuit breaker.
+    """
+
+    def __init__(self, adapter, timeout=None, retries=None, backoff=None, breaker=None, session=None):
+        self.adapter = adapter
+        self.timeout = timeout if timeout is not None else getattr(settings, "SOCIAL_TIMEOUT", 3.0)
+        self.retries = retries if retries is not None else getattr(settings, "SOCIAL_RETRIES", 2)
+        self.backoff = backoff if backoff is not None else getattr(settings, "SOCIAL_RETRY_BACKOFF", 0.5)
+        self.breaker = breaker or CircuitBreaker(
+            getattr(settings, "SOCIAL_BREAKER_THRESHOLD", 5),
+            getattr(settings, "SOCIAL_BREAKER_RESET_SECONDS", 60),
+        )
+        self.session = session or self._build_session()
+
+    def _build_session(self):
+        pool = getattr(settings, "SOCIAL_POOL_SIZE", 10)
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _record(self, name, latency_ms=None):
+        if name == "short_circuited":
+            metrics.SOCIAL_POSTS.inc(adapter=self.adapter.name, result="short_circuited")
+        else:
+            metrics.SOCIAL_REQUESTS.inc(adapter=self.adapter.name, event=name)
+        if latency_ms is not None:
+            metrics.SOCIAL_DURATION.observe(latency_ms / 1000, adapter=self.adapter.name)
+
+    def publish(self, article):
+        """
+        Publishes an article. Raises SocialPublishError on failure.
+        """
+        method, url, kwargs = self.adapter.build_request(article)
+        # A request that timed out while waiting for the response, or got a
+        # 5xx such as a gateway's 502 or 504, may have been published; only
+        # an idempotency key makes sending it again safe.
+        resend_safe = self.adapter.idempotency_key(article) is not None
+        last_error = None
+
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                self._record("short_circuited")
+                raise CircuitOpenError(f"{self.adapter.name} circuit is open") from last_error
+
+            if attempt:
+                self._record("retries")
+                delay = self.backoff * (2 ** (attempt - 1))
+                time.sleep(random.uniform(delay / 2, delay))
+
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except requests.RequestException as exc:
+                latency_ms = (time.monotonic() - started) * 1000
+                last_error = exc
+                if isinstance(exc, requests.ConnectionError):
+                    # Includes ConnectTimeout: the request never reached the endpoint.
+                    retryable = True
+                elif isinstance(exc, requests.ReadTimeout):
+                    retryable = resend_safe
+                else:
+                    retryable = False
+                breaker_failure = True
+            else:
+                latency_ms = (time.monotonic() - started) * 1000
+                if self.adapter.is_success(response):
+                    self._record("attempts", latency_ms)
+                    self._record("successes")
+                    self.breaker.record_success()
+                    metrics.SOCIAL_POSTS.inc(adapter=self.adapter.name, result="published")
+                    return response
+                last_error = SocialPublishError(
+                    f"{self.adapter.name} returned HTTP {response.status_code}: {response.text[:200]}"
+                )
+                # Other 4xx responses are about this request, not the endpoint's health.
+                breaker_failure = response.status_code == 429 or response.status_code >= 500
+                retryable = response.status_code == 429 or (response.status_code >= 500 and resend_safe)
+
+            self._record("attempts", latency_ms)
+            self._record("failures")
+            if breaker_failure:
+                self.breaker.record_failure()
+            logger.warning("Publishing article %s to %s failed: %s", article.pk, self.adapter.name, last_error)
+
+            if not retryable:
+                break
+
+        metrics.SOCIAL_POSTS.inc(adapter=self.adapter.name, result="failed")
+        if isinstance(last_error, SocialPublishError):
+            last_error.retryable = retryable
+            raise last_error
+        raise SocialPublishError(str(last_error), retryable=retryable) from last_error
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the process-wide client for SOCIAL_ADAPTER.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            adapter = import_string(getattr(settings, "SOCIAL_ADAPTER", "news.social.XAdapter"))()
+            _client = SocialClient(adapter)
+        return _client
+
+
+def reset_client():
+    """
+    Drops the process-wide client, e.g. after changing settings in tests.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.session.close()
+        _client = None
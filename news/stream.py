@@ -0,0 +1,322 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from importlib import import_module
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aget_user
+from django.core import signals
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpRequest, QueryDict
+from django.http.cookie import parse_cookie
+from django.urls import reverse
+
+from . import metrics
+from .models import Article, CustomUser
+from .serializers import ARTICLE_FIELDS, serialize_article_row
+from .subscriptions import areader_journalist_ids, areader_publisher_ids
+
+# Newly approved articles are published to an in-process hub on commit of
+# the approval. Each event is encoded once and kept in a ring buffer of
+# STREAM_BUFFER_SIZE; every open stream keeps only its position in the
+# buffer and waits on a future shared by all the streams of its event
+# loop, so an idle connection costs a suspended coroutine and nothing
+# more. Event ids are "<hub>:<sequence>": a Last-Event-ID from another
+# process, an earlier run, or from before the oldest buffered event gets
+# a "reset" event, after which the client should reload /api/articles/.
+#
+# The hub only sees approvals made in its own process, so serve the
+# stream from the ASGI worker that also handles editors' requests.
+
+RETRY_MS = 5000
+
+# Subscription sets are reloaded at most this often per stream, so a new
+# subscription shows up within this many seconds.
+SOURCES_MAX_AGE = 30
+
+RESET = b"event: reset\ndata: {}\n\n"
+PING = b": ping\n\n"
+
+
+Event = namedtuple("Event", ["seq", "publisher_id", "journalist_id", "payload"])
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Hub:
+    """
+    Fans events out to the streams of one process. Publishing is thread
+    safe; waiting happens on the streams' event loops.
+    """
+
+    def __init__(self, size):
+        self.name = uuid.uuid4().hex[:8]
+        self.active = False
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=size)
+        self._seq = 0
+        # Event loop -> future resolved by the next publish.
+        self._waiters = {}
+
+    @property
+    def position(self):
+        return self._seq
+
+    def publish(self, events):
+        """
+        Appends (publisher id, journalist id, data) events and wakes the
+        waiting streams once.
+        """
+        with self._lock:
+            for publisher_id, journalist_id, data in events:
+                self._seq += 1
+                payload = f"id: {self.name}:{self._seq}\nevent: article\ndata: {data}\n\n".encode()
+                self._events.append(Event(self._seq, publisher_id, journalist_id, payload))
+            waiters, self._waiters = self._waiters, {}
+
+        for loop, future in waiters.items():
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                # The loop has closed; nothing waits on it any more.
+                pass
+
+    def resume(self, last_event_id):
+        """
+        Returns the position to stream from for a Last-Event-ID, or None
+        when the events after it are no longer known.
+        """
+        self.active = True
+        if not last_event_id:
+            return self._seq
+        name, _, seq = last_event_id.partition(":")
+        if name != self.name or not seq.isdigit() or int(seq) > self._seq:
+            return None
+        return int(seq) if self.since(int(seq)) is not None else None
+
+    def since(self, position):
+        """
+        Returns the events after ``position``, oldest first, or None when
+        some of them have already left the buffer.
+        """
+        with self._lock:
+            count = self._seq - position
+            if count <= 0:
+                return []
+            if count > len(self._events):
+                return None
+            events = list(islice(reversed(self._events), count))
+        events.reverse()
+        return events
+
+    async def wait(self, position, timeout):
+        """
+        Waits up to ``timeout`` seconds for an event after ``position``.
+        Returns False on timeout.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._seq > position:
+                return True
+            future = self._waiters.get(loop)
+            if future is None:
+                future = self._waiters[loop] = loop.create_future()
+        done, _ = await asyncio.wait([future], timeout=timeout)
+        return bool(done)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = Hub(getattr(settings, "STREAM_BUFFER_SIZE", 1000))
+        return _hub
+
+
+def publish_approved(article_ids):
+    """
+    Publishes newly approved articles to this process's streams. Call it
+    once the approval has committed.
+    """
+    hub = get_hub()
+    # Processes that never served a stream (WSGI and job workers) skip
+    # the query.
+    if not hub.active or not article_ids:
+        return
+
+    rows = (
+        Article.objects.filter(pk__in=article_ids, approved=True)
+        .order_by("id")
+        .values(*ARTICLE_FIELDS, "publisher_id", "journalist_id")
+    )
+    hub.publish(
+        [(row["publisher_id"], row["journalist_id"], json.dumps(serialize_article_row(row))) for row in rows]
+    )
+
+
+def reader_events(reader_id, last_event_id=None):
+    """
+    Returns the server-sent events for one reader: every newly approved
+    article from a publisher or journalist they subscribe to, and a
+    comment every STREAM_HEARTBEAT seconds to keep the connection open.
+
+    Writes wait for the client (ASGI servers apply flow control), so a
+    slow client only falls behind in the buffer; once it falls out of it
+    the client gets a "reset" and continues from the newest event.
+    """
+    hub = get_hub()
+    # Fixed now rather than when the body starts, so nothing approved in
+    # between is missed.
+    return _reader_events(hub, reader_id, hub.resume(last_event_id))
+
+
+async def _reader_events(hub, reader_id, position):
+    heartbeat = getattr(settings, "STREAM_HEARTBEAT", 15)
+
+    yield f"retry: {RETRY_MS}\n\n".encode()
+
+    if position is None:
+        yield RESET
+        position = hub.position
+
+    publisher_ids = journalist_ids = None
+    loaded_at = None
+
+    while True:
+        events = hub.since(position)
+        if events is None:
+            yield RESET
+            position = hub.position
+            continue
+
+        if not events:
+            if not await hub.wait(position, heartbeat):
+                yield PING
+            continue
+
+        position = events[-1].seq
+        if loaded_at is None or time.monotonic() - loaded_at > SOURCES_MAX_AGE:
+            publisher_ids = await areader_publisher_ids(reader_id)
+            journalist_ids = await areader_journalist_ids(reader_id)
+            loaded_at = time.monotonic()
+
+        chunk = b"".join(
+            event.payload
+            for event in events
+            if event.publisher_id in publisher_ids or event.journalist_id in journalist_ids
+        )
+        if chunk:
+            yield chunk
+
+
+HEADERS = [
+    (b"content-type", b"text/event-stream"),
+    (b"cache-control", b"no-cache"),
+    # Stops nginx from buffering the events.
+    (b"x-accel-buffering", b"no"),
+    (b"x-content-type-options", b"nosniff"),
+]
+
+
+async def _reader(cookies):
+    """
+    Returns the signed-in reader for a session cookie, or None.
+    """
+    session_key = cookies.get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return None
+
+    # Loaded as Django's handler would, request_started and
+    # request_finished closing stale database connections around it.
+    await sync_to_async(signals.request_started.send)(sender=StreamApplication)
+    try:
+        request = HttpRequest()
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+        user = await aget_user(request)
+    finally:
+        await sync_to_async(signals.request_finished.send)(sender=StreamApplication)
+
+    if not user.is_authenticated or str(getattr(user, "role", "")).lower() != CustomUser.READER:
+        return None
+    return user
+
+
+def _allowed_host(scope):
+    """
+    Returns whether Django would accept the request's Host header.
+    """
+    try:
+        ASGIRequest(scope, None).get_host()
+    except DisallowedHost:
+        return False
+    return True
+
+
+async def _serve(events, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": HEADERS})
+    # Not seen by RequestTimingMiddleware, so counted here.
+    metrics.REQUESTS.inc(view="article_stream", method="GET", status=200)
+    metrics.STREAMS.inc(event="opened")
+
+    async def pump():
+        async for chunk in events:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(disconnected())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await events.aclose()
+        metrics.STREAMS.inc(event="closed")
+
+
+class StreamApplication:
+    """
+    ASGI application that serves signed-in readers' article streams
+    itself and hands every other request to ``application``.
+
+    Django gives each request a worker thread of its own for sync code
+    that lives as long as the request, so under Django every open stream
+    would keep a thread. Here the session and user are loaded first and
+    the stream then runs on the event loop alone. Requests from anyone
+    else, or with a Host not in ALLOWED_HOSTS, go to Django, where the
+    article_stream view or the middleware answers them.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.path = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "GET":
+            if self.path is None:
+                self.path = reverse("article_stream")
+            if scope["path"] == self.path and _allowed_host(scope):
+                headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+                reader = await _reader(parse_cookie(headers.get("cookie", "")))
+                if reader is not None:
+                    params = QueryDict(scope.get("query_string", b""))
+                    last_event_id = headers.get("last-event-id") or params.get("last_event_id")
+                    await _serve(reader_events(reader.pk, last_event_id), receive, send)
+                    return
+        await self.application(scope, receive, send)
@@ -0,0 +1,168 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import replicas
+from .models import CustomUser
+
+# Subscription sets are cached in both directions, by id only:
+#   reader -> publisher ids, reader -> journalist ids,
+#   publisher -> subscriber ids, journalist -> subscriber ids.
+# signals.py invalidates exactly the keys an m2m change touches. Misses
+# load from the primary database.
+#
+# With a per-process backend (locmem) only the process that made a change
+# sees it at once; others keep the old set for SUBSCRIPTION_CACHE_TIMEOUT.
+# That is fine for pages, but who gets an email or a feed entry must not
+# depend on it, so the job and fan-out paths pass cached=False.
+READER_PUBLISHERS = "reader-publishers"
+READER_JOURNALISTS = "reader-journalists"
+PUBLISHER_SUBSCRIBERS = "publisher-subscribers"
+JOURNALIST_SUBSCRIBERS = "journalist-subscribers"
+
+
+def _cache():
+    return caches[getattr(settings, "SUBSCRIPTION_CACHE_ALIAS", "default")]
+
+
+def _key(kind, pk):
+    return f"news:subs:{kind}:{pk}"
+
+
+def _cached_ids(kind, pk, load, cached=True):
+    if not cached:
+        return frozenset(load())
+
+    cache = _cache()
+    key = _key(kind, pk)
+    ids = cache.get(key)
+    if ids is None:
+        with replicas.primary():
+            ids = frozenset(load())
+        cache.set(key, ids, getattr(settings, "SUBSCRIPTION_CACHE_TIMEOUT", 300))
+    return ids
+
+
+async def _acached_ids(kind, pk, load):
+    cache = _cache()
+    key = _key(kind, pk)
+    ids = await cache.aget(key)
+    if ids is None:
+        with replicas.primary():
+            ids = frozenset([row async for row in load()])
+        await cache.aset(key, ids, getattr(settings, "SUBSCRIPTION_CACHE_TIMEOUT", 300))
+    return ids
+
+
+def _reader_publishers(reader_id):
+    return CustomUser.subscribed_publishers.through.objects.filter(customuser_id=reader_id).values_list(
+        "publisher_id", flat=True
+    )
+
+
+def _reader_journalists(reader_id):
+    return CustomUser.subscribed_journalists.through.objects.filter(from_customuser_id=reader_id).values_list(
+        "to_customuser_id", flat=True
+    )
+
+
+def reader_publisher_ids(reader_id, cached=True):
+    """
+    Returns the ids of the publishers a reader subscribes to.
+    """
+    return _cached_ids(READER_PUBLISHERS, reader_id, lambda: _reader_publishers(reader_id), cached)
+
+
+async def areader_publisher_ids(reader_id):
+    return await _acached_ids(READER_PUBLISHERS, reader_id, lambda: _reader_publishers(reader_id))
+
+
+def reader_journalist_ids(reader_id, cached=True):
+    """
+    Returns the ids of the journalists a reader subscribes to.
+    """
+    return _cached_ids(READER_JOURNALISTS, reader_id, lambda: _reader_journalists(reader_id), cached)
+
+
+async def areader_journalist_ids(reader_id):
+    return await _acached_ids(READER_JOURNALISTS, reader_id, lambda: _reader_journalists(reader_id))
+
+
+def publisher_subscriber_ids(publisher_id, cached=True):
+    """
+    Returns the ids of the readers subscribed to a publisher.
+    """
+    return _cached_ids(
+        PUBLISHER_SUBSCRIBERS,
+        publisher_id,
+        lambda: CustomUser.objects.filter(
+            role=CustomUser.READER, subscribed_publishers=publisher_id
+        ).values_list("id", flat=True),
+        cached,
+    )
+
+
+def journalist_subscriber_ids(journalist_id, cached=True):
+    """
+    Returns the ids of the readers subscribed to a journalist.
+    """
+    return _cached_ids(
+        JOURNALIST_SUBSCRIBERS,
+        journalist_id,
+        lambda: CustomUser.objects.filter(
+            role=CustomUser.READER, subscribed_journalists=journalist_id
+        ).values_list("id", flat=True),
+        cached,
+    )
+
+
+def subscriber_ids(publisher_id, journalist_id, cached=True):
+    """
+    Returns the ids of the readers subscribed to a publisher or a journalist.
+    """
+    ids = set()
+    if publisher_id:
+        ids |= publisher_subscriber_ids(publisher_id, cached)
+    if journalist_id:
+        ids |= journalist_subscriber_ids(journalist_id, cached)
+    return ids
+
+
+def invalidate(keys):
+    """
+    Drops cached subscription sets, given as (kind, id) pairs.
+
+    The keys are dropped again on commit, so a request that read the old
+    rows before our transaction committed cannot leave them cached.
+    """
+    keys = [_key(kind, pk) for kind, pk in keys]
+    if not keys:
+        return
+
+    cache = _cache()
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_user(user_id):
+    """
+    Drops every cached set that mentions a user, e.g. before it is deleted.
+    """
+    keys = [
+        (READER_PUBLISHERS, user_id),
+        (READER_JOURNALISTS, user_id),
+        (JOURNALIST_SUBSCRIBERS, user_id),
+    ]
+    keys += [(PUBLISHER_SUBSCRIBERS, pk) for pk in reader_publisher_ids(user_id)]
+    keys += [(JOURNALIST_SUBSCRIBERS, pk) for pk in reader_journalist_ids(user_id)]
+    keys += [(READER_JOURNALISTS, pk) for pk in journalist_subscriber_ids(user_id)]
+    invalidate(keys)
+
+
+def invalidate_publisher(publisher_id):
+    """
+    Drops every cached set that mentions a publisher.
+    """
+    keys = [(PUBLISHER_SUBSCRIBERS, publisher_id)]
+    keys += [(READER_PUBLISHERS, pk) for pk in publisher_subscriber_ids(publisher_id)]
+    invalidate(keys)
@@ -1,11 +1,172 @@
-from django.test import TestCase
-from django.urls import reverse
+import csv
+import asyncio
+import gzip
+import json
+import logging
+import os
+import pstats
+import re
+import tempfile
+import smtplib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import socketserver
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-from .models import Article, CustomUser, Publisher
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail.backends import locmem
+from django.core.management import CommandError, call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.core.signals import request_finished, request_started
+from django.db import OperationalError, close_old_connections, connection, connections, router, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from . import metrics, moderation, page_cache, profiling, replicas, search, stream, subscriptions, urls, views
+from .delivery import DeliveryError
+from .jobs import claim, enqueue, run_pending
+from .middleware import ReplicaMiddleware
+from .models import Article, CustomUser, EmailBatch, FeedEntry, Job, Newsletter, Publisher
+from .notifications import email_subscribers, post_to_x_job
+from .serializers import serialize_articles_to_xml
+from .signals import GROUP_PERMISSIONS, create_groups_and_permissions, forget_role_groups
+from .social import CircuitOpenError, SocialAdapter, SocialClient, SocialPublishError
+
+
+def clear_caches():
+    # Test databases reuse primary keys, so cached sets and versions keyed
+    # by id must not outlive a test.
+    for cache in caches.all():
+        cache.clear()
+    forget_role_groups()
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    """
+    Minimal SMTP server that records connections and envelopes.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        self.connections = 0
+        self.messages = []
+        super().__init__(("127.0.0.1", 0), SMTPStubHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPStubHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 stub")
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line.split(" ", 1)[0].upper()
+            if not line or command == "QUIT":
+                self.reply("221 bye")
+                return
+            if command == "DATA":
+                self.reply("354 go ahead")
+                while self.rfile.readline().rstrip(b"\r\n") != b".":
+                    pass
+                self.server.messages.append(recipients)
+                recipients = []
+                self.reply("250 queued")
+            elif command == "RCPT":
+                recipients.append(line.split(":", 1)[1].strip("<> "))
+                self.reply("250 ok")
+            else:
+                self.reply("250 ok")
+
+
+class HTTPStub(ThreadingHTTPServer):
+    """
+    Keep-alive HTTP server that answers POSTs with queued status codes.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, statuses=()):
+        self.connections = 0
+        self.requests = []
+        self.statuses = list(statuses)
+        super().__init__(("127.0.0.1", 0), HTTPStubHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/post"
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class HTTPStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def handle(self):
+        self.server.connections += 1
+        super().handle()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append(json.loads(body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 201
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+class StubAdapter(SocialAdapter):
+    name = "stub"
+
+    def __init__(self, url):
+        self.url = url
+
+    def build_request(self, article):
+        return "POST", self.url, {"json": {"text": article.title}}
+
+
+def read_json(response):
+    if response.streaming:
+        return json.loads(b"".join(response.streaming_content))
+    return response.json()
 
 
 class ApiArticlesTests(TestCase):
     def setUp(self):
+        clear_caches()
         self.pub1 = Publisher.objects.create(name="pub1")
         self.pub2 = Publisher.objects.create(name="pub2")
 
@@ -46,7 +207,7 @@ class ApiArticlesTests(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
-        data = res.json()
+        data = read_json(res)
         titles = sorted([a["title"] for a in data["articles"]])
 
         self.assertEqual(titles, ["A1", "A2"])
@@ -60,7 +221,7 @@ class ApiArticlesTests(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
-        data = res.json()
+        data = read_json(res)
         titles = [a["title"] for a in data["articles"]]
 
         self.assertIn("A2", titles)
@@ -82,7 +243,53 @@ class ApiArticlesTests(TestCase):
 
         self.assertEqual(res.status_code, 200)
         self.assertIn("application/xml", res["Content-Type"])
-        self.assertIn(b"<articles>", res.content)
+        self.assertIn(b"<articles>", b"".join(res.streaming_content))
+
+    def test_streamed_xml_matches_element_tree_output(self):
+        self.a1.title = "Tom & Jerry <live> \"quoted\" 'single'"
+        self.a1.content = "caf\u00e9 \u2603 a > b\r\nnext"
+        self.a1.save()
+        self.a2.journalist = None
+        self.a2.content = ""
+        self.a2.save()
+
+        qs = Article.objects.filter(approved=True).order_by("-created_at")
+
+        root = ET.Element("articles")
+        for a in qs:
+            node = ET.SubElement(root, "article")
+            ET.SubElement(node, "id").text = str(a.id)
+            ET.SubElement(node, "title").text = a.title
+            ET.SubElement(node, "content").text = a.content
+            ET.SubElement(node, "approved").text = "true" if a.approved else "false"
+            ET.SubElement(node, "created_at").text = a.created_at.isoformat() if a.created_at else ""
+            ET.SubElement(node, "publisher").text = a.publisher.name if a.publisher else ""
+            ET.SubElement(node, "journalist").text = a.journalist.username if a.journalist else ""
+
+        self.assertEqual(serialize_articles_to_xml(qs), ET.tostring(root, encoding="utf-8"))
+        self.assertEqual(serialize_articles_to_xml(Article.objects.none()), b"<articles />")
+
+    def feed_queries(self, fmt):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(reverse("get_articles"), {"format": fmt})
+            body = b"".join(res.streaming_content)
+        clear_caches()
+        return len(ctx.captured_queries), body
+
+    def test_query_count_constant_as_feed_grows(self):
+        self.r1.subscribed_publishers.add(self.pub1, self.pub2)
+        self.client.login(username="reader1", password="pass")
+
+        for fmt in ("json", "xml"):
+            small, _ = self.feed_queries(fmt)
+
+            for i in range(20):
+                Article.objects.create(title=f"N{i}", content="C", publisher=self.pub1, journalist=self.j2, approved=True)
+            run_pending()
+            large, body = self.feed_queries(fmt)
+
+            self.assertEqual(small, large)
+            self.assertIn(b"N19", body)
 
     def test_no_subscriptions_returns_empty_list(self):
         self.client.login(username="reader1", password="pass")
@@ -90,5 +297,1936 @@ class ApiArticlesTests(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
-        data = res.json()
+        data = read_json(res)
         self.assertEqual(data["articles"], [])
+
+    def test_json_is_streamed(self):
+        self.r1.subscribed_publishers.add(self.pub1)
+        self.client.login(username="reader1", password="pass")
+
+        res = self.client.get(reverse("get_articles"))
+
+        self.assertTrue(res.streaming)
+        self.assertEqual(res["Content-Type"], "application/json")
+        self.assertIsNone(read_json(res)["next_cursor"])
+
+    def test_cursor_pagination_walks_whole_feed(self):
+        for i in range(5):
+            Article.objects.create(title=f"P{i}", content="C", publisher=self.pub1, approved=True)
+        self.r1.subscribed_publishers.add(self.pub1)
+        self.client.login(username="reader1", password="pass")
+
+        url = reverse("get_articles")
+        seen = []
+        pages = 0
+        cursor = ""
+        while True:
+            data = read_json(self.client.get(url, {"limit": 2, "cursor": cursor}))
+            pages += 1
+            self.assertLessEqual(len(data["articles"]), 2)
+            seen.extend(a["id"] for a in data["articles"])
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+
+        full = read_json(self.client.get(url))
+        self.assertEqual(seen, [a["id"] for a in full["articles"]])
+        self.assertEqual(len(seen), 6)
+        self.assertEqual(pages, 3)
+
+    def test_invalid_cursor_rejected(self):
+        self.client.login(username="reader1", password="pass")
+
+        res = self.client.get(reverse("get_articles"), {"cursor": "not-a-cursor"})
+        self.assertEqual(res.status_code, 400)
+
+        res = self.client.get(reverse("get_articles"), {"limit": "zero"})
+        self.assertEqual(res.status_code, 400)
+
+
+class ApprovalJobTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.pub = Publisher.objects.create(name="pub")
+        self.journalist = CustomUser.objects.create_user(username="journalist", password="pass", role="journalist")
+        self.editor = CustomUser.objects.create_user(username="editor", password="pass", role="editor")
+        self.reader = CustomUser.objects.create_user(
+            username="reader", password="pass", role="reader", email="reader@example.com"
+        )
+        self.reader.subscribed_publishers.add(self.pub)
+
+        self.article = Article.objects.create(
+            title="Pending",
+            content="Body",
+            publisher=self.pub,
+            journalist=self.journalist,
+        )
+
+    def approve(self):
+        self.client.login(username="editor", password="pass")
+        return self.client.post(reverse("approve_article", args=[self.article.pk]))
+
+    def test_approve_enqueues_instead_of_sending(self):
+        res = self.approve()
+
+        self.assertEqual(res.status_code, 302)
+        self.article.refresh_from_db()
+        self.assertTrue(self.article.approved)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            sorted(Job.objects.values_list("kind", flat=True)),
+            ["email_subscribers", "fanout_article", "post_to_x"],
+        )
+
+    def test_worker_delivers_email(self):
+        self.approve()
+
+        self.assertEqual(run_pending(), 3)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["reader@example.com"])
+        self.assertFalse(Job.objects.exclude(status=Job.DONE).exists())
+
+    def test_reapproval_emails_again(self):
+        self.approve()
+        run_pending()
+        self.article.refresh_from_db()
+        self.article.approved = False
+        self.article.save()
+
+        self.approve()
+        run_pending()
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job = enqueue("email_subscribers", article_id=self.article.pk)
+
+        with mock.patch("news.notifications.email_subscribers", side_effect=RuntimeError("smtp down")):
+            Article.objects.filter(pk=self.article.pk).update(approved=True)
+            self.assertEqual(run_pending(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn("smtp down", job.last_error)
+
+    def test_job_fails_after_max_attempts(self):
+        job = enqueue("email_subscribers", article_id=self.article.pk)
+        Job.objects.filter(pk=job.pk).update(attempts=job.max_attempts - 1)
+
+        with mock.patch("news.notifications.email_subscribers", side_effect=RuntimeError("smtp down")):
+            Article.objects.filter(pk=self.article.pk).update(approved=True)
+            run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_stale_running_job_is_reclaimed(self):
+        job = enqueue("email_subscribers", article_id=self.article.pk)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING,
+            locked_by="dead-worker",
+            locked_at=timezone.now() - timedelta(hours=1),
+        )
+
+        claimed = claim("live-worker")
+
+        self.assertEqual([j.pk for j in claimed], [job.pk])
+        self.assertEqual(claimed[0].locked_by, "live-worker")
+        self.assertEqual(claim("other-worker"), [])
+
+    def test_stale_job_on_its_last_attempt_fails(self):
+        job = enqueue("email_subscribers", article_id=self.article.pk)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING,
+            attempts=job.max_attempts,
+            locked_by="dead-worker",
+            locked_at=timezone.now() - timedelta(hours=1),
+        )
+
+        self.assertEqual(claim("live-worker"), [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn("dead-worker", job.last_error)
+
+    def test_worker_survives_database_errors(self):
+        enqueue("email_subscribers", article_id=self.article.pk)
+        Article.objects.filter(pk=self.article.pk).update(approved=True)
+        real_claim = claim
+        calls = []
+
+        def flaky_claim(worker_id):
+            calls.append(worker_id)
+            if len(calls) == 1:
+                raise OperationalError("server has gone away")
+            return real_claim(worker_id)
+
+        class InlineThread:
+            # Runs the worker in the test's transaction.
+            def __init__(self, target, args, **kwargs):
+                self.run = lambda: target(*args)
+
+            def start(self):
+                self.run()
+
+            def is_alive(self):
+                return False
+
+        command = "news.management.commands.run_jobs"
+        out = StringIO()
+        with (
+            mock.patch(f"{command}.threading.Thread", InlineThread),
+            mock.patch(f"{command}.claim", side_effect=flaky_claim),
+            mock.patch(f"{command}.retry_delay", return_value=0),
+            mock.patch(f"{command}.close_old_connections"),
+            mock.patch(f"{command}.connection"),
+            self.assertLogs(command, "ERROR"),
+        ):
+            call_command("run_jobs", workers=1, once=True, stdout=out)
+
+        self.assertIn("Processed 1 job(s).", out.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class ListingIndexBenchTests(TransactionTestCase):
+    @override_settings(BENCH_SCRATCH_DATABASES=["default"])
+    def test_bench_listings_uses_indexes(self):
+        out = StringIO()
+        call_command("bench_listings", seed=200, repeat=1, compare=True, json=True, stdout=out, stderr=StringIO())
+
+        results = json.loads(out.getvalue())
+        self.assertEqual(set(results), {"without_indexes", "with_indexes"})
+        if connection.vendor == "sqlite":
+            self.assertIn("article_created_idx", results["with_indexes"]["editor_articles"]["plan"])
+            self.assertNotIn("article_created_idx", results["without_indexes"]["editor_articles"]["plan"])
+
+    def test_compare_refuses_a_database_that_is_not_scratch(self):
+        with self.assertRaisesMessage(CommandError, "BENCH_SCRATCH_DATABASES"):
+            call_command("bench_listings", repeat=1, compare=True, stdout=StringIO(), stderr=StringIO())
+
+
+class MaterializedFeedTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.pub1 = Publisher.objects.create(name="pub1")
+        self.pub2 = Publisher.objects.create(name="pub2")
+        self.j1 = CustomUser.objects.create_user(username="journalist1", password="pass", role="journalist")
+        self.reader = CustomUser.objects.create_user(username="reader", password="pass", role="reader")
+
+    def feed(self):
+        return set(FeedEntry.objects.filter(reader=self.reader).values_list("article__title", flat=True))
+
+    def create(self, title, publisher, journalist=None, approved=True):
+        article = Article.objects.create(
+            title=title, content="C", publisher=publisher, journalist=journalist, approved=approved
+        )
+        run_pending()
+        return article
+
+    def test_fanout_ignores_a_stale_subscription_cache(self):
+        subscriptions.publisher_subscriber_ids(self.pub1.pk)
+        # Subscribed in another process: this one's cached set is stale.
+        CustomUser.subscribed_publishers.through.objects.create(customuser=self.reader, publisher=self.pub1)
+
+        self.create("A", self.pub1)
+        self.assertEqual(self.feed(), {"A"})
+
+    def test_approval_fans_out_to_subscribers(self):
+        self.reader.subscribed_publishers.add(self.pub1)
+        article = self.create("A", self.pub1, approved=False)
+        self.assertEqual(self.feed(), set())
+
+        article.approved = True
+        article.save()
+        self.assertEqual(self.feed(), set())
+        run_pending()
+        self.assertEqual(self.feed(), {"A"})
+
+        article.approved = False
+        article.save()
+        self.assertEqual(self.feed(), set())
+
+    def test_subscription_changes_update_feed(self):
+        self.create("P1", self.pub1)
+        self.create("P2 by J1", self.pub2, self.j1)
+        self.create("P1 by J1", self.pub1, self.j1)
+
+        self.reader.subscribed_publishers.add(self.pub1)
+        self.assertEqual(self.feed(), {"P1", "P1 by J1"})
+
+        self.j1.journalist_subscribers.add(self.reader)
+        self.assertEqual(self.feed(), {"P1", "P1 by J1", "P2 by J1"})
+
+        self.reader.subscribed_publishers.remove(self.pub1)
+        self.assertEqual(self.feed(), {"P1 by J1", "P2 by J1"})
+
+        self.reader.subscribed_journalists.clear()
+        self.assertEqual(self.feed(), set())
+
+    def test_repair_fixes_drift(self):
+        self.reader.subscribed_publishers.add(self.pub1)
+        keep = self.create("keep", self.pub1)
+        stray = self.create("stray", self.pub2)
+        FeedEntry.objects.filter(article=keep).delete()
+        FeedEntry.objects.create(reader=self.reader, article=stray, created_at=stray.created_at)
+
+        call_command("repair_feeds", dry_run=True, stdout=StringIO())
+        self.assertEqual(self.feed(), {"stray"})
+
+        call_command("repair_feeds", stdout=StringIO())
+        self.assertEqual(self.feed(), {"keep"})
+
+    def test_feed_read_is_single_query(self):
+        self.reader.subscribed_publishers.add(self.pub1)
+        for i in range(3):
+            self.create(f"A{i}", self.pub1, self.j1)
+        self.client.login(username="reader", password="pass")
+
+        res = self.client.get(reverse("get_articles"))
+        with CaptureQueriesContext(connection) as ctx:
+            data = read_json(res)
+
+        self.assertEqual(len(data["articles"]), 3)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn("news_feedentry", ctx.captured_queries[0]["sql"])
+
+
+class FeedCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.pub = Publisher.objects.create(name="pub")
+        self.reader = CustomUser.objects.create_user(username="reader", password="pass", role="reader")
+        self.reader.subscribed_publishers.add(self.pub)
+        Article.objects.create(title="A1", content="C", publisher=self.pub, approved=True)
+        run_pending()
+        self.client.login(username="reader", password="pass")
+        self.url = reverse("get_articles")
+
+    def fetch(self, **headers):
+        res = self.client.get(self.url, headers=headers)
+        if res.streaming:
+            res.content_bytes = b"".join(res.streaming_content)
+        return res
+
+    def test_if_none_match_returns_304_without_reading_articles(self):
+        etag = self.fetch()["ETag"]
+
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.fetch(if_none_match=etag)
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res["ETag"], etag)
+        for query in ctx.captured_queries:
+            self.assertNotIn("news_article", query["sql"])
+            self.assertNotIn("news_feedentry", query["sql"])
+
+    def test_cached_body_is_served_until_feed_changes(self):
+        first = self.fetch()
+        self.assertTrue(first.streaming)
+
+        second = self.fetch()
+        self.assertFalse(second.streaming)
+        self.assertEqual(second.content, first.content_bytes)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+        Article.objects.create(title="A2", content="C", publisher=self.pub, approved=True)
+        run_pending()
+
+        third = self.fetch(if_none_match=first["ETag"])
+        self.assertEqual(third.status_code, 200)
+        self.assertNotEqual(third["ETag"], first["ETag"])
+        self.assertIn(b"A2", third.content_bytes)
+
+    def test_etag_changes_with_subscriptions_edits_and_variant(self):
+        etag = self.fetch()["ETag"]
+        self.assertNotEqual(self.client.get(self.url, {"limit": 1})["ETag"], etag)
+
+        other = Publisher.objects.create(name="other")
+        self.reader.subscribed_publishers.add(other)
+        etag2 = self.fetch()["ETag"]
+        self.assertNotEqual(etag2, etag)
+
+        article = Article.objects.get(title="A1")
+        article.content = "edited"
+        article.save()
+        self.assertNotEqual(self.fetch()["ETag"], etag2)
+
+    @override_settings(FEED_CACHE_VERSION_TIMEOUT=60)
+    def test_version_tokens_expire(self):
+        etag = self.fetch()["ETag"]
+        later = time.time() + 61
+        with mock.patch("django.core.cache.backends.locmem.time.time", return_value=later - 2):
+            self.assertEqual(self.fetch(if_none_match=etag).status_code, 304)
+        with mock.patch("django.core.cache.backends.locmem.time.time", return_value=later):
+            self.assertEqual(self.fetch(if_none_match=etag).status_code, 200)
+
+    def test_renaming_a_journalist_changes_the_feed(self):
+        journalist = CustomUser.objects.create_user(username="jo", password="pass", role="journalist")
+        Article.objects.create(title="A2", content="C", publisher=self.pub, journalist=journalist, approved=True)
+        run_pending()
+        first = self.fetch()
+        self.assertIn(b'"jo"', first.content_bytes)
+        etag = first["ETag"]
+
+        journalist.last_login = timezone.now()
+        journalist.save()
+        self.assertEqual(self.fetch(if_none_match=etag).status_code, 304)
+
+        journalist.username = "joanna"
+        journalist.save()
+        res = self.fetch(if_none_match=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'"joanna"', res.content_bytes)
+
+
+class SubscriptionIndexTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.pub1 = Publisher.objects.create(name="pub1")
+        self.pub2 = Publisher.objects.create(name="pub2")
+        self.j1 = CustomUser.objects.create_user(username="journalist1", password="pass", role="journalist")
+        self.r1 = CustomUser.objects.create_user(username="reader1", password="pass", role="reader")
+        self.r2 = CustomUser.objects.create_user(username="reader2", password="pass", role="reader")
+
+    def test_sets_are_cached(self):
+        self.r1.subscribed_publishers.add(self.pub1)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(subscriptions.reader_publisher_ids(self.r1.pk), {self.pub1.pk})
+            self.assertEqual(subscriptions.publisher_subscriber_ids(self.pub1.pk), {self.r1.pk})
+        with self.assertNumQueries(0):
+            subscriptions.reader_publisher_ids(self.r1.pk)
+            subscriptions.publisher_subscriber_ids(self.pub1.pk)
+
+    def test_changes_invalidate_both_directions(self):
+        self.assertEqual(subscriptions.reader_publisher_ids(self.r1.pk), set())
+        self.assertEqual(subscriptions.publisher_subscriber_ids(self.pub1.pk), set())
+        self.assertEqual(subscriptions.journalist_subscriber_ids(self.j1.pk), set())
+
+        self.r1.subscribed_publishers.add(self.pub1)
+        self.pub1.subscribers.add(self.r2)
+        self.j1.journalist_subscribers.add(self.r1)
+
+        self.assertEqual(subscriptions.reader_publisher_ids(self.r2.pk), {self.pub1.pk})
+        self.assertEqual(subscriptions.publisher_subscriber_ids(self.pub1.pk), {self.r1.pk, self.r2.pk})
+        self.assertEqual(subscriptions.reader_journalist_ids(self.r1.pk), {self.j1.pk})
+        self.assertEqual(subscriptions.subscriber_ids(self.pub2.pk, self.j1.pk), {self.r1.pk})
+
+        self.r1.subscribed_publishers.clear()
+        self.assertEqual(subscriptions.publisher_subscriber_ids(self.pub1.pk), {self.r2.pk})
+
+        self.r1.subscribed_journalists.remove(self.j1)
+        self.assertEqual(subscriptions.journalist_subscriber_ids(self.j1.pk), set())
+
+    def test_untouched_sets_stay_cached(self):
+        subscriptions.publisher_subscriber_ids(self.pub2.pk)
+        self.r1.subscribed_publishers.add(self.pub1)
+
+        with self.assertNumQueries(0):
+            subscriptions.publisher_subscriber_ids(self.pub2.pk)
+
+    def test_deleting_a_reader_drops_them_from_cached_sets(self):
+        self.r1.subscribed_publishers.add(self.pub1)
+        self.assertEqual(subscriptions.publisher_subscriber_ids(self.pub1.pk), {self.r1.pk})
+
+        self.r1.delete()
+        self.assertEqual(subscriptions.publisher_subscriber_ids(self.pub1.pk), set())
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.enterContext(self.settings(METRICS_DIR=self.dir.name))
+        self.pub = Publisher.objects.create(name="pub")
+        self.article = Article.objects.create(title="Cached", content="Body", publisher=self.pub, approved=True)
+        self.reader = CustomUser.objects.create_user(username="reader", password="pass", role="reader")
+        self.client.login(username="reader", password="pass")
+
+    def test_pages_are_served_from_cache(self):
+        for name, args in (("articles", []), ("article_detail", [self.article.pk])):
+            url = reverse(name, args=args)
+            first = self.client.get(url)
+            with CaptureQueriesContext(connection) as ctx:
+                second = self.client.get(url)
+
+            self.assertEqual(first.content, second.content)
+            for query in ctx.captured_queries:
+                self.assertNotIn("news_article", query["sql"])
+
+        self.assertEqual(self.events()["hits"], 2)
+        self.assertEqual(self.events()["misses"], 2)
+
+    def events(self):
+        return {
+            dict(labels)["event"]: value
+            for (sample, labels), value in metrics.collect().items()
+            if sample == "news_page_cache_events_total"
+        }
+
+    def test_pages_rendered_before_commit_are_dropped(self):
+        detail = reverse("article_detail", args=[self.article.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.title = "Renamed"
+            self.article.save()
+            # Another request renders the old row before the save commits.
+            stale = page_cache._cache()
+            stale.set(page_cache.article_detail_key(self.article.pk), "Cached")
+            stale.set(page_cache.article_list_key(None, None), "Cached")
+
+        self.assertContains(self.client.get(detail), "Renamed")
+        self.assertContains(self.client.get(reverse("articles")), "Renamed")
+
+    def test_article_and_publisher_changes_invalidate(self):
+        detail = reverse("article_detail", args=[self.article.pk])
+        self.assertContains(self.client.get(reverse("articles")), "Cached")
+        self.assertContains(self.client.get(detail), "pub")
+
+        self.article.title = "Renamed"
+        self.article.save()
+        self.assertContains(self.client.get(reverse("articles")), "Renamed")
+
+        self.pub.name = "new-pub-name"
+        self.pub.save()
+        self.assertContains(self.client.get(detail), "new-pub-name")
+
+        self.article.approved = False
+        self.article.save()
+        self.assertEqual(self.client.get(detail).status_code, 404)
+
+    def test_concurrent_misses_build_once(self):
+        calls = []
+        started = threading.Event()
+
+        def build():
+            calls.append(1)
+            started.set()
+            time.sleep(0.3)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(page_cache.get_or_build("stampede", build)))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(self.events()["waits"], 4)
+
+    @override_settings(PAGE_CACHE_LOCK_TIMEOUT=0)
+    def test_build_after_waiting_reads_the_primary(self):
+        page_cache._cache().add("slow:lock", "other process")
+        with mock.patch.object(replicas, "primary", wraps=replicas.primary) as primary:
+            self.assertEqual(page_cache.get_or_build("slow", lambda: "value"), "value")
+        primary.assert_called_once()
+        self.assertEqual(self.events()["waits"], 1)
+
+
+@override_settings(EMAIL_BATCH_SIZE=2)
+class EmailDeliveryTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.pub = Publisher.objects.create(name="pub")
+        self.readers = []
+        for i in range(5):
+            reader = CustomUser.objects.create_user(
+                username=f"reader{i}", password="pass", role="reader", email=f"reader{i}@example.com"
+            )
+            reader.subscribed_publishers.add(self.pub)
+            self.readers.append(reader)
+        CustomUser.objects.create_user(username="no-email", password="pass", role="reader").subscribed_publishers.add(
+            self.pub
+        )
+        self.article = Article.objects.create(title="Hello", content="Body", publisher=self.pub, approved=True)
+
+    def test_one_message_per_recipient_in_batches(self):
+        self.assertEqual(email_subscribers(self.article), 5)
+
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertTrue(all(len(m.to) == 1 for m in mail.outbox))
+        self.assertEqual(sorted(a for m in mail.outbox for a in m.to), [r.email for r in self.readers])
+        self.assertEqual(
+            list(EmailBatch.objects.order_by("id").values_list("recipients", "sent", "error")),
+            [(2, 2, ""), (2, 2, ""), (1, 1, "")],
+        )
+
+    def test_failed_batch_stops_and_retry_resumes(self):
+        calls = []
+        real_send = locmem.EmailBackend.send_messages
+
+        def flaky(backend, messages):
+            calls.append(len(messages))
+            # The second message of the second batch.
+            if len(calls) == 4:
+                raise smtplib.SMTPServerDisconnected("gone")
+            return real_send(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, "send_messages", flaky):
+            with self.assertRaises(DeliveryError):
+                email_subscribers(self.article, fail_silently=False, delivery="d1")
+        self.assertEqual(len(mail.outbox), 3)
+
+        email_subscribers(self.article, fail_silently=False, delivery="d1")
+
+        self.assertEqual(sorted(a for m in mail.outbox for a in m.to), [r.email for r in self.readers])
+        self.assertEqual(EmailBatch.objects.exclude(error="").count(), 1)
+
+    def test_refused_recipient_does_not_fail_the_batch(self):
+        real_send = locmem.EmailBackend.send_messages
+        refused = self.readers[1].email
+
+        def refusing(backend, messages):
+            if messages[0].to == [refused]:
+                raise smtplib.SMTPRecipientsRefused({refused: (550, b"No such user")})
+            return real_send(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, "send_messages", refusing):
+            self.assertEqual(email_subscribers(self.article, fail_silently=False, delivery="d1"), 4)
+            email_subscribers(self.article, fail_silently=False, delivery="d1")
+
+        self.assertEqual(len(mail.outbox), 4)
+        batch = EmailBatch.objects.get(first_recipient_id=self.readers[0].pk)
+        self.assertEqual((batch.recipients, batch.sent, batch.error), (2, 1, ""))
+        self.assertEqual([f["recipient"] for f in batch.failures], [self.readers[1].pk])
+
+    def test_recipients_are_not_read_from_the_cache(self):
+        subscriptions.publisher_subscriber_ids(self.pub.pk)
+        # As another process would: no m2m_changed, so the cached set is stale.
+        late = CustomUser.objects.create_user(username="late", password="pass", role="reader", email="late@example.com")
+        CustomUser.subscribed_publishers.through.objects.create(customuser=late, publisher=self.pub)
+
+        self.assertEqual(email_subscribers(self.article), 6)
+
+    def test_new_delivery_starts_over(self):
+        email_subscribers(self.article, delivery="d1")
+        email_subscribers(self.article, delivery="d1")
+        self.assertEqual(len(mail.outbox), 5)
+
+        email_subscribers(self.article, delivery="d2")
+        self.assertEqual(len(mail.outbox), 10)
+
+    @override_settings(EMAIL_RATE_LIMIT=10)
+    def test_rate_limit_paces_batches(self):
+        with mock.patch("news.delivery.time.sleep") as sleep:
+            email_subscribers(self.article)
+
+        self.assertEqual(sleep.call_count, 3)
+        self.assertAlmostEqual(sleep.call_args_list[0].args[0], 0.2, places=1)
+
+    def test_smtp_connection_is_reused(self):
+        stub = SMTPStub()
+        self.addCleanup(stub.close)
+
+        with self.settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=stub.port,
+        ):
+            self.assertEqual(email_subscribers(self.article, fail_silently=False), 5)
+
+        self.assertEqual(stub.connections, 1)
+        self.assertEqual(sorted(r for m in stub.messages for r in m), [r.email for r in self.readers])
+        self.assertTrue(all(len(m) == 1 for m in stub.messages))
+
+
+@override_settings(PAGE_SIZE=2)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.pub = Publisher.objects.create(name="pub")
+        self.editor = CustomUser.objects.create_user(username="editor", password="pass", role="editor")
+        self.articles = [
+            Article.objects.create(title=f"A{i}", content="C", publisher=self.pub, approved=i % 2 == 0)
+            for i in range(5)
+        ]
+        self.client.login(username="editor", password="pass")
+
+    def test_next_and_previous_links_walk_every_row_once(self):
+        url = reverse("editor_articles")
+
+        res = self.client.get(url)
+        pages = [res.context["page"]]
+        while pages[-1].has_next:
+            res = self.client.get(url, {"after": pages[-1].next_cursor})
+            pages.append(res.context["page"])
+
+        seen = [a.pk for page in pages for a in page]
+        self.assertEqual(seen, [a.pk for a in reversed(self.articles)])
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertFalse(pages[0].has_previous)
+        self.assertContains(self.client.get(url), "?after=")
+
+        res = self.client.get(url, {"before": pages[-1].previous_cursor})
+        self.assertEqual([a.pk for a in res.context["page"]], [a.pk for a in pages[1]])
+
+    def test_list_views_fetch_one_page(self):
+        Newsletter.objects.create(title="N", content="C", publisher=self.pub)
+        for name in ("articles", "review_articles", "editor_articles", "editor_newsletters"):
+            res = self.client.get(reverse(name))
+            self.assertEqual(res.status_code, 200)
+            self.assertLessEqual(len(res.context["page"].object_list), 2)
+
+    def test_bad_cursor_is_rejected(self):
+        res = self.client.get(reverse("editor_articles"), {"after": "garbage"})
+        self.assertEqual(res.status_code, 400)
+
+
+class SocialClientTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        quiet = mock.patch.object(logging.getLogger("news.social"), "disabled", True)
+        quiet.start()
+        self.addCleanup(quiet.stop)
+        self.stub = HTTPStub()
+        self.addCleanup(self.stub.close)
+        self.article = Article(pk=1, title="Hello", content="Body")
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.enterContext(self.settings(METRICS_DIR=self.dir.name))
+
+    def make_client(self, **kwargs):
+        kwargs.setdefault("backoff", 0)
+        client = SocialClient(StubAdapter(self.stub.url), **kwargs)
+        self.addCleanup(client.session.close)
+        return client
+
+    def counted(self, event):
+        samples = metrics.collect()
+        if event == "short_circuited":
+            return samples.get(("news_social_posts_total", (("adapter", "stub"), ("result", event))), 0)
+        return samples.get(("news_social_requests_total", (("adapter", "stub"), ("event", event))), 0)
+
+    def test_posts_reuse_one_connection(self):
+        client = self.make_client()
+        for _ in range(5):
+            client.publish(self.article)
+
+        self.assertEqual(len(self.stub.requests), 5)
+        self.assertEqual(self.stub.connections, 1)
+        self.assertEqual(self.counted("successes"), 5)
+        self.assertEqual(metrics.collect()[("news_social_request_duration_seconds_count", (("adapter", "stub"),))], 5)
+
+    def test_server_errors_are_retried_with_an_idempotency_key(self):
+        self.stub.statuses = [503, 500]
+        client = self.make_client(retries=2)
+        with mock.patch.object(client.adapter, "idempotency_key", return_value="article-1"):
+            client.publish(self.article)
+
+        self.assertEqual(len(self.stub.requests), 3)
+        self.assertEqual(self.counted("retries"), 2)
+        self.assertEqual(self.counted("failures"), 2)
+
+    def test_server_errors_without_an_idempotency_key_are_not_retried(self):
+        # A gateway's 502 may follow a post that was published.
+        self.stub.statuses = [502]
+        client = self.make_client(retries=2)
+        with self.assertRaises(SocialPublishError) as ctx:
+            client.publish(self.article)
+        self.assertFalse(ctx.exception.retryable)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_rate_limits_are_retried(self):
+        self.stub.statuses = [429]
+        self.make_client(retries=2).publish(self.article)
+        self.assertEqual(len(self.stub.requests), 2)
+
+    def test_client_errors_are_not_retried(self):
+        self.stub.statuses = [403]
+        client = self.make_client(retries=2)
+        with self.assertRaises(SocialPublishError):
+            client.publish(self.article)
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_breaker_stops_calling_a_failing_endpoint(self):
+        self.stub.statuses = [500] * 10
+        client = self.make_client(retries=0)
+        client.breaker.threshold = 2
+        client.breaker.reset_timeout = 60
+
+        for _ in range(2):
+            with self.assertRaises(SocialPublishError):
+                client.publish(self.article)
+        with self.assertRaises(CircuitOpenError):
+            client.publish(self.article)
+
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertEqual(self.counted("short_circuited"), 1)
+        self.assertEqual(client.breaker.state, "open")
+
+        # After the reset timeout one trial call closes it again.
+        client.breaker.reset_timeout = 0
+        self.stub.statuses = []
+        client.publish(self.article)
+        self.assertEqual(client.breaker.state, "closed")
+
+    def test_unreachable_endpoint_fails_fast(self):
+        self.stub.close()
+        client = self.make_client(retries=1, timeout=1)
+        with self.assertRaises(SocialPublishError):
+            client.publish(self.article)
+        self.assertEqual(self.counted("failures"), 2)
+
+    def test_client_errors_do_not_open_the_breaker(self):
+        self.stub.statuses = [400, 400]
+        client = self.make_client(retries=0)
+        client.breaker.threshold = 1
+
+        for _ in range(2):
+            with self.assertRaises(SocialPublishError) as ctx:
+                client.publish(self.article)
+            self.assertNotIsInstance(ctx.exception, CircuitOpenError)
+            self.assertFalse(ctx.exception.retryable)
+        self.assertEqual(client.breaker.state, "closed")
+
+    def test_read_timeout_is_only_retried_with_an_idempotency_key(self):
+        session = mock.Mock()
+        session.request.side_effect = requests.ReadTimeout("slow")
+        client = self.make_client(retries=2, session=session)
+
+        with self.assertRaises(SocialPublishError) as ctx:
+            client.publish(self.article)
+        self.assertFalse(ctx.exception.retryable)
+        self.assertEqual(session.request.call_count, 1)
+
+        session.request.reset_mock()
+        with mock.patch.object(client.adapter, "idempotency_key", return_value="article-1"):
+            with self.assertRaises(SocialPublishError) as ctx:
+                client.publish(self.article)
+        self.assertTrue(ctx.exception.retryable)
+        self.assertEqual(session.request.call_count, 3)
+
+    def test_job_ends_on_an_error_that_is_not_retryable(self):
+        pub = Publisher.objects.create(name="pub")
+        journalist = CustomUser.objects.create_user(username="j", password="pass", role="journalist")
+        article = Article.objects.create(title="T", content="C", publisher=pub, journalist=journalist, approved=True)
+        client = mock.Mock()
+        with mock.patch("news.notifications.get_client", return_value=client):
+            client.publish.side_effect = SocialPublishError("HTTP 403", retryable=False)
+            with self.assertLogs("news.notifications", "ERROR"):
+                post_to_x_job(article.pk)
+
+            client.publish.side_effect = SocialPublishError("HTTP 503")
+            with self.assertRaises(SocialPublishError):
+                post_to_x_job(article.pk)
+
+
+class RoleGroupTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.pub = Publisher.objects.create(name="Pub")
+        self.journalist = CustomUser.objects.create_user(username="j", password="pass", role=CustomUser.JOURNALIST)
+        self.user = CustomUser.objects.create_user(username="u", password="pass", role=CustomUser.READER)
+        self.user.subscribed_publishers.add(self.pub)
+        self.user.subscribed_journalists.add(self.journalist)
+
+    def group_names(self, user):
+        return sorted(user.groups.values_list("name", flat=True))
+
+    def test_new_user_gets_role_group(self):
+        self.assertEqual(self.group_names(self.user), ["Reader"])
+
+    def test_unrelated_saves_run_no_extra_queries(self):
+        user = CustomUser.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            user.save(update_fields=["last_login"])
+        user.email = "u@example.com"
+        with self.assertNumQueries(1):
+            user.save()
+        with self.assertNumQueries(1):
+            self.pub.save()
+        self.assertEqual(self.user.subscribed_publishers.count(), 1)
+
+    def test_login_does_not_touch_memberships(self):
+        with CaptureQueriesContext(connection) as captured:
+            self.client.force_login(self.user)
+        self.assertFalse([q for q in captured if "news_customuser_" in q["sql"] or "auth_group" in q["sql"]])
+
+    def test_role_change_moves_group_and_clears_subscriptions(self):
+        user = CustomUser.objects.get(pk=self.user.pk)
+        user.role = CustomUser.EDITOR
+        user.save()
+
+        self.assertEqual(self.group_names(user), ["Editor"])
+        self.assertFalse(user.subscribed_publishers.exists())
+        self.assertFalse(user.subscribed_journalists.exists())
+        self.assertEqual(subscriptions.publisher_subscriber_ids(self.pub.pk), frozenset())
+
+        # A second save with the same role is a no-op.
+        with self.assertNumQueries(1):
+            user.save()
+
+    def test_deferred_role_is_looked_at_only_when_set(self):
+        user = CustomUser.objects.only("id", "username").get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            user.save(update_fields=["username"])
+
+        user.role = CustomUser.JOURNALIST
+        user.save(update_fields=["role"])
+        self.assertEqual(self.group_names(user), ["Journalist"])
+
+    def test_bench_logins_reports_queries(self):
+        out = StringIO()
+        call_command("bench_logins", users=2, repeat=1, json=True, stdout=out)
+        result = json.loads(out.getvalue())
+        self.assertEqual(result["logins"], 2)
+        self.assertGreater(result["queries_per_login"], 0)
+
+    def test_bench_logins_fails_when_a_login_does_not_stick(self):
+        with mock.patch("django.test.Client.force_login"):
+            with self.assertRaisesMessage(CommandError, "did not put user"):
+                call_command("bench_logins", users=1, repeat=1, stdout=StringIO())
+
+
+class PermissionBootstrapTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.news_config = apps.get_app_config("news")
+
+    def group_perms(self):
+        return {
+            group.name: sorted(group.permissions.values_list("codename", flat=True))
+            for group in Group.objects.filter(name__in=GROUP_PERMISSIONS)
+        }
+
+    def test_rerun_is_read_only_and_fast(self):
+        with self.assertNumQueries(3):
+            start = time.perf_counter()
+            create_groups_and_permissions(self.news_config)
+            elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 0.25)
+        self.assertEqual(self.group_perms(), {name: sorted(names) for name, names in GROUP_PERMISSIONS.items()})
+
+    def test_repairs_missing_and_extra_rows(self):
+        Group.objects.filter(name="Reader").delete()
+        editor = Group.objects.get(name="Editor")
+        editor.permissions.remove(Permission.objects.get(codename="change_article"))
+        editor.permissions.add(Permission.objects.get(codename="add_newsletter"))
+
+        create_groups_and_permissions(self.news_config)
+
+        self.assertEqual(self.group_perms(), {name: sorted(names) for name, names in GROUP_PERMISSIONS.items()})
+        user = CustomUser.objects.create_user(username="r", password="pass", role=CustomUser.READER)
+        self.assertEqual(list(user.groups.values_list("name", flat=True)), ["Reader"])
+
+    def test_only_runs_for_news_app(self):
+        # One post_migrate round covers every installed app.
+        with CaptureQueriesContext(connection) as captured:
+            emit_post_migrate_signal(0, False, "default", apps=apps, plan=[])
+        # auth_group itself, not auth_group_permissions; quoting varies by backend.
+        group_queries = [q for q in captured if re.search(r"FROM \W?auth_group\b", q["sql"])]
+        self.assertEqual(len(group_queries), 1)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.pub = Publisher.objects.create(name="Pub")
+        self.user = CustomUser.objects.create_user(username="r", password="pass", role=CustomUser.READER)
+        self.client.login(username="r", password="pass")
+
+        self.title_hit = Article.objects.create(
+            title="Harbour bridge reopens", content="Traffic is flowing again.", publisher=self.pub, approved=True
+        )
+        self.content_hit = Article.objects.create(
+            title="City news",
+            content="Council members met to discuss the harbour <b>budget</b> for next year.",
+            publisher=self.pub,
+            approved=True,
+        )
+        self.pending = Article.objects.create(title="Harbour draft", content="Not yet.", publisher=self.pub)
+
+    def search(self, q, **params):
+        res = self.client.get(reverse("api_article_search"), dict(params, q=q))
+        self.assertEqual(res.status_code, 200)
+        return res.json()
+
+    def test_ranked_results_with_snippets(self):
+        data = self.search("harbour")
+        self.assertEqual([r["id"] for r in data["results"]], [self.title_hit.pk, self.content_hit.pk])
+        snippet = data["results"][1]["snippet"]
+        self.assertIn("<mark>harbour</mark>", snippet)
+        self.assertIn("&lt;b&gt;budget", snippet)
+
+    def test_mysql_leaves_out_terms_it_does_not_index(self):
+        backend = search.MySQLBackend()
+        backend._unindexed = (3, {"the", "about"})
+
+        self.assertEqual(backend.boolean_query(["the", "uk", "harbour", "budget"]), "+harbour +budget")
+        self.assertEqual(backend.boolean_query(["about", "it"]), "")
+        self.assertEqual(backend.search(["about", "it"], limit=10), [])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual([r["id"] for r in self.search("Council, budget!")["results"]], [self.content_hit.pk])
+        self.assertEqual(self.search("budg")["results"], [])
+        self.assertEqual(self.search("harbour nonsense")["results"], [])
+        self.assertEqual(self.search('"harbour*" (bridge')["results"][0]["id"], self.title_hit.pk)
+        self.assertEqual(self.search("")["results"], [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.pending.approved = True
+        self.pending.save()
+        self.assertIn(self.pending.pk, [r["id"] for r in self.search("draft")["results"]])
+
+        self.title_hit.title = "Tunnel closes"
+        self.title_hit.save()
+        self.assertEqual([r["id"] for r in self.search("tunnel")["results"]], [self.title_hit.pk])
+        self.assertNotIn(self.title_hit.pk, [r["id"] for r in self.search("bridge")["results"]])
+
+        self.content_hit.delete()
+        self.pending.approved = False
+        self.pending.save()
+        self.assertEqual(self.search("harbour")["results"], [])
+
+    def test_pages_with_offset(self):
+        first = self.search("harbour", limit=1)
+        self.assertEqual(first["next_offset"], 1)
+        second = self.search("harbour", limit=1, offset=1)
+        self.assertEqual([r["id"] for r in second["results"]], [self.content_hit.pk])
+        self.assertIsNone(second["next_offset"])
+
+    def test_html_page(self):
+        res = self.client.get(reverse("article_search"), {"q": "harbour"})
+        self.assertContains(res, "Harbour bridge reopens")
+        self.assertContains(res, "<mark>harbour</mark>")
+        self.assertNotContains(res, "Harbour draft")
+
+    def test_reindex_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM news_article_fts")
+        self.assertEqual(self.search("harbour")["results"], [])
+
+        out = StringIO()
+        call_command("reindex_search", stdout=out)
+        self.assertIn("Indexed 2 articles", out.getvalue())
+        self.assertEqual(len(self.search("harbour")["results"]), 2)
+
+
+class ImportContentTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.pub = Publisher.objects.create(name="Daily")
+        self.journalist = CustomUser.objects.create_user(username="jo", password="pass", role=CustomUser.JOURNALIST)
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(text)
+        return path
+
+    def run_import(self, *args, **options):
+        out = StringIO()
+        call_command("import_content", *args, stdout=out, **options)
+        return out.getvalue()
+
+    def test_jsonl_import_with_rejects(self):
+        rows = [
+            {"title": "Old news", "content": "Body", "publisher": "Daily", "journalist": "jo",
+             "approved": True, "created_at": "2015-03-01T10:00:00"},
+            {"title": "Draft", "content": "Body", "publisher": "Daily"},
+            {"title": "", "content": "Body", "publisher": "Daily"},
+            {"title": "No publisher", "content": "Body"},
+            {"title": "Bad publisher", "content": "Body", "publisher": "Nope"},
+            {"title": "Bad journalist", "content": "Body", "publisher": "Daily", "journalist": "ghost"},
+        ]
+        lines = [json.dumps(row) for row in rows] + ["{not json"]
+        path = self.write("articles.jsonl", "\n".join(lines) + "\n")
+
+        output = self.run_import(path, batch_size=1)
+
+        self.assertIn("Imported 2 articles", output)
+        self.assertIn("rejected 5", output)
+        old = Article.objects.get(title="Old news")
+        self.assertTrue(old.approved)
+        self.assertEqual(old.journalist, self.journalist)
+        self.assertEqual(old.created_at.year, 2015)
+        self.assertFalse(Article.objects.get(title="Draft").approved)
+
+        with open(path + ".rejects.jsonl") as handle:
+            rejects = [json.loads(line) for line in handle]
+        self.assertEqual([r["line"] for r in rejects], [3, 4, 5, 6, 7])
+        self.assertEqual(rejects[0]["error"], "Title is required.")
+        self.assertEqual(rejects[1]["error"], "Publisher is required.")
+        self.assertEqual(rejects[2]["error"], "Unknown publisher: Nope")
+
+        # Approved imports reach search and the feed fan-out like saved ones.
+        self.assertEqual([r["id"] for r in search.search_articles("old news", 10)], [old.pk])
+        self.assertEqual(list(Job.objects.values_list("kind", "payload")), [("fanout_articles", {"article_ids": [old.pk]})])
+
+    def test_csv_newsletters_in_batches(self):
+        lines = ["title,content,publisher,journalist"]
+        lines += [f"Issue {i},Text {i},Daily,jo" for i in range(25)]
+        path = self.write("newsletters.csv", "\n".join(lines) + "\n")
+
+        with CaptureQueriesContext(connection) as captured:
+            output = self.run_import(path, model="newsletter", batch_size=10)
+
+        self.assertIn("Imported 25 newsletters", output)
+        self.assertEqual(Newsletter.objects.filter(journalist=self.journalist).count(), 25)
+        inserts = [q for q in captured if q["sql"].startswith("INSERT INTO") and "news_newsletter" in q["sql"]]
+        self.assertEqual(len(inserts), 3)
+        self.assertFalse(os.path.exists(path + ".rejects.jsonl"))
+
+
+class ExportContentTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.pub = Publisher.objects.create(name="Daily")
+        self.journalist = CustomUser.objects.create_user(username="jo", password="pass", role=CustomUser.JOURNALIST)
+        self.reader = CustomUser.objects.create_user(username="r", password="pass", role=CustomUser.READER)
+        self.reader.subscribed_publishers.add(self.pub)
+        self.reader.subscribed_journalists.add(self.journalist)
+        self.articles = [
+            Article.objects.create(
+                title=f"A{i}", content="Body <b>", publisher=self.pub, journalist=self.journalist, approved=i % 2 == 0
+            )
+            for i in range(5)
+        ]
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def export(self, *args, **options):
+        call_command("export_content", *args, stdout=StringIO(), **options)
+
+    def test_ndjson_gzip_in_chunks(self):
+        out = self.path("articles.ndjson.gz")
+        self.export("articles", output=out, chunk_size=2)
+
+        with gzip.open(out, "rt", encoding="utf-8") as handle:
+            rows = [json.loads(line) for line in handle]
+        self.assertEqual([r["id"] for r in rows], [a.pk for a in self.articles])
+        self.assertEqual(rows[0]["publisher"], "Daily")
+        self.assertEqual(rows[0]["journalist"], "jo")
+
+    def test_xml_matches_feed_schema(self):
+        out = self.path("articles.xml")
+        self.export("articles", format="xml", output=out)
+        with open(out, "rb") as handle:
+            self.assertEqual(handle.read(), serialize_articles_to_xml(Article.objects.order_by("created_at", "id")))
+
+    def test_csv_subscriptions(self):
+        out = self.path("subs.csv")
+        self.export("journalist-subscriptions", format="csv", output=out)
+        with open(out, newline="") as handle:
+            rows = list(csv.DictReader(handle))
+        self.assertEqual(rows, [{"id": rows[0]["id"], "reader_id": str(self.reader.pk), "journalist_id": str(self.journalist.pk)}])
+
+    def test_watermark_exports_only_new_rows(self):
+        out = self.path("articles.ndjson")
+        mark = self.path("articles.watermark")
+
+        self.export("articles", output=out, watermark_file=mark, chunk_size=2)
+        with open(out) as handle:
+            self.assertEqual(len(handle.readlines()), 5)
+
+        newer = Article.objects.create(title="New", content="Body", publisher=self.pub)
+        self.export("articles", output=out, watermark_file=mark)
+        with open(out) as handle:
+            self.assertEqual([json.loads(line)["id"] for line in handle], [newer.pk])
+
+        self.export("articles", output=out, watermark_file=mark)
+        with open(out) as handle:
+            self.assertEqual(handle.read(), "")
+        with open(mark) as handle:
+            self.assertEqual(json.load(handle)["id"], newer.pk)
+
+    def test_export_round_trips_through_import(self):
+        out = self.path("newsletters.ndjson")
+        Newsletter.objects.create(title="N1", content="C", publisher=self.pub, journalist=self.journalist)
+        self.export("newsletters", output=out)
+        Newsletter.objects.all().delete()
+
+        call_command("import_content", out, model="newsletter", format="jsonl", stdout=StringIO())
+        self.assertEqual(list(Newsletter.objects.values_list("title", "journalist__username")), [("N1", "jo")])
+
+
+class BulkModerationTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.daily = Publisher.objects.create(name="Daily")
+        self.weekly = Publisher.objects.create(name="Weekly")
+        self.editor = CustomUser.objects.create_user(username="editor", password="pass", role=CustomUser.EDITOR)
+        self.both = CustomUser.objects.create_user(
+            username="both", password="pass", role=CustomUser.READER, email="both@example.com"
+        )
+        self.both.subscribed_publishers.add(self.daily, self.weekly)
+        self.weekly_reader = CustomUser.objects.create_user(
+            username="weekly", password="pass", role=CustomUser.READER, email="weekly@example.com"
+        )
+        self.weekly_reader.subscribed_publishers.add(self.weekly)
+
+        self.live = Article.objects.create(title="Live", content="Body", publisher=self.daily, approved=True)
+        self.pending = [
+            Article.objects.create(title="Daily one", content="Body", publisher=self.daily),
+            Article.objects.create(title="Weekly one", content="Body", publisher=self.weekly),
+            Article.objects.create(title="Weekly two", content="Body", publisher=self.weekly),
+        ]
+        Job.objects.all().delete()
+        self.client.login(username="editor", password="pass")
+
+    def api(self, action, ids):
+        return self.client.post(
+            reverse("api_moderate_articles"),
+            json.dumps({"action": action, "ids": ids}),
+            content_type="application/json",
+        )
+
+    def test_approve_is_one_conditional_update(self):
+        ids = [a.pk for a in self.pending] + [self.live.pk]
+        with CaptureQueriesContext(connection) as captured:
+            res = self.api("approve", ids)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["ids"], [a.pk for a in self.pending])
+        updates = [q for q in captured if q["sql"].startswith("UPDATE") and "news_article" in q["sql"]]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Article.objects.filter(approved=True).count(), 4)
+        self.assertEqual(
+            sorted(Job.objects.values_list("kind", flat=True)),
+            ["email_digest", "fanout_articles", "post_to_x", "post_to_x", "post_to_x"],
+        )
+        self.assertEqual(len(search.search_articles("weekly", 10)), 2)
+
+        # Approving again changes nothing.
+        self.assertEqual(self.api("approve", ids).json()["ids"], [])
+
+    def test_each_reader_gets_one_email_for_the_batch(self):
+        self.api("approve", [a.pk for a in self.pending])
+        run_pending()
+
+        subjects = {m.to[0]: m.subject for m in mail.outbox}
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(subjects["both@example.com"], "3 New Articles Approved")
+        self.assertEqual(subjects["weekly@example.com"], "2 New Articles Approved")
+        self.assertEqual(FeedEntry.objects.filter(reader=self.both).count(), 3)
+        self.assertEqual(FeedEntry.objects.filter(reader=self.weekly_reader).count(), 2)
+
+    def test_digest_with_a_reapproved_article(self):
+        first = self.pending[0]
+        self.api("approve", [first.pk])
+        run_pending()
+        self.assertEqual(len(mail.outbox), 1)
+        Article.objects.filter(pk=first.pk).update(approved=False)
+
+        self.api("approve", [first.pk, self.pending[1].pk])
+        run_pending()
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox[1:]), ["both@example.com", "weekly@example.com"])
+
+    def test_review_page_form(self):
+        res = self.client.get(reverse("review_articles"))
+        self.assertContains(res, 'name="ids"', count=3)
+
+        with self.assertLogs("news.moderation", "INFO") as logs:
+            res = self.client.post(
+                reverse("moderate_articles"), {"action": "reject", "ids": [self.pending[0].pk, self.live.pk]}
+            )
+        self.assertRedirects(res, reverse("review_articles"))
+        self.assertEqual(logs.output, [f"INFO:news.moderation:editor rejected articles [{self.pending[0].pk}]"])
+        self.assertTrue(Article.objects.get(pk=self.pending[0].pk).rejected)
+        self.assertFalse(Article.objects.get(pk=self.live.pk).rejected)
+        res = self.client.get(reverse("review_articles"))
+        self.assertContains(res, 'name="ids"', count=2)
+
+        self.client.post(reverse("moderate_articles"), {"action": "approve", "ids": [self.pending[1].pk]})
+        self.assertTrue(Article.objects.get(pk=self.pending[1].pk).approved)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.api("publish", [self.pending[0].pk]).status_code, 400)
+        self.assertEqual(self.api("approve", ["x"]).status_code, 400)
+        self.assertEqual(self.api("approve", []).status_code, 400)
+
+        self.client.login(username="weekly", password="pass")
+        self.assertEqual(self.api("approve", [self.pending[0].pk]).status_code, 403)
+        self.assertFalse(Article.objects.get(pk=self.pending[0].pk).approved)
+
+
+class ViewBenchTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        call_command(
+            "seed_bench",
+            publishers=3,
+            journalists=4,
+            editors=1,
+            readers=20,
+            articles=60,
+            newsletters=10,
+            feed_readers=-1,
+            stdout=StringIO(),
+            stderr=StringIO(),
+        )
+
+    def test_seed_bench_volumes(self):
+        self.assertEqual(Article.objects.count(), 60)
+        self.assertEqual(Newsletter.objects.count(), 10)
+        self.assertEqual(CustomUser.objects.filter(role=CustomUser.READER).count(), 20)
+        self.assertTrue(all(r.subscribed_publishers.exists() for r in CustomUser.objects.filter(role=CustomUser.READER)))
+        self.assertTrue(FeedEntry.objects.exists())
+        self.assertTrue(search.search_articles("benchmark", 5))
+
+    def test_bench_views_covers_every_route(self):
+        out = StringIO()
+        call_command("bench_views", repeat=2, stdout=out, stderr=StringIO())
+        report = json.loads(out.getvalue())
+
+        names = {p.name for p in urls.urlpatterns}
+        self.assertEqual(set(report["views"]) | set(report["skipped"]), names)
+        self.assertEqual(
+            set(report["skipped"]),
+            {
+                "logout",
+                "moderate_articles",
+                "api_moderate_articles",
+                "profile_list",
+                "profile_download",
+                "article_stream",
+            },
+        )
+        for name, row in report["views"].items():
+            self.assertEqual(row["status"], 200, name)
+            self.assertGreaterEqual(row["p95_ms"], row["p50_ms"])
+            self.assertGreater(row["peak_memory_kb"], 0)
+        self.assertGreater(report["views"]["editor_articles"]["queries"], 0)
+
+
+@modify_settings(MIDDLEWARE={"prepend": "news.middleware.RequestTimingMiddleware"})
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.pub = Publisher.objects.create(name="Daily")
+        self.reader = CustomUser.objects.create_user(username="r", password="pass", role=CustomUser.READER)
+        for i in range(3):
+            Article.objects.create(title=f"A{i}", content="Body", publisher=self.pub, approved=True)
+        self.client.login(username="r", password="pass")
+
+    def timings(self, response):
+        entries = {}
+        for part in response["Server-Timing"].split(", "):
+            name, *params = part.split(";")
+            entries[name] = dict(param.split("=", 1) for param in params)
+        return entries
+
+    @override_settings(REQUEST_TIMING_SLOW_MS=60000)
+    def test_server_timing_header(self):
+        with self.assertNoLogs("news.middleware"):
+            res = self.client.get(reverse("articles"))
+
+        timings = self.timings(res)
+        self.assertEqual(set(timings), {"db", "tpl", "view", "total"})
+        self.assertRegex(timings["db"]["desc"], r'^"[1-9]\d* queries"$')
+        self.assertGreater(float(timings["tpl"]["dur"]), 0)
+        self.assertGreaterEqual(float(timings["total"]["dur"]), float(timings["view"]["dur"]))
+
+        # A cached page renders no template.
+        timings = self.timings(self.client.get(reverse("articles")))
+        self.assertEqual(float(timings["tpl"]["dur"]), 0)
+
+        timings = self.timings(self.client.get(reverse("home")))
+        self.assertGreater(float(timings["tpl"]["dur"]), 0)
+
+    @override_settings(REQUEST_TIMING_SLOW_MS=0, REQUEST_TIMING_TOP_QUERIES=2)
+    def test_slow_request_log(self):
+        with self.assertLogs("news.middleware", "WARNING") as logs:
+            self.client.get(reverse("articles"))
+
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry["path"], "/articles/")
+        self.assertEqual(entry["view"], "articles")
+        self.assertEqual(entry["status"], 200)
+        self.assertLessEqual(len(entry["top_queries"]), 2)
+        self.assertGreaterEqual(entry["queries"], sum(q["calls"] for q in entry["top_queries"]))
+        self.assertEqual(entry["top_queries"], sorted(entry["top_queries"], key=lambda q: -q["ms"]))
+        self.assertIn("SELECT", entry["top_queries"][0]["sql"])
+
+
+@modify_settings(MIDDLEWARE={"append": "news.middleware.ProfilingMiddleware"})
+class ProfilingTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.enterContext(self.settings(PROFILE_DIR=self.dir.name))
+
+        self.pub = Publisher.objects.create(name="Daily")
+        self.staff = CustomUser.objects.create_user(
+            username="staff", password="pass", role=CustomUser.READER, is_staff=True
+        )
+        self.staff.subscribed_publishers.add(self.pub)
+        self.other = CustomUser.objects.create_user(username="other", password="pass", role=CustomUser.READER)
+        for i in range(3):
+            Article.objects.create(title=f"A{i}", content="Body", publisher=self.pub, approved=True)
+        self.token = profiling.make_token(self.staff)
+
+    def test_profiles_view_with_query_param(self):
+        self.client.login(username="staff", password="pass")
+        res = self.client.get(reverse("articles"), {profiling.PARAM: self.token, "page": "1"})
+        self.assertEqual(res.status_code, 200)
+        name = res["X-Profile"]
+
+        [meta] = profiling.list_profiles()
+        self.assertEqual(meta["name"], name)
+        self.assertEqual(meta["path"], "/articles/?page=1")
+        self.assertEqual(meta["user"], "staff")
+        self.assertGreater(meta["calls"], 0)
+
+        stats = pstats.Stats(profiling.profile_path(name, "pstats"))
+        self.assertTrue(any(func[2] == "articles" for func in stats.stats))
+        # Built on first download, not in the profiled request.
+        self.assertFalse(os.path.exists(os.path.join(self.dir.name, f"{name}.collapsed")))
+        with open(profiling.profile_path(name, "collapsed"), encoding="utf-8") as handle:
+            lines = handle.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+        self.assertTrue(any("articles (views.py:" in line for line in lines))
+
+        listing = self.client.get(reverse("profile_list"))
+        self.assertContains(listing, "/articles/?page=1")
+        download = self.client.get(reverse("profile_download", args=[name, "collapsed"]))
+        self.assertEqual(b"".join(download.streaming_content).decode().splitlines(), lines)
+
+    def test_streamed_feed_is_profiled_with_header(self):
+        self.client.login(username="staff", password="pass")
+        res = self.client.get(reverse("get_articles"), {"format": "xml"}, HTTP_X_PROFILE_TOKEN=self.token)
+        self.assertEqual(ET.fromstring(b"".join(res.streaming_content)).tag, "articles")
+
+        with open(profiling.profile_path(res["X-Profile"], "collapsed"), encoding="utf-8") as handle:
+            self.assertIn("iter_articles_xml", handle.read())
+
+    def test_token_must_be_valid_and_staff(self):
+        self.client.login(username="staff", password="pass")
+        self.assertNotIn("X-Profile", self.client.get(reverse("articles"), {profiling.PARAM: self.token + "x"}))
+        other_token = profiling.make_token(self.other)
+        self.assertNotIn("X-Profile", self.client.get(reverse("articles"), {profiling.PARAM: other_token}))
+        with override_settings(PROFILE_TOKEN_MAX_AGE=-1):
+            self.assertNotIn("X-Profile", self.client.get(reverse("articles"), {profiling.PARAM: self.token}))
+
+        self.client.login(username="other", password="pass")
+        self.assertNotIn("X-Profile", self.client.get(reverse("articles"), {profiling.PARAM: other_token}))
+        self.assertEqual(self.client.get(reverse("profile_list")).status_code, 302)
+        self.assertEqual(profiling.list_profiles(), [])
+
+    def test_download_rejects_unknown_names(self):
+        self.client.login(username="staff", password="pass")
+        self.assertEqual(self.client.get(reverse("profile_download", args=["..", "pstats"])).status_code, 404)
+        self.assertEqual(
+            self.client.get(reverse("profile_download", args=["20260101T000000-x-0123abcd", "json"])).status_code, 404
+        )
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.enterContext(self.settings(METRICS_DIR=self.dir.name))
+
+        self.pub = Publisher.objects.create(name="Daily")
+        self.editor = CustomUser.objects.create_user(username="ed", password="pass", role=CustomUser.EDITOR)
+        self.reader = CustomUser.objects.create_user(
+            username="r", password="pass", role=CustomUser.READER, email="r@example.com"
+        )
+        self.reader.subscribed_publishers.add(self.pub)
+        self.article = Article.objects.create(title="Pending", content="Body", publisher=self.pub)
+
+    def scrape(self):
+        res = self.client.get(reverse("metrics"))
+        self.assertEqual(res["Content-Type"], "text/plain; version=0.0.4")
+        samples = {}
+        for line in res.content.decode().splitlines():
+            if not line.startswith("#"):
+                sample, value = line.rsplit(" ", 1)
+                samples[sample] = float(value)
+        return samples
+
+    def test_request_metrics_by_route(self):
+        self.client.login(username="r", password="pass")
+        self.client.get(reverse("articles"))
+        self.client.get(reverse("articles"))
+        self.client.get("/no-such-page/")
+
+        samples = self.scrape()
+        self.assertEqual(samples['news_http_requests_total{method="GET",status="200",view="articles"}'], 2)
+        self.assertEqual(samples['news_http_requests_total{method="GET",status="404",view="unmatched"}'], 1)
+        self.assertEqual(samples['news_http_request_duration_seconds_count{view="articles"}'], 2)
+        self.assertEqual(samples['news_http_request_duration_seconds_bucket{view="articles",le="+Inf"}'], 2)
+        self.assertEqual(samples['news_http_request_queries_count{view="articles"}'], 2)
+        self.assertGreater(samples['news_http_request_queries_sum{view="articles"}'], 0)
+        self.assertEqual(samples['news_page_cache_events_total{event="misses"}'], 1)
+        self.assertEqual(samples['news_page_cache_events_total{event="hits"}'], 1)
+
+    def test_approval_pipeline_counters(self):
+        stub = HTTPStub()
+        self.addCleanup(stub.close)
+        client = SocialClient(StubAdapter(stub.url), backoff=0)
+        self.addCleanup(client.session.close)
+
+        self.client.login(username="ed", password="pass")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("approve_article", args=[self.article.pk]))
+        with mock.patch("news.notifications.get_client", return_value=client):
+            run_pending()
+
+        samples = self.scrape()
+        self.assertEqual(samples["news_articles_approved_total"], 1)
+        self.assertEqual(samples['news_emails_total{result="sent"}'], 1)
+        self.assertEqual(samples['news_social_posts_total{adapter="stub",result="published"}'], 1)
+        self.assertEqual(samples['news_social_requests_total{adapter="stub",event="attempts"}'], 1)
+        self.assertEqual(samples['news_social_request_duration_seconds_count{adapter="stub"}'], 1)
+        for kind in ("email_subscribers", "fanout_article", "post_to_x"):
+            self.assertEqual(samples[f'news_jobs_total{{kind="{kind}",result="done"}}'], 1)
+
+    def test_processes_are_summed(self):
+        metrics.JOBS.inc(kind="test", result="done")
+        pid = os.fork()
+        if pid == 0:
+            metrics.JOBS.inc(2, kind="test", result="done")
+            os._exit(0)
+        os.waitpid(pid, 0)
+        metrics.JOBS.inc(kind="test", result="done")
+
+        self.assertEqual(len(os.listdir(self.dir.name)), 2)
+        self.assertEqual(self.scrape()['news_jobs_total{kind="test",result="done"}'], 4)
+
+    def test_store_grows(self):
+        for i in range(2000):
+            metrics.JOBS.inc(i, kind=f"kind-{i}", result="done")
+
+        samples = self.scrape()
+        self.assertGreater(os.path.getsize(os.path.join(self.dir.name, f"metrics_{os.getpid()}.db")), 64 * 1024)
+        self.assertEqual(samples['news_jobs_total{kind="kind-1999",result="done"}'], 1999)
+
+
+ASYNC_VIEWS = {"articles": views.aarticles, "article_detail": views.aarticle_detail, "get_articles": views.aget_articles}
+
+
+class AsyncUrls:
+    # news.urls as served under ASGI (ASYNC_VIEWS=1).
+    urlpatterns = [
+        URLPattern(p.pattern, ASYNC_VIEWS.get(p.name, p.callback), p.default_args, p.name) for p in urls.urlpatterns
+    ]
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.pub = Publisher.objects.create(name="Daily")
+        self.journalist = CustomUser.objects.create_user(username="j", password="pass", role=CustomUser.JOURNALIST)
+        self.reader = CustomUser.objects.create_user(username="r", password="pass", role=CustomUser.READER)
+        self.reader.subscribed_publishers.add(self.pub)
+        for i in range(3):
+            Article.objects.create(
+                title=f"A{i} <&>", content="Body", publisher=self.pub, journalist=self.journalist, approved=True
+            )
+        self.pending = Article.objects.create(title="Pending", content="Body", publisher=self.pub)
+        run_pending()
+        self.article = Article.objects.filter(approved=True).first()
+
+        self.client.force_login(self.reader)
+        self.async_client.force_login(self.reader)
+
+    async def fetch(self, path, params=None, headers=None):
+        with override_settings(ROOT_URLCONF=AsyncUrls):
+            res = await self.async_client.get(path, params or {}, headers=headers)
+            if res.streaming:
+                res.body = b"".join([chunk async for chunk in res.streaming_content])
+            else:
+                res.body = res.content
+        return res
+
+    def sync_fetch(self, path, params=None):
+        res = self.client.get(path, params or {})
+        res.body = res.getvalue()
+        return res
+
+    async def test_same_responses_as_sync_views(self):
+        cursor = json.loads((await self.fetch(reverse("get_articles"), {"limit": "2"})).body)["next_cursor"]
+        requests = [
+            (reverse("articles"), {}),
+            (reverse("articles"), {"after": cursor}),
+            (reverse("article_detail", args=[self.article.pk]), {}),
+            (reverse("get_articles"), {}),
+            (reverse("get_articles"), {"limit": "2"}),
+            (reverse("get_articles"), {"cursor": cursor}),
+            (reverse("get_articles"), {"format": "xml"}),
+        ]
+        for path, params in requests:
+            await sync_to_async(clear_caches)()
+            expected = await sync_to_async(self.sync_fetch)(path, params)
+            await sync_to_async(clear_caches)()
+            res = await self.fetch(path, params)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.body, expected.body)
+
+        self.assertEqual(len(ET.fromstring(res.body)), 3)
+
+    async def test_feed_etag_and_cached_body(self):
+        first = await self.fetch(reverse("get_articles"))
+        self.assertTrue(first.streaming)
+
+        cached = await self.fetch(reverse("get_articles"))
+        self.assertFalse(cached.streaming)
+        self.assertEqual(cached.body, first.body)
+
+        res = await self.fetch(reverse("get_articles"), headers={"If-None-Match": first["ETag"]})
+        self.assertEqual(res.status_code, 304)
+
+    async def test_access_checks(self):
+        res = await self.fetch(reverse("article_detail", args=[self.pending.pk]))
+        self.assertEqual(res.status_code, 404)
+
+        await self.async_client.alogout()
+        for name in ("articles", "get_articles"):
+            res = await self.fetch(reverse(name))
+            self.assertEqual(res.status_code, 302)
+            self.assertTrue(res["Location"].startswith("/login/?next="))
+
+        await self.async_client.aforce_login(self.journalist)
+        res = await self.fetch(reverse("get_articles"))
+        self.assertEqual(res.status_code, 403)
+
+    async def test_bad_cursor(self):
+        res = await self.fetch(reverse("articles"), {"after": "nope"})
+        self.assertEqual(res.status_code, 400)
+        res = await self.fetch(reverse("get_articles"), {"cursor": "nope"})
+        self.assertEqual(res.status_code, 400)
+
+    @modify_settings(MIDDLEWARE={"prepend": "news.middleware.RequestTimingMiddleware"})
+    @override_settings(REQUEST_TIMING_SLOW_MS=60000)
+    async def test_middleware_sees_async_queries(self):
+        # The async ORM runs its queries through sync_to_async.
+        res = await self.fetch(reverse("articles"))
+        self.assertRegex(res["Server-Timing"], r'db;dur=[0-9.]+;desc="[1-9]\d* queries"')
+
+
+@override_settings(STREAM_HEARTBEAT=0.2)
+class ArticleStreamTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.enterContext(mock.patch.object(stream, "_hub", stream.Hub(5)))
+        self.pub = Publisher.objects.create(name="Daily")
+        self.other_pub = Publisher.objects.create(name="Other")
+        self.journalist = CustomUser.objects.create_user(username="j", password="pass", role=CustomUser.JOURNALIST)
+        self.editor = CustomUser.objects.create_user(username="ed", password="pass", role=CustomUser.EDITOR)
+        self.reader = CustomUser.objects.create_user(username="r", password="pass", role=CustomUser.READER)
+        self.reader.subscribed_publishers.add(self.pub)
+        self.reader.subscribed_journalists.add(self.journalist)
+        self.async_client.force_login(self.reader)
+
+    def approve(self, title, publisher=None, journalist=None):
+        article = Article.objects.create(title=title, content="Body", publisher=publisher, journalist=journalist)
+        with self.captureOnCommitCallbacks(execute=True):
+            article.approved = True
+            article.save()
+        return article
+
+    async def connect(self, headers=None):
+        res = await self.async_client.get(reverse("article_stream"), headers=headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res["Content-Type"], "text/event-stream")
+        events = aiter(res.streaming_content)
+        self.assertEqual(await anext(events), b"retry: 5000\n\n")
+        return events
+
+    def parse(self, chunk):
+        events = []
+        for block in chunk.decode().split("\n\n"):
+            if block:
+                events.append(dict(line.split(": ", 1) for line in block.split("\n")))
+        return events
+
+    async def test_pushes_subscribed_approvals(self):
+        events = await self.connect()
+        await sync_to_async(self.approve)("Elsewhere", publisher=self.other_pub)
+        await sync_to_async(self.approve)("Mine", publisher=self.pub)
+        await sync_to_async(self.approve)("By j", publisher=self.other_pub, journalist=self.journalist)
+
+        received = self.parse(await asyncio.wait_for(anext(events), 5))
+        self.assertEqual([event["event"] for event in received], ["article", "article"])
+        self.assertEqual([json.loads(event["data"])["title"] for event in received], ["Mine", "By j"])
+        self.assertEqual(received[1]["id"], f"{stream.get_hub().name}:3")
+
+        # Editing an approved article is not a new approval.
+        article = await Article.objects.aget(title="Mine")
+        article.title = "Mine, edited"
+        await sync_to_async(self.save_on_commit)(article)
+        self.assertEqual(await asyncio.wait_for(anext(events), 5), stream.PING)
+
+    async def test_waiting_stream_is_woken(self):
+        events = await self.connect()
+        pending = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.05)
+        await sync_to_async(self.approve)("Mine", publisher=self.pub)
+        self.assertIn(b"event: article", await asyncio.wait_for(pending, 5))
+
+    def save_on_commit(self, article):
+        with self.captureOnCommitCallbacks(execute=True):
+            article.save()
+
+    async def test_resumes_from_last_event_id(self):
+        events = await self.connect()
+        hub = stream.get_hub()
+        for title in ("A", "B", "C"):
+            await sync_to_async(self.approve)(title, publisher=self.pub)
+
+        events = await self.connect(headers={"Last-Event-ID": f"{hub.name}:1"})
+        received = self.parse(await asyncio.wait_for(anext(events), 5))
+        self.assertEqual([json.loads(event["data"])["title"] for event in received], ["B", "C"])
+
+    async def test_reset_when_events_are_lost(self):
+        await self.connect()
+        hub = stream.get_hub()
+        for i in range(7):
+            await sync_to_async(self.approve)(f"A{i}", publisher=self.pub)
+
+        # Event 1 has left the five-event buffer; "x" is another process.
+        for last_event_id in (f"{hub.name}:1", "x:1", f"{hub.name}:99"):
+            events = await self.connect(headers={"Last-Event-ID": last_event_id})
+            self.assertEqual(await anext(events), stream.RESET)
+
+        events = await self.connect(headers={"Last-Event-ID": f"{hub.name}:3"})
+        self.assertEqual(len(self.parse(await anext(events))), 4)
+
+    async def test_bulk_approval(self):
+        ids = []
+        for title in ("A", "B"):
+            article = await Article.objects.acreate(title=title, content="Body", publisher=self.pub)
+            ids.append(article.pk)
+        events = await self.connect()
+
+        def approve():
+            with self.captureOnCommitCallbacks(execute=True):
+                moderation.approve_articles(ids)
+
+        await sync_to_async(approve)()
+        received = self.parse(await asyncio.wait_for(anext(events), 5))
+        self.assertEqual([json.loads(event["data"])["id"] for event in received], ids)
+
+    async def test_access(self):
+        await self.async_client.aforce_login(self.editor)
+        res = await self.async_client.get(reverse("article_stream"))
+        self.assertEqual(res.status_code, 403)
+
+        await self.async_client.alogout()
+        res = await self.async_client.get(reverse("article_stream"))
+        self.assertEqual(res.status_code, 302)
+
+    def test_wsgi_is_refused(self):
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(reverse("article_stream")).status_code, 501)
+
+    def test_inactive_hub_skips_publishing(self):
+        with self.assertNumQueries(0):
+            stream.publish_approved([1])
+
+    def test_publish_from_thread_wakes_waiters(self):
+        hub = stream.get_hub()
+
+        async def wait():
+            return await hub.wait(hub.position, 5)
+
+        threading.Timer(0.05, hub.publish, [[(1, 2, "{}")]]).start()
+        self.assertTrue(async_to_sync(wait)())
+        self.assertFalse(async_to_sync(hub.wait)(hub.position, 0.01))
+
+    def call_app(self, cookie=None, query_string=b"", disconnect_after=2, host="testserver"):
+        """
+        Runs one GET of the stream through StreamApplication and returns
+        (messages sent, scopes passed on to the wrapped application).
+        """
+        # As the test client does, so the test transaction's connection
+        # stays open.
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+        passed = []
+
+        async def django_app(scope, receive, send):
+            passed.append(scope)
+
+        headers = [(b"host", host.encode())]
+        if cookie:
+            headers.append((b"cookie", cookie.encode()))
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": reverse("article_stream"),
+            "query_string": query_string,
+            "headers": headers,
+        }
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def receive():
+            while len(sent) < disconnect_after:
+                await asyncio.sleep(0.01)
+            return {"type": "http.disconnect"}
+
+        async_to_sync(stream.StreamApplication(django_app))(scope, receive, send)
+        return sent, passed
+
+    def test_application_serves_readers(self):
+        self.client.force_login(self.reader)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        sent, passed = self.call_app(cookie, b"last_event_id=x:1", disconnect_after=3)
+        self.assertEqual(passed, [])
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream"), sent[0]["headers"])
+        self.assertEqual([message["body"] for message in sent[1:]], [b"retry: 5000\n\n", stream.RESET])
+
+        # Everyone else is left to the view.
+        self.client.force_login(self.editor)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        for value in (cookie, None):
+            sent, passed = self.call_app(value)
+            self.assertEqual((sent, len(passed)), ([], 1))
+
+    def test_application_checks_the_host_and_counts_streams(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(self.settings(METRICS_DIR=directory))
+        self.client.force_login(self.reader)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+        # Left to Django, which refuses the host.
+        sent, passed = self.call_app(cookie, host="evil.example.com")
+        self.assertEqual((sent, len(passed)), ([], 1))
+
+        self.call_app(cookie)
+        samples = metrics.collect()
+        self.assertEqual(samples[("news_article_streams_total", (("event", "opened"),))], 1)
+        self.assertEqual(samples[("news_article_streams_total", (("event", "closed"),))], 1)
+        requests_key = ("news_http_requests_total", (("method", "GET"), ("status", "200"), ("view", "article_stream")))
+        self.assertEqual(samples[requests_key], 1)
+
+
+@override_settings(
+    REPLICA_DATABASES=["replica1", "replica2"],
+    DATABASE_ROUTERS=["news.replicas.ReplicaRouter"],
+    REPLICA_CHECK_INTERVAL=60,
+)
+class ReplicaRoutingTests(TransactionTestCase):
+    # Transactional: reads inside the atomic block of a TestCase would
+    # all go to the primary.
+
+    def setUp(self):
+        clear_caches()
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.enterContext(self.settings(METRICS_DIR=self.dir.name))
+        self.enterContext(mock.patch.dict(replicas._health, clear=True))
+        self.up = {"replica1": True, "replica2": True}
+        self.real_check = replicas.check_replica
+        self.check = self.enterContext(mock.patch.object(replicas, "check_replica", side_effect=self.up.get))
+
+    def request(self, method="GET", cookies=None, write=False):
+        """
+        Runs a request through ReplicaMiddleware and returns (response,
+        read aliases before and after the optional write).
+        """
+        reads = []
+
+        def view(request):
+            reads.append(router.db_for_read(Article))
+            reads.append(router.db_for_read(Publisher))
+            if write:
+                Publisher.objects.create(name="Daily")
+                reads.append(router.db_for_read(Article))
+            return HttpResponse()
+
+        request = RequestFactory().generic(method, "/")
+        request.COOKIES.update(cookies or {})
+        return ReplicaMiddleware(view)(request), reads
+
+    def test_reads_from_one_replica_until_the_request_writes(self):
+        res, reads = self.request(write=True)
+        self.assertIn(reads[0], self.up)
+        self.assertEqual(reads[1:], [reads[0], "default"])
+        self.assertEqual(res.cookies[replicas.PIN_COOKIE]["max-age"], 20)
+
+        res, reads = self.request()
+        self.assertIn(reads[0], self.up)
+        self.assertNotIn(replicas.PIN_COOKIE, res.cookies)
+
+    def test_pinned_and_unsafe_requests_use_the_primary(self):
+        res, reads = self.request(cookies={replicas.PIN_COOKIE: "1"})
+        self.assertEqual(reads, ["default", "default"])
+
+        res, reads = self.request("POST")
+        self.assertEqual(reads, ["default", "default"])
+        self.assertNotIn(replicas.PIN_COOKIE, res.cookies)
+
+        # Outside a request, and inside a transaction.
+        self.assertEqual(router.db_for_read(Article), "default")
+        with replicas.routed(replicas.RequestRouting(True)), transaction.atomic():
+            self.assertEqual(router.db_for_read(Article), "default")
+
+    def test_unhealthy_replicas_are_skipped(self):
+        self.up["replica1"] = False
+        for _ in range(5):
+            self.assertEqual(self.request()[1][0], "replica2")
+
+        self.up["replica2"] = False
+        replicas._health.clear()
+        self.assertEqual(self.request()[1][0], "default")
+        # Checked once per REPLICA_CHECK_INTERVAL.
+        self.request()
+        self.assertEqual(self.check.call_count, 4)
+
+    def test_cache_builds_read_from_the_primary(self):
+        routing = replicas.RequestRouting(True)
+        with replicas.routed(routing):
+            self.assertEqual(page_cache.get_or_build("k", lambda: router.db_for_read(Article)), "default")
+            self.assertIn(router.db_for_read(Article), self.up)
+
+            with replicas.primary():
+                Publisher.objects.create(name="Daily")
+        self.assertTrue(routing.wrote)
+
+    def test_writes_and_migrations_go_to_the_primary(self):
+        article = Article(title="A", content="Body")
+        article._state.db = "replica1"
+        self.assertEqual(router.db_for_write(Article, instance=article), "default")
+        self.assertFalse(router.allow_migrate("replica1", "news"))
+        self.assertTrue(router.allow_migrate("default", "news"))
+
+    def test_health_check(self):
+        self.assertTrue(self.real_check("default"))
+        with mock.patch.object(connections["default"], "cursor", side_effect=OperationalError("gone")):
+            with self.assertLogs("news.replicas", "WARNING"):
+                self.assertFalse(self.real_check("default"))
+        samples = metrics.collect()
+        self.assertEqual(samples[("news_db_replica_health_checks_total", (("alias", "default"), ("result", "healthy")))], 1)
+        self.assertEqual(samples[("news_db_replica_health_checks_total", (("alias", "default"), ("result", "unhealthy")))], 1)
+
+    def test_streamed_bodies_are_routed(self):
+        def chunks():
+            yield router.db_for_read(Article).encode()
+
+        async def achunks():
+            yield router.db_for_read(Article).encode()
+
+        res = ReplicaMiddleware(lambda request: StreamingHttpResponse(chunks()))(RequestFactory().get("/"))
+        self.assertIn(res.getvalue().decode(), self.up)
+
+        async def view(request):
+            return StreamingHttpResponse(achunks())
+
+        async def fetch():
+            res = await ReplicaMiddleware(view)(RequestFactory().get("/"))
+            return b"".join([chunk async for chunk in res])
+
+        self.assertIn(async_to_sync(fetch)().decode(), self.up)
+        self.assertEqual(router.db_for_read(Article), "default")
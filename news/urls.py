@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth import views as auth_views
 from django.urls import path
 
@@ -6,6 +7,8 @@ from .views import (
     register,
     review_articles,
     approve_article,
+    moderate_articles,
+    api_moderate_articles,
     editor_articles,
     editor_article_edit,
     editor_article_delete,
@@ -21,21 +24,38 @@ from .views import (
     journalist_newsletter_edit,
     journalist_newsletter_delete,
     get_articles,
+    article_stream,
     articles,
     article_detail,
+    article_search,
+    api_article_search,
     publisher_list,
     publisher_create,
+    prometheus_metrics,
+    profile_list,
+    profile_download,
+    aarticles,
+    aarticle_detail,
+    aget_articles,
 )
 
+# With ASYNC_VIEWS the busiest read paths run on the async ORM; under WSGI
+# the sync versions avoid starting an event loop per request.
+def _view(sync_view, async_view):
+    return async_view if settings.ASYNC_VIEWS else sync_view
+
+
 urlpatterns = [
     path("", home, name="home"),
     path("login/", auth_views.LoginView.as_view(template_name="news/login.html"), name="login"),
     path("logout/", auth_views.LogoutView.as_view(), name="logout"),
     path("register/", register, name="register"),
-    path("articles/", articles, name="articles"),
-    path("articles/<int:pk>/", article_detail, name="article_detail"),
+    path("articles/", _view(articles, aarticles), name="articles"),
+    path("articles/search/", article_search, name="article_search"),
+    path("articles/<int:pk>/", _view(article_detail, aarticle_detail), name="article_detail"),
     path("editor/articles/review/", review_articles, name="review_articles"),
     path("editor/articles/<int:pk>/approve/", approve_article, name="approve_article"),
+    path("editor/articles/moderate/", moderate_articles, name="moderate_articles"),
     path("editor/articles/", editor_articles, name="editor_articles"),
     path("editor/articles/<int:pk>/edit/", editor_article_edit, name="editor_article_edit"),
     path("editor/articles/<int:pk>/delete/", editor_article_delete, name="editor_article_delete"),
@@ -52,5 +72,11 @@ urlpatterns = [
     path("journalist/newsletters/<int:pk>/delete/", journalist_newsletter_delete, name="journalist_newsletter_delete"),
     path("publishers/", publisher_list, name="publisher_list"),
     path("publishers/new/", publisher_create, name="publisher_create"),
-    path("api/articles/", get_articles, name="get_articles"),
+    path("api/articles/", _view(get_articles, aget_articles), name="get_articles"),
+    path("api/articles/search/", api_article_search, name="api_article_search"),
+    path("api/articles/stream/", article_stream, name="article_stream"),
+    path("api/articles/moderate/", api_moderate_articles, name="api_moderate_articles"),
+    path("metrics", prometheus_metrics, name="metrics"),
+    path("profiles/", profile_list, name="profile_list"),
+    path("profiles/<str:name>.<str:kind>", profile_download, name="profile_download"),
 ]
\ No newline at end of file
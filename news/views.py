@@ -1,14 +1,46 @@
+import json
 import os
-import requests
 
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.core.mail import send_mail
-from django.db.models import Q
-from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
-from django.shortcuts import get_object_or_404, redirect, render
-
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseNotAllowed,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect
+from django.utils.http import parse_etags
+
+from . import metrics, page_cache, profiling, stream
+from .feed_cache import acached_body, acaching_stream, afeed_etag, cached_body, caching_stream, feed_etag
+from .delivery import new_delivery
+from .feeds import reader_feed
+from .forms import content_error
+from .jobs import enqueue
+from .middleware import render, render_to_string
 from .models import Article, CustomUser, Newsletter, Publisher
-from .serializers import serialize_article, serialize_articles_to_xml
+from .moderation import moderate
+from .pagination import InvalidCursor, after_cursor, apaginate_keyset, paginate_keyset, parse_limit
+from .search import search_articles
+from .serializers import (
+    afeed_rows,
+    aiter_articles_json,
+    aiter_articles_xml,
+    feed_rows,
+    iter_articles_json,
+    iter_articles_xml,
+    serialize_article_row,
+)
+from .subscriptions import areader_journalist_ids, areader_publisher_ids, reader_journalist_ids, reader_publisher_ids
 
 
 def home(request):
@@ -77,57 +109,79 @@ def is_reader_user(user):
     return user.is_authenticated and str(getattr(user, "role", "")).lower() == CustomUser.READER
 
 
-def post_to_x(article):
+async def _is_authenticated(user):
+    return user.is_authenticated
+
+
+# login_required for the async views. The check is a coroutine, so the
+# user is loaded with request.auser() and nothing hops to a thread.
+async_login_required = user_passes_test(_is_authenticated, login_url="/login/")
+
+
+@login_required(login_url="/login/")
+def review_articles(request):
     """
-    Posts article to X.
+    Lets editor review articles.
     """
-    token = os.environ.get("X_BEARER_TOKEN")
-    if not token:
-        return False
+    if not is_editor_user(request.user):
+        return HttpResponseForbidden("Forbidden")
 
-    url = "https://api.twitter.com/2/tweets"
-    headers = {"Authorization": f"Bearer {token}"}
+    qs = Article.objects.filter(approved=False, rejected=False).select_related("publisher", "journalist")
+    page = paginate_keyset(request, qs)
+    return render(request, "news/editor_article_list.html", {"articles": page.object_list, "page": page})
 
-    text = f"{article.title}\n\n{article.content}"
-    payload = {"text": text[:270]}
 
+def _moderation_ids(values):
     try:
-        r = requests.post(url, json=payload, headers=headers, timeout=10)
-        return r.status_code in (200, 201)
-    except Exception:
-        return False
+        ids = {int(value) for value in values}
+    except (TypeError, ValueError):
+        raise ValueError("Article ids must be numbers.") from None
 
+    if not ids:
+        raise ValueError("No articles selected.")
+    if len(ids) > settings.MODERATION_MAX_IDS:
+        raise ValueError(f"At most {settings.MODERATION_MAX_IDS} articles can be moderated at once.")
+    return ids
 
-def email_subscribers(article):
+
+@login_required(login_url="/login/")
+def moderate_articles(request):
     """
-    Sends email about new article.
+    Approves or rejects the articles ticked on the review page.
     """
-    subscribers = CustomUser.objects.filter(role=CustomUser.READER).filter(
-        Q(subscribed_publishers=article.publisher)
-        | Q(subscribed_journalists=article.journalist)
-    ).distinct()
-
-    emails = [u.email for u in subscribers if u.email]
-    if not emails:
-        return
+    if not is_editor_user(request.user):
+        return HttpResponseForbidden("Forbidden")
+    if request.method != "POST":
+        return redirect("review_articles")
 
-    subject = f"New Article Approved: {article.title}"
-    message = f"{article.title}\n\n{article.content}"
+    try:
+        moderate(request.POST.get("action"), _moderation_ids(request.POST.getlist("ids")), editor=request.user)
+    except ValueError as exc:
+        return HttpResponseBadRequest(str(exc))
 
-    from_email = os.environ.get("DEFAULT_FROM_EMAIL") or "webmaster@localhost"
-    send_mail(subject, message, from_email, emails, fail_silently=True)
+    return redirect("review_articles")
 
 
 @login_required(login_url="/login/")
-def review_articles(request):
+def api_moderate_articles(request):
     """
-    Lets editor review articles.
+    Approves or rejects articles given as {"action": ..., "ids": [...]}.
     """
     if not is_editor_user(request.user):
         return HttpResponseForbidden("Forbidden")
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
 
-    articles = Article.objects.filter(approved=False).order_by("-created_at")
-    return render(request, "news/editor_article_list.html", {"articles": articles})
+    try:
+        data = json.loads(request.body)
+        if not isinstance(data, dict) or not isinstance(data.get("ids"), list):
+            raise ValueError("Expected a JSON object with an ids list.")
+        action = data.get("action")
+        done = moderate(action, _moderation_ids(data["ids"]), editor=request.user)
+    except ValueError as exc:
+        return HttpResponseBadRequest(str(exc))
+
+    return JsonResponse({"action": action, "ids": sorted(done)})
 
 
 @login_required(login_url="/login/")
@@ -141,11 +195,16 @@ def approve_article(request, pk):
     article = get_object_or_404(Article, pk=pk)
 
     if request.method == "POST":
-        article.approved = True
-        article.save()
+        # Subscriber emails and the X post run in the job worker; queueing
+        # them in the same transaction means they exist iff the approval does.
+        with transaction.atomic():
+            article.approved = True
+            article.rejected = False
+            article.save()
 
-        email_subscribers(article)
-        post_to_x(article)
+            enqueue("email_subscribers", article_id=article.pk, delivery=new_delivery())
+            enqueue("post_to_x", article_id=article.pk)
+            transaction.on_commit(metrics.ARTICLES_APPROVED.inc)
 
         return redirect("review_articles")
 
@@ -171,14 +230,7 @@ def create_article(request):
         if publisher_id:
             publisher = get_object_or_404(Publisher, pk=publisher_id)
 
-        error = None
-        if not title:
-            error = "Title is required."
-        elif not content:
-            error = "Content is required."
-        elif not publisher:
-            error = "Publisher is required."
-
+        error = content_error(title, content, publisher, publisher_required=True)
         if error:
             return render(
                 request,
@@ -207,14 +259,135 @@ def create_article(request):
 
 @login_required(login_url="/login/")
 def articles(request):
-    qs = Article.objects.filter(approved=True).order_by("-created_at")
-    return render(request, "news/article_list.html", {"articles": qs})
+    # Public pages are the same for every user, so they are rendered
+    # without the request and cached whole.
+    def build():
+        page = paginate_keyset(request, Article.objects.filter(approved=True))
+        return render_to_string("news/article_list.html", {"articles": page.object_list, "page": page})
+
+    key = page_cache.article_list_key(request.GET.get("after"), request.GET.get("before"))
+    return HttpResponse(page_cache.get_or_build(key, build))
+
+
+@async_login_required
+async def aarticles(request):
+    """
+    ``articles`` on the async ORM, served under ASGI.
+    """
+
+    async def build():
+        page = await apaginate_keyset(request, Article.objects.filter(approved=True))
+        return render_to_string("news/article_list.html", {"articles": page.object_list, "page": page})
+
+    key = await page_cache.aarticle_list_key(request.GET.get("after"), request.GET.get("before"))
+    return HttpResponse(await page_cache.aget_or_build(key, build))
+
+
+def _search_params(request):
+    query = request.GET.get("q", "").strip()
+    limit = parse_limit(request.GET.get("limit"), settings.API_MAX_PAGE_SIZE) or settings.PAGE_SIZE
+    try:
+        offset = max(0, int(request.GET.get("offset") or 0))
+    except ValueError:
+        raise ValueError("Offset must be a number.") from None
+    return query, limit, offset
+
+
+@login_required(login_url="/login/")
+def article_search(request):
+    try:
+        query, limit, offset = _search_params(request)
+    except ValueError as exc:
+        return HttpResponseBadRequest(str(exc))
+
+    results = search_articles(query, limit + 1, offset)
+    return render(
+        request,
+        "news/article_search.html",
+        {
+            "query": query,
+            "results": results[:limit],
+            "previous_offset": max(0, offset - limit) if offset else None,
+            "next_offset": offset + limit if len(results) > limit else None,
+        },
+    )
+
+
+@login_required(login_url="/login/")
+def api_article_search(request):
+    try:
+        query, limit, offset = _search_params(request)
+    except ValueError as exc:
+        return HttpResponseBadRequest(str(exc))
+
+    results = search_articles(query, limit + 1, offset)
+    return JsonResponse(
+        {
+            "results": [
+                dict(serialize_article_row(row), score=row["score"], snippet=row["snippet"])
+                for row in results[:limit]
+            ],
+            "next_offset": offset + limit if len(results) > limit else None,
+        }
+    )
 
 
 @login_required(login_url="/login/")
 def article_detail(request, pk):
-    article = get_object_or_404(Article, pk=pk, approved=True)
-    return render(request, "news/article_detail.html", {"article": article})
+    def build():
+        article = get_object_or_404(Article.objects.select_related("publisher", "journalist"), pk=pk, approved=True)
+        return render_to_string("news/article_detail.html", {"article": article})
+
+    return HttpResponse(page_cache.get_or_build(page_cache.article_detail_key(pk), build))
+
+
+@async_login_required
+async def aarticle_detail(request, pk):
+    """
+    ``article_detail`` on the async ORM, served under ASGI.
+    """
+
+    async def build():
+        article = await aget_object_or_404(
+            Article.objects.select_related("publisher", "journalist"), pk=pk, approved=True
+        )
+        return render_to_string("news/article_detail.html", {"article": article})
+
+    return HttpResponse(await page_cache.aget_or_build(await page_cache.aarticle_detail_key(pk), build))
+
+
+def prometheus_metrics(request):
+    """
+    Exposes request, cache and approval pipeline metrics of every process
+    in Prometheus text format.
+    """
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4")
+
+
+@staff_member_required
+def profile_list(request):
+    """
+    Lists captured request profiles and gives the current user a token.
+    """
+    return render(
+        request,
+        "news/profile_list.html",
+        {
+            "profiles": profiling.list_profiles(),
+            "token": profiling.make_token(request.user),
+            "param": profiling.PARAM,
+            "header": profiling.HEADER,
+            "enabled": "news.middleware.ProfilingMiddleware" in settings.MIDDLEWARE,
+        },
+    )
+
+
+@staff_member_required
+def profile_download(request, name, kind):
+    path = profiling.profile_path(name, kind)
+    if path is None:
+        raise Http404("No such profile.")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=os.path.basename(path))
 
 
 @login_required(login_url="/login/")
@@ -224,24 +397,146 @@ def get_articles(request):
     if not is_reader_user(user):
         return HttpResponseForbidden("Forbidden")
 
-    publisher_ids = list(user.subscribed_publishers.values_list("id", flat=True))
-    journalist_ids = list(user.subscribed_journalists.values_list("id", flat=True))
+    fmt = request.GET.get("format", "json").lower()
+    cursor = request.GET.get("cursor")
 
-    qs = (
-        Article.objects.filter(approved=True)
-        .filter(Q(publisher_id__in=publisher_ids) | Q(journalist_id__in=journalist_ids))
-        .distinct()
-        .order_by("-created_at")
+    try:
+        limit = parse_limit(request.GET.get("limit"), settings.API_MAX_PAGE_SIZE)
+    except ValueError as exc:
+        return HttpResponseBadRequest(str(exc))
+
+    # Answer repeat polls from the version tokens alone; the article and
+    # feed tables are only read when the feed may have changed.
+    etag = feed_etag(
+        user.pk,
+        reader_publisher_ids(user.pk),
+        reader_journalist_ids(user.pk),
+        fmt,
+        cursor,
+        limit,
     )
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        return response
+
+    content_type = "application/xml" if fmt == "xml" else "application/json"
+    body = cached_body(etag)
+    if body is not None:
+        response = HttpResponse(body, content_type=content_type)
+        response["ETag"] = etag
+        return response
+
+    # The feed is materialized per reader when articles are approved, so
+    # this is one range scan of the reader's FeedEntry index.
+    qs = reader_feed(user.pk)
+
+    if fmt == "xml":
+        chunks = iter_articles_xml(feed_rows(qs, settings.API_CHUNK_SIZE))
+    else:
+        if cursor:
+            try:
+                qs = after_cursor(qs, cursor, id_field="article_id")
+            except InvalidCursor as exc:
+                return HttpResponseBadRequest(str(exc))
+
+        if limit is not None:
+            qs = qs[: limit + 1]
+
+        chunks = iter_articles_json(feed_rows(qs, settings.API_CHUNK_SIZE), limit)
+
+    response = StreamingHttpResponse(caching_stream(chunks, etag), content_type=content_type)
+    response["ETag"] = etag
+    return response
+
+
+@async_login_required
+async def aget_articles(request):
+    """
+    ``get_articles`` on the async ORM, served under ASGI. The body is an
+    async stream, so a slow client holds no thread while it downloads.
+    """
+    user = await request.auser()
+
+    if not is_reader_user(user):
+        return HttpResponseForbidden("Forbidden")
 
     fmt = request.GET.get("format", "json").lower()
+    cursor = request.GET.get("cursor")
+
+    try:
+        limit = parse_limit(request.GET.get("limit"), settings.API_MAX_PAGE_SIZE)
+    except ValueError as exc:
+        return HttpResponseBadRequest(str(exc))
+
+    etag = await afeed_etag(
+        user.pk,
+        await areader_publisher_ids(user.pk),
+        await areader_journalist_ids(user.pk),
+        fmt,
+        cursor,
+        limit,
+    )
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        return response
+
+    content_type = "application/xml" if fmt == "xml" else "application/json"
+    body = await acached_body(etag)
+    if body is not None:
+        response = HttpResponse(body, content_type=content_type)
+        response["ETag"] = etag
+        return response
+
+    qs = reader_feed(user.pk)
 
     if fmt == "xml":
-        xml = serialize_articles_to_xml(qs)
-        return HttpResponse(xml, content_type="application/xml")
+        chunks = aiter_articles_xml(afeed_rows(qs, settings.API_CHUNK_SIZE))
+    else:
+        if cursor:
+            try:
+                qs = after_cursor(qs, cursor, id_field="article_id")
+            except InvalidCursor as exc:
+                return HttpResponseBadRequest(str(exc))
+
+        if limit is not None:
+            qs = qs[: limit + 1]
+
+        chunks = aiter_articles_json(afeed_rows(qs, settings.API_CHUNK_SIZE), limit)
+
+    response = StreamingHttpResponse(acaching_stream(chunks, etag), content_type=content_type)
+    response["ETag"] = etag
+    return response
+
+
+@async_login_required
+async def article_stream(request):
+    """
+    Server-sent events for the reader's newly approved articles (see
+    news.stream). Resumes from the Last-Event-ID header, or the
+    last_event_id parameter on a first connection.
 
-    data = [serialize_article(a) for a in qs]
-    return JsonResponse({"articles": data})
+    news_project/asgi.py serves signed-in readers before they reach
+    Django, so there this view only turns other users away.
+    """
+    user = await request.auser()
+
+    if not is_reader_user(user):
+        return HttpResponseForbidden("Forbidden")
+
+    # A WSGI server would hold a thread for the life of the stream.
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse("The article stream is only served under ASGI.", status=501)
+
+    last_event_id = request.headers.get("Last-Event-ID") or request.GET.get("last_event_id")
+    response = StreamingHttpResponse(
+        stream.reader_events(user.pk, last_event_id), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # Stops nginx from buffering the events.
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 
 @login_required(login_url="/login/")
@@ -249,8 +544,8 @@ def journalist_articles(request):
     if not is_journalist_user(request.user):
         return HttpResponseForbidden("Forbidden")
 
-    qs = Article.objects.filter(journalist=request.user).order_by("-created_at")
-    return render(request, "news/journalist_article_list.html", {"articles": qs})
+    page = paginate_keyset(request, Article.objects.filter(journalist=request.user))
+    return render(request, "news/journalist_article_list.html", {"articles": page.object_list, "page": page})
 
 
 @login_required(login_url="/login/")
@@ -271,15 +566,14 @@ def journalist_article_edit(request, pk):
         if publisher_id:
             publisher = get_object_or_404(Publisher, pk=publisher_id)
 
-        if not title:
-            error = "Title is required."
-        elif not content:
-            error = "Content is required."
-        else:
+        error = content_error(title, content)
+        if error is None:
             article.title = title
             article.content = content
             article.publisher = publisher
             article.approved = False
+            # Back in the review queue.
+            article.rejected = False
             article.save()
             return redirect("journalist_articles")
 
@@ -309,8 +603,8 @@ def editor_articles(request):
     if not is_editor_user(request.user):
         return HttpResponseForbidden("Forbidden")
 
-    qs = Article.objects.all().order_by("-created_at")
-    return render(request, "news/editor_article_manage_list.html", {"articles": qs})
+    page = paginate_keyset(request, Article.objects.all())
+    return render(request, "news/editor_article_manage_list.html", {"articles": page.object_list, "page": page})
 
 
 @login_required(login_url="/login/")
@@ -332,11 +626,8 @@ def editor_article_edit(request, pk):
         if publisher_id:
             publisher = get_object_or_404(Publisher, pk=publisher_id)
 
-        if not title:
-            error = "Title is required."
-        elif not content:
-            error = "Content is required."
-        else:
+        error = content_error(title, content)
+        if error is None:
             article.title = title
             article.content = content
             article.publisher = publisher
@@ -370,8 +661,8 @@ def journalist_newsletters(request):
     if not is_journalist_user(request.user):
         return HttpResponseForbidden("Forbidden")
 
-    qs = Newsletter.objects.filter(journalist=request.user).order_by("-created_at")
-    return render(request, "news/journalist_newsletter_list.html", {"newsletters": qs})
+    page = paginate_keyset(request, Newsletter.objects.filter(journalist=request.user))
+    return render(request, "news/journalist_newsletter_list.html", {"newsletters": page.object_list, "page": page})
 
 
 @login_required(login_url="/login/")
@@ -391,11 +682,8 @@ def create_newsletter(request):
         if publisher_id:
             publisher = get_object_or_404(Publisher, pk=publisher_id)
 
-        if not title:
-            error = "Title is required."
-        elif not content:
-            error = "Content is required."
-        else:
+        error = content_error(title, content, publisher)
+        if not error:
             Newsletter.objects.create(
                 title=title,
                 content=content,
@@ -429,11 +717,8 @@ def journalist_newsletter_edit(request, pk):
         if publisher_id:
             publisher = get_object_or_404(Publisher, pk=publisher_id)
 
-        if not title:
-            error = "Title is required."
-        elif not content:
-            error = "Content is required."
-        else:
+        error = content_error(title, content)
+        if error is None:
             newsletter.title = title
             newsletter.content = content
             newsletter.publisher = publisher
@@ -470,8 +755,8 @@ def editor_newsletters(request):
     if not is_editor_user(request.user):
         return HttpResponseForbidden("Forbidden")
 
-    qs = Newsletter.objects.all().order_by("-created_at")
-    return render(request, "news/editor_newsletter_manage_list.html", {"newsletters": qs})
+    page = paginate_keyset(request, Newsletter.objects.all())
+    return render(request, "news/editor_newsletter_manage_list.html", {"newsletters": page.object_list, "page": page})
 
 
 @login_required(login_url="/login/")
@@ -492,11 +777,8 @@ def editor_newsletter_edit(request, pk):
         if publisher_id:
             publisher = get_object_or_404(Publisher, pk=publisher_id)
 
-        if not title:
-            error = "Title is required."
-        elif not content:
-            error = "Content is required."
-        else:
+        error = content_error(title, content)
+        if error is None:
             newsletter.title = title
             newsletter.content = content
             newsletter.publisher = publisher
@@ -13,4 +13,11 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'news_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up.
+from news.stream import StreamApplication  # noqa: E402
+
+# Readers' article streams are served without Django's per-request worker
+# thread; see news.stream.
+application = StreamApplication(django_application)
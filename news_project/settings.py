@@ -143,3 +143,259 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Background jobs
+# Approval side effects (subscriber emails, X posts) are queued in the Job
+# table and processed by `python manage.py run_jobs`.
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = int(os.getenv("JOB_RETRY_MAX_SECONDS", "600"))
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))
+
+
+# HTML list views are keyset-paginated on (created_at, id), PAGE_SIZE rows
+# per page.
+
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+
+
+# Reader API
+# /api/articles/ streams its JSON body, fetching API_CHUNK_SIZE rows per
+# database round trip. Clients page with ?limit= (capped at
+# API_MAX_PAGE_SIZE) and the returned next_cursor.
+
+API_CHUNK_SIZE = int(os.getenv("API_CHUNK_SIZE", "500"))
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "500"))
+
+
+# Subscriber emails
+# One message per subscriber, sent EMAIL_BATCH_SIZE at a time over one SMTP
+# connection and paced to EMAIL_RATE_LIMIT messages/second (0 = no limit).
+
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "100"))
+EMAIL_RATE_LIMIT = float(os.getenv("EMAIL_RATE_LIMIT", "0"))
+
+
+# Caches
+# The feed cache holds per-reader feed version tokens and rendered feed
+# bodies. Version bumps happen in web and job worker processes alike, so
+# in production point FEED_CACHE_REDIS_URL at a Redis server shared by
+# all of them. Without one each process has its own cache and sees the
+# others' changes once its version tokens expire, after
+# FEED_CACHE_VERSION_TIMEOUT seconds.
+
+FEED_CACHE_REDIS_URL = os.getenv("FEED_CACHE_REDIS_URL", "")
+
+# Rendered pages likewise: with PAGE_CACHE_REDIS_URL one process rebuilds
+# a page for all of them. Without it each process caches its own, and an
+# invalidation reaches the others once their pages expire.
+PAGE_CACHE_REDIS_URL = os.getenv("PAGE_CACHE_REDIS_URL", "")
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "subscriptions": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "subscriptions",
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    },
+    "pages": (
+        {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": PAGE_CACHE_REDIS_URL,
+        }
+        if PAGE_CACHE_REDIS_URL
+        else {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "pages",
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    ),
+    "feeds": (
+        {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": FEED_CACHE_REDIS_URL,
+        }
+        if FEED_CACHE_REDIS_URL
+        else {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "feeds",
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    ),
+}
+
+# Subscription id sets are invalidated via m2m_changed in the process that
+# makes the change; other processes see it after SUBSCRIPTION_CACHE_TIMEOUT
+# unless the alias points at a shared backend. Emails and feed fan-out
+# always read the subscription tables.
+SUBSCRIPTION_CACHE_ALIAS = "subscriptions"
+SUBSCRIPTION_CACHE_TIMEOUT = int(os.getenv("SUBSCRIPTION_CACHE_TIMEOUT", "300"))
+
+# Rendered /articles/ pages. Signals invalidate them on Article/Publisher
+# changes; one request per key rebuilds a miss while others wait up to
+# PAGE_CACHE_LOCK_TIMEOUT seconds for it.
+PAGE_CACHE_ALIAS = "pages"
+PAGE_CACHE_TIMEOUT = int(os.getenv("PAGE_CACHE_TIMEOUT", "300"))
+PAGE_CACHE_LOCK_TIMEOUT = int(os.getenv("PAGE_CACHE_LOCK_TIMEOUT", "10"))
+
+FEED_CACHE_ALIAS = "feeds"
+FEED_CACHE_TIMEOUT = int(os.getenv("FEED_CACHE_TIMEOUT", "300"))
+FEED_CACHE_VERSION_TIMEOUT = int(
+    os.getenv("FEED_CACHE_VERSION_TIMEOUT", "86400" if FEED_CACHE_REDIS_URL else "60")
+)
+FEED_CACHE_MAX_BYTES = int(os.getenv("FEED_CACHE_MAX_BYTES", str(1024 * 1024)))
+
+
+# Reader feeds
+# Approved articles are written into each subscriber's FeedEntry rows
+# (fan-out on write) in batches of FEED_BATCH_SIZE. Rebuild with
+# `manage.py backfill_feeds` / `manage.py repair_feeds`.
+
+FEED_BATCH_SIZE = int(os.getenv("FEED_BATCH_SIZE", "1000"))
+
+
+# Social publishing
+# Approved articles are posted through SOCIAL_ADAPTER over one pooled HTTP
+# session per process. Each post is tried SOCIAL_RETRIES more times on
+# connection errors, 429 and 5xx, with jittered exponential backoff from
+# SOCIAL_RETRY_BACKOFF seconds. After SOCIAL_BREAKER_THRESHOLD consecutive
+# failures the endpoint is not called for SOCIAL_BREAKER_RESET_SECONDS.
+
+SOCIAL_ADAPTER = os.getenv("SOCIAL_ADAPTER", "news.social.XAdapter")
+X_API_URL = os.getenv("X_API_URL", "https://api.twitter.com/2/tweets")
+SOCIAL_TIMEOUT = float(os.getenv("SOCIAL_TIMEOUT", "3"))
+SOCIAL_POOL_SIZE = int(os.getenv("SOCIAL_POOL_SIZE", "10"))
+SOCIAL_RETRIES = int(os.getenv("SOCIAL_RETRIES", "2"))
+SOCIAL_RETRY_BACKOFF = float(os.getenv("SOCIAL_RETRY_BACKOFF", "0.5"))
+SOCIAL_BREAKER_THRESHOLD = int(os.getenv("SOCIAL_BREAKER_THRESHOLD", "5"))
+SOCIAL_BREAKER_RESET_SECONDS = float(os.getenv("SOCIAL_BREAKER_RESET_SECONDS", "60"))
+
+
+# Search
+# /articles/search/ and /api/articles/search/ use an FTS5 table on SQLite
+# and a FULLTEXT index on MySQL. Signals keep it in sync with approved
+# articles; rebuild with `manage.py reindex_search`.
+
+SEARCH_SNIPPET_WORDS = int(os.getenv("SEARCH_SNIPPET_WORDS", "16"))
+# Results are ranked among the SEARCH_CANDIDATES newest matching articles.
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "1000"))
+
+
+# Moderation
+# Editors can approve or reject up to MODERATION_MAX_IDS articles in one
+# request; subscribers get one email per reader for the whole batch.
+
+MODERATION_MAX_IDS = int(os.getenv("MODERATION_MAX_IDS", "500"))
+
+
+# Request timing
+# With REQUEST_TIMING=1 every response carries a Server-Timing header
+# (query count, DB, template and view time), and requests slower than
+# REQUEST_TIMING_SLOW_MS are logged to "news.middleware" as JSON with
+# their REQUEST_TIMING_TOP_QUERIES most expensive statements.
+
+REQUEST_TIMING = os.getenv("REQUEST_TIMING", "0") == "1"
+REQUEST_TIMING_SLOW_MS = float(os.getenv("REQUEST_TIMING_SLOW_MS", "500"))
+REQUEST_TIMING_TOP_QUERIES = int(os.getenv("REQUEST_TIMING_TOP_QUERIES", "5"))
+
+if REQUEST_TIMING:
+    MIDDLEWARE.insert(0, "news.middleware.RequestTimingMiddleware")
+
+
+# Profiling
+# With PROFILING=1, staff can profile a single request by sending the
+# signed token shown on /profiles/ (valid PROFILE_TOKEN_MAX_AGE seconds)
+# as ?_profile= or X-Profile-Token. The view runs under cProfile and the
+# pstats and collapsed stacks land in PROFILE_DIR; the newest
+# PROFILE_KEEP are kept.
+
+PROFILING = os.getenv("PROFILING", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/news_profiles")
+PROFILE_TOKEN_MAX_AGE = int(os.getenv("PROFILE_TOKEN_MAX_AGE", "3600"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+
+if PROFILING:
+    MIDDLEWARE.append("news.middleware.ProfilingMiddleware")
+
+
+# Metrics
+# /metrics serves Prometheus text: per-route request counts, latency and
+# query histograms, page cache events and the approval pipeline (jobs,
+# emails, social posts). Each process writes its own memory-mapped file
+# under METRICS_DIR and /metrics sums them, so every web and job worker
+# must share the directory. Empty it when the service is deployed:
+# files of exited processes stay in the totals.
+
+METRICS = os.getenv("METRICS", "1") == "1"
+METRICS_DIR = os.getenv("METRICS_DIR", "/tmp/news_metrics")
+
+if METRICS:
+    MIDDLEWARE.insert(0, "news.middleware.MetricsMiddleware")
+
+
+# Async views
+# With ASYNC_VIEWS=1 /articles/, /articles/<pk>/ and /api/articles/ are
+# served by async views on the async ORM. Off by default, under ASGI too:
+# bench_servers measured them slower than the sync views. Keep it off
+# under WSGI.
+
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "0") == "1"
+
+
+# Article stream
+# /api/articles/stream/ (ASGI only) pushes newly approved articles to
+# subscribed readers as server-sent events. Each process keeps the last
+# STREAM_BUFFER_SIZE events for clients resuming with Last-Event-ID and
+# sends a keep-alive comment every STREAM_HEARTBEAT seconds.
+
+STREAM_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", "1000"))
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", "15"))
+
+
+# Benchmarks
+# bench_listings --compare drops and recreates the listing indexes, so it
+# only runs against the database aliases listed here, comma separated.
+# Never list one holding data you need.
+
+BENCH_SCRATCH_DATABASES = [alias for alias in os.getenv("BENCH_SCRATCH_DATABASES", "").split(",") if alias]
+
+
+# Read replicas
+# DATABASE_REPLICAS lists read replicas of the default database, comma
+# separated: MySQL hosts, or with USE_SQLITE=1 copies of the SQLite file,
+# opened read-only (to try it locally, cp /tmp/db.sqlite3 to
+# /tmp/replica.sqlite3 and recopy it to "replicate"). GET and HEAD
+# requests then read from a replica that passed its last health check,
+# run every REPLICA_CHECK_INTERVAL seconds, which on MySQL also fails
+# replicas more than REPLICA_MAX_LAG seconds behind; with none healthy
+# they read from the primary. A request that writes keeps its client on
+# the primary for REPLICA_PIN_SECONDS so it reads its own writes; keep
+# that above REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL. Pages and feeds
+# cached from a replica can be as far behind. Run the tests without
+# replicas.
+
+DATABASE_REPLICAS = [location for location in os.getenv("DATABASE_REPLICAS", "").split(",") if location]
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "5"))
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "10"))
+REPLICA_PIN_SECONDS = int(os.getenv("REPLICA_PIN_SECONDS", "20"))
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", "2"))
+
+REPLICA_DATABASES = []
+for number, location in enumerate(DATABASE_REPLICAS, 1):
+    alias = f"replica{number}"
+    if USE_SQLITE:
+        DATABASES[alias] = dict(DATABASES["default"], NAME=f"file:{location}?mode=ro")
+    else:
+        DATABASES[alias] = dict(DATABASES["default"], HOST=location, OPTIONS={"connect_timeout": REPLICA_CONNECT_TIMEOUT})
+    DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+    REPLICA_DATABASES.append(alias)
+
+if REPLICA_DATABASES:
+    DATABASE_ROUTERS = ["news.replicas.ReplicaRouter"]
+    MIDDLEWARE.insert(0, "news.middleware.ReplicaMiddleware")